@@ -2,8 +2,19 @@ from ._version import get_versions
 __version__ = get_versions()['version']
 del get_versions
 
-# Bring the plugins to the top level package
-from .kikitPlugins import Tooling, Framing, Text
-tooling = Tooling
-framing = Framing
-text = Text
+# Bring the plugins to the top level package. They are resolved lazily as they
+# import pcbnew, which is slow and unnecessary for the CLI.
+_PLUGINS = {
+    "Tooling": "Tooling",
+    "Framing": "Framing",
+    "Text": "Text",
+    "tooling": "Tooling",
+    "framing": "Framing",
+    "text": "Text"
+}
+
+def __getattr__(name):
+    if name in _PLUGINS:
+        from . import kikitPlugins
+        return getattr(kikitPlugins, _PLUGINS[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,249 @@
+"""
+A minimal ZIP writer tailored to the manufacturing archives. The members are
+compressed in a thread pool (zlib releases the GIL), while the archive itself
+is written sequentially in a single pass. Members that are already compressed
+(nested archives, PDFs, images) are stored as they are, as deflating them
+again costs time and saves nothing. Large members and archives with many
+members use the ZIP64 extensions like zipfile does.
+"""
+
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Deque, Iterable, Iterator, List, Optional, Tuple, Union
+from zipfile import ZipInfo
+
+DEFAULT_COMPRESSION_LEVEL = 6
+STORED_SUFFIXES = frozenset([".zip", ".pdf", ".png", ".jpg", ".jpeg", ".gz", ".7z"])
+
+_CHUNK_SIZE = 1 << 20
+
+_ZIP_STORED = 0
+_ZIP_DEFLATED = 8
+_VERSION = 20 # Version needed to extract deflate
+_ZIP64_VERSION = 45
+_UNIX = 3
+_FLAG_UTF8 = 0x800
+# Values from this limit on are stored in the ZIP64 records
+_ZIP64_LIMIT = 0xFFFFFFFF
+_ZIP64_ENTRIES_LIMIT = 0xFFFF
+_ZIP64_EXTRA = 0x0001
+
+_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+_CENTRAL_HEADER = struct.Struct("<4s4B4HL2L5H2L")
+_END_OF_CENTRAL_DIR = struct.Struct("<4s4H2LH")
+_END_OF_CENTRAL_DIR64 = struct.Struct("<4sQ2H2L4Q")
+_END_OF_CENTRAL_DIR64_LOCATOR = struct.Struct("<4sLQL")
+
+class ArchiveError(Exception):
+    pass
+
+@dataclass
+class ArchiveMember:
+    """
+    A member ready to be written: the data are already compressed by the
+    given method
+    """
+    name: str
+    method: int
+    crc: int
+    size: int
+    compressedSize: int
+    data: Iterable[bytes]
+    mtime: float
+    mode: int
+    offset: int = 0
+
+    @property
+    def flags(self) -> int:
+        return 0 if self.name.isascii() else _FLAG_UTF8
+
+    @property
+    def dosTime(self) -> Tuple[int, int]:
+        t = time.localtime(self.mtime)
+        year = min(max(t.tm_year, 1980), 2107)
+        return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+                ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+def _shouldStore(path: Union[str, Path], compressionLevel: int) -> bool:
+    return compressionLevel == 0 or Path(path).suffix.lower() in STORED_SUFFIXES
+
+def _compressMember(path: Union[str, Path], name: str,
+                    compressionLevel: int) -> ArchiveMember:
+    stat = os.stat(path)
+    store = _shouldStore(path, compressionLevel)
+    compressor = None if store else zlib.compressobj(compressionLevel,
+                                                     zlib.DEFLATED, -15)
+    crc, size, data = 0, 0, []
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(_CHUNK_SIZE)
+            if len(chunk) == 0:
+                break
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            data.append(chunk if compressor is None else compressor.compress(chunk))
+    if compressor is not None:
+        data.append(compressor.flush())
+    return ArchiveMember(name=name, method=_ZIP_STORED if store else _ZIP_DEFLATED,
+                         crc=crc, size=size,
+                         compressedSize=sum(len(x) for x in data), data=data,
+                         mtime=stat.st_mtime, mode=stat.st_mode)
+
+def bytesMember(name: str, content: bytes,
+                compressionLevel: int=DEFAULT_COMPRESSION_LEVEL) -> ArchiveMember:
+    """
+    Make a member from data in memory.
+    """
+    data = content
+    if compressionLevel > 0:
+        compressor = zlib.compressobj(compressionLevel, zlib.DEFLATED, -15)
+        data = compressor.compress(content) + compressor.flush()
+    return ArchiveMember(name=name,
+                         method=_ZIP_DEFLATED if compressionLevel > 0 else _ZIP_STORED,
+                         crc=zlib.crc32(content), size=len(content),
+                         compressedSize=len(data), data=[data],
+                         mtime=time.time(), mode=0o100644)
+
+def copiedMember(archivePath: Union[str, Path], info: ZipInfo,
+                 name: Optional[str]=None) -> ArchiveMember:
+    """
+    Make a member copied from an existing archive without recompressing it.
+    The data are read only once the member is written.
+    """
+    if info.flag_bits & 0x1:
+        raise ArchiveError(f"Cannot copy encrypted member {info.filename}")
+
+    def data() -> Iterator[bytes]:
+        with open(archivePath, "rb") as f:
+            f.seek(info.header_offset)
+            header = _LOCAL_HEADER.unpack(f.read(_LOCAL_HEADER.size))
+            if header[0] != b"PK\003\004":
+                raise ArchiveError(f"Invalid local header of {info.filename} in {archivePath}")
+            nameLength, extraLength = header[-2:]
+            f.seek(nameLength + extraLength, os.SEEK_CUR)
+            remaining = info.compress_size
+            while remaining > 0:
+                chunk = f.read(min(_CHUNK_SIZE, remaining))
+                if len(chunk) == 0:
+                    raise ArchiveError(f"Truncated member {info.filename} in {archivePath}")
+                remaining -= len(chunk)
+                yield chunk
+
+    return ArchiveMember(name=name if name is not None else info.filename,
+                         method=info.compress_type, crc=info.CRC, size=info.file_size,
+                         compressedSize=info.compress_size, data=data(),
+                         mtime=time.mktime(info.date_time + (0, 0, -1)),
+                         mode=info.external_attr >> 16)
+
+def _zip64Extra(values: List[int]) -> bytes:
+    if len(values) == 0:
+        return b""
+    return struct.pack(f"<2H{len(values)}Q", _ZIP64_EXTRA, 8 * len(values), *values)
+
+def _writeMember(out: BinaryIO, member: ArchiveMember) -> None:
+    member.offset = out.tell()
+    name = member.name.encode("utf-8")
+    dosTime, dosDate = member.dosTime
+    # We know the sizes in advance, so the local header needs ZIP64 only when
+    # they overflow
+    zip64 = max(member.size, member.compressedSize) >= _ZIP64_LIMIT
+    extra = _zip64Extra([member.size, member.compressedSize] if zip64 else [])
+    out.write(_LOCAL_HEADER.pack(b"PK\003\004",
+        _ZIP64_VERSION if zip64 else _VERSION, 0, member.flags,
+        member.method, dosTime, dosDate, member.crc,
+        0xFFFFFFFF if zip64 else member.compressedSize,
+        0xFFFFFFFF if zip64 else member.size, len(name), len(extra)))
+    out.write(name)
+    out.write(extra)
+    for chunk in member.data:
+        out.write(chunk)
+    # Release the memory as soon as possible, only metadata are needed for
+    # the central directory
+    member.data = []
+
+def _writeCentralDirectory(out: BinaryIO, members: List[ArchiveMember]) -> None:
+    start = out.tell()
+    for member in members:
+        name = member.name.encode("utf-8")
+        dosTime, dosDate = member.dosTime
+        # Only the overflowing values go to the ZIP64 extra field, in this
+        # order
+        fields = [member.size, member.compressedSize, member.offset]
+        overflowing = [x for x in fields if x >= _ZIP64_LIMIT]
+        size, compressedSize, offset = [0xFFFFFFFF if x >= _ZIP64_LIMIT else x
+                                        for x in fields]
+        extra = _zip64Extra(overflowing)
+        version = _ZIP64_VERSION if len(overflowing) > 0 else _VERSION
+        out.write(_CENTRAL_HEADER.pack(b"PK\001\002", version, _UNIX, version,
+            0, member.flags, member.method, dosTime, dosDate, member.crc,
+            compressedSize, size, len(name), len(extra), 0, 0, 0,
+            (member.mode & 0xFFFF) << 16, offset))
+        out.write(name)
+        out.write(extra)
+    end = out.tell()
+    count, size = len(members), end - start
+    if count >= _ZIP64_ENTRIES_LIMIT or max(size, start) >= _ZIP64_LIMIT:
+        out.write(_END_OF_CENTRAL_DIR64.pack(b"PK\006\006",
+            _END_OF_CENTRAL_DIR64.size - 12, _ZIP64_VERSION, _ZIP64_VERSION,
+            0, 0, count, count, size, start))
+        out.write(_END_OF_CENTRAL_DIR64_LOCATOR.pack(b"PK\006\007", 0, end, 1))
+        count = min(count, 0xFFFF)
+        size = min(size, 0xFFFFFFFF)
+        start = min(start, 0xFFFFFFFF)
+    out.write(_END_OF_CENTRAL_DIR.pack(b"PK\005\006", 0, 0, count, count,
+        size, start, 0))
+
+def writeMembers(archivePath: Union[str, Path],
+                 members: Iterable[ArchiveMember]) -> None:
+    """
+    Write a ZIP archive with given prepared members in the given order.
+    """
+    written: List[ArchiveMember] = []
+    with open(archivePath, "wb") as out:
+        for member in members:
+            _writeMember(out, member)
+            written.append(member)
+        _writeCentralDirectory(out, written)
+
+def writeArchive(archivePath: Union[str, Path],
+                 members: Iterable[Tuple[Union[str, Path], str]],
+                 compressionLevel: int=DEFAULT_COMPRESSION_LEVEL,
+                 workers: Optional[int]=None) -> None:
+    """
+    Write a ZIP archive with given members - pairs (file path, name in the
+    archive). The members are written in the given order. An existing archive
+    is replaced; the archive appears only once it is complete.
+    """
+    if not 0 <= compressionLevel <= 9:
+        raise ArchiveError(f"Invalid compression level {compressionLevel}")
+    workers = workers if workers is not None else (os.cpu_count() or 1)
+    # Bound the number of compressed members held in memory
+    window = 2 * workers
+
+    archivePath = Path(archivePath)
+    tmpPath = archivePath.parent / (archivePath.name + ".tmp")
+    written: List[ArchiveMember] = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor, \
+             open(tmpPath, "wb") as out:
+            pending: Deque[Future] = deque()
+            for path, name in members:
+                pending.append(executor.submit(_compressMember, path,
+                    name.replace(os.sep, "/"), compressionLevel))
+                if len(pending) >= window:
+                    written.append(pending.popleft().result())
+                    _writeMember(out, written[-1])
+            while len(pending) > 0:
+                written.append(pending.popleft().result())
+                _writeMember(out, written[-1])
+            _writeCentralDirectory(out, written)
+        os.replace(tmpPath, archivePath)
+    finally:
+        if tmpPath.exists():
+            tmpPath.unlink()
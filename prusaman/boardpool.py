@@ -0,0 +1,79 @@
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Tuple
+
+import pcbnew # type: ignore
+
+from .footprints import FootprintTable
+from .util import StrPath
+
+BoardKey = Tuple[str, int, int] # Path, mtime, size
+
+class BoardPool:
+    """
+    Per-build pool of loaded boards. Loading a board is expensive, so the
+    stages share a single read-only instance per file. The instance is keyed by
+    the path and the file modification time, so a rewritten file is loaded
+    again.
+
+    Stages that modify the board have to explicitly ask for a private copy via
+    checkout. KiCAD doesn't offer an API to clone a board, so the copy is a
+    fresh load of the file.
+    """
+    def __init__(self) -> None:
+        self._boards: Dict[BoardKey, pcbnew.BOARD] = {}
+        self._footprints: Dict[BoardKey, FootprintTable] = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    @staticmethod
+    def _key(path: StrPath) -> BoardKey:
+        resolved = Path(path).resolve()
+        stat = os.stat(resolved)
+        return str(resolved), stat.st_mtime_ns, stat.st_size
+
+    def _load(self, path: str) -> pcbnew.BOARD:
+        self.loads += 1
+        return pcbnew.LoadBoard(path)
+
+    def get(self, path: StrPath) -> pcbnew.BOARD:
+        """
+        Return a shared instance of the board. The caller must not modify it.
+        """
+        key = self._key(path)
+        with self._lock:
+            board = self._boards.get(key)
+            if board is None:
+                # Drop stale versions of the same file
+                for k in [k for k in self._boards.keys() if k[0] == key[0]]:
+                    del self._boards[k]
+                    self._footprints.pop(k, None)
+                board = self._load(key[0])
+                self._boards[key] = board
+            return board
+
+    def footprints(self, path: StrPath) -> FootprintTable:
+        """
+        Return a snapshot of footprints of the shared instance of the board.
+        """
+        board = self.get(path)
+        key = self._key(path)
+        with self._lock:
+            table = self._footprints.get(key)
+            if table is None:
+                table = FootprintTable.fromBoard(board)
+                self._footprints[key] = table
+            return table
+
+    def checkout(self, path: StrPath) -> pcbnew.BOARD:
+        """
+        Return a private instance of the board that the caller can modify.
+        """
+        with self._lock:
+            return self._load(str(Path(path).resolve()))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._boards = {}
+            self._footprints = {}
@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple, Union
+
+from .util import StrPath
+
+LogRecord = Tuple[str, str, str] # Severity, tag, message
+
+DEFAULT_CACHE_SIZE = 2 * 1024 ** 3
+
+class Fingerprint:
+    """
+    Incrementally built content hash of stage inputs. Every input is named, so
+    e.g., swapping two files yields a different fingerprint. Files are named by
+    their path relative to root, files outside of it by their absolute path.
+    """
+    def __init__(self, root: Optional[StrPath]=None) -> None:
+        self._hash = hashlib.sha256()
+        self._root = None if root is None else Path(root).resolve()
+
+    def _fileName(self, path: StrPath) -> str:
+        path = Path(path).resolve()
+        if self._root is not None:
+            try:
+                return path.relative_to(self._root).as_posix()
+            except ValueError:
+                pass
+        return path.as_posix()
+
+    def _add(self, name: str, data: bytes) -> None:
+        encodedName = name.encode("utf-8")
+        self._hash.update(len(encodedName).to_bytes(8, "little"))
+        self._hash.update(encodedName)
+        self._hash.update(len(data).to_bytes(8, "little"))
+        self._hash.update(data)
+
+    def addText(self, name: str, text: str) -> Fingerprint:
+        self._add(name, text.encode("utf-8"))
+        return self
+
+    def addFile(self, path: StrPath) -> Fingerprint:
+        """
+        Add file content. A missing file is also a valid input state.
+        """
+        try:
+            with open(path, "rb") as f:
+                self._add(f"file:{self._fileName(path)}", f.read())
+        except FileNotFoundError:
+            self._add(f"missing:{self._fileName(path)}", b"")
+        return self
+
+    def addFiles(self, paths: Iterable[StrPath]) -> Fingerprint:
+        for p in paths:
+            self.addFile(p)
+        return self
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
+class CacheEntry:
+    def __init__(self, path: Path) -> None:
+        self._path = path
+
+    @property
+    def log(self) -> List[LogRecord]:
+        with open(self._path / "meta.json") as f:
+            return [tuple(x) for x in json.load(f)["log"]]
+
+    def readText(self, name: str) -> str:
+        """
+        Read a single cached file
+        """
+        with open(self._path / "files" / name, encoding="utf-8") as f:
+            return f.read()
+
+    def restore(self, target: StrPath) -> None:
+        """
+        Copy the cached files into the target directory
+        """
+        files = self._path / "files"
+        for root, _, names in os.walk(files):
+            for name in names:
+                source = Path(root) / name
+                destination = Path(target) / source.relative_to(files)
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(source, destination)
+
+
+class BuildCache:
+    """
+    Content-addressed store of stage outputs. Entries are keyed by the stage
+    input fingerprint, when the store grows over the size limit, the least
+    recently used entries are evicted.
+    """
+    def __init__(self, path: Union[None, Path, str]=None,
+                 sizeLimit: int=DEFAULT_CACHE_SIZE) -> None:
+        self._path = self._defaultPath() if path is None else Path(path)
+        self._sizeLimit = sizeLimit
+        self._path.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def _defaultPath() -> Path:
+        return Path.home() / ".prusaman" / "cache"
+
+    def _entryPath(self, key: str) -> Path:
+        return self._path / key[:2] / key
+
+    def lookup(self, key: str) -> Optional[CacheEntry]:
+        path = self._entryPath(key)
+        meta = path / "meta.json"
+        if not meta.exists():
+            return None
+        # The modification time of the metadata tracks the last use
+        try:
+            os.utime(meta)
+        except OSError:
+            return None
+        return CacheEntry(path)
+
+    def store(self, key: str, basePath: StrPath, files: Iterable[StrPath],
+              log: List[LogRecord]) -> None:
+        """
+        Store files (relative to basePath) and the log of the stage under given
+        key.
+        """
+        target = self._entryPath(key)
+        if target.exists():
+            return
+        # Build the entry aside and atomically move it into place, so parallel
+        # builds never observe half-written entries.
+        tmp = self._path / "tmp" / uuid.uuid4().hex
+        size = 0
+        try:
+            for f in files:
+                destination = tmp / "files" / os.path.relpath(f, basePath)
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(f, destination)
+                size += os.path.getsize(f)
+            tmp.mkdir(parents=True, exist_ok=True)
+            with open(tmp / "meta.json", "w") as f:
+                json.dump({"size": size, "created": time.time(), "log": log}, f)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.replace(tmp, target)
+            except OSError:
+                # Somebody else stored the same entry in the meantime
+                pass
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Remove the least recently used entries until the cache fits into the
+        size limit.
+        """
+        entries = []
+        for meta in self._path.glob("??/*/meta.json"):
+            try:
+                with open(meta) as f:
+                    size = json.load(f)["size"]
+                entries.append((meta.stat().st_mtime, size, meta.parent))
+            except (OSError, ValueError, KeyError):
+                continue
+        total = sum(x[1] for x in entries)
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self._sizeLimit:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self) -> None:
+        shutil.rmtree(self._path, ignore_errors=True)
+        self._path.mkdir(parents=True, exist_ok=True)
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from kikit.eeschema_v6 import (SchematicError, Symbol,  # type: ignore
+                               extractSymbol, extractSymbolInstance,
+                               extractSymbolInstanceV6, getProperty,
+                               getReference, getUuid, isPath, isSheet,
+                               isSymbol, isSymbolInstances, isUuid)
+from kikit.sexpr import SExpr, parseSexprF # type: ignore
+
+from .bom import BomFilter
+from .schema import Schema
+from .util import splitOn
+
+@dataclass
+class ComponentModel:
+    """
+    Components of a schematic hierarchy extracted once and shared by all the
+    consumers of a build. The model is picklable, so it can be shipped to
+    worker processes.
+    """
+    schema: Schema
+    symbols: List[Symbol]
+    sheetFiles: List[Path]
+    assembly: List[Symbol] = field(default_factory=list)
+    sourcing: List[Symbol] = field(default_factory=list)
+    unannotated: Dict[str, int] = field(default_factory=dict)
+    invalidAnnotation: List[str] = field(default_factory=list)
+    _fields: Dict[str, Dict[str, str]] = field(default_factory=dict, repr=False)
+
+    @staticmethod
+    def fromFile(path: Union[str, Path], bomFilter: BomFilter) -> ComponentModel:
+        crawler = _HierarchyCrawler()
+        model = ComponentModel(
+            schema=crawler.schema(str(path)),
+            symbols=crawler.components(str(path)),
+            sheetFiles=crawler.files)
+        model._index(bomFilter)
+        return model
+
+    def _index(self, bomFilter: BomFilter) -> None:
+        self._fields = {
+            s.path: {k.lower(): v for k, v in s.properties.items()}
+            for s in self.symbols
+        }
+        self.assembly = [s for s in self.symbols if bomFilter.assemblyFilter(s)]
+        self.sourcing = [s for s in self.symbols if bomFilter.sourcingFilter(s)]
+
+        for s in self.symbols:
+            ref = getReference(s)
+            if "?" in ref:
+                self.unannotated[ref] = self.unannotated.get(ref, 0) + 1
+                continue
+            _, num = splitOn(ref, lambda x: not x.isdigit())
+            if not num.isdigit():
+                self.invalidAnnotation.append(ref)
+
+    def field(self, symbol: Symbol, name: str) -> Optional[str]:
+        """
+        Return field of the symbol, the name is case insensitive.
+        """
+        return self._fields[symbol.path].get(name.lower(), None)
+
+    @property
+    def isAnnotated(self) -> bool:
+        return len(self.unannotated) == 0 and len(self.invalidAnnotation) == 0
+
+
+@dataclass
+class _Sheet:
+    """
+    The parts of a sheet file the component extraction needs. The items keep
+    the file order, either symbols or (file, uuid) of subsheets.
+    """
+    uuid: Optional[str]
+    items: List[Union[SExpr, Tuple[str, str]]]
+    symbolInstances: List[SExpr]
+
+class _HierarchyCrawler:
+    """
+    Extracts components of a schematic hierarchy the same way as
+    kikit.eeschema_v6.extractComponents, however, it parses every sheet file
+    only once even if the sheet is instantiated multiple times. Only the
+    symbols and subsheets of a parsed file are kept, not its whole AST.
+    """
+    def __init__(self) -> None:
+        self._sheets: Dict[str, _Sheet] = {}
+        self.files: List[Path] = []
+        self._root: Optional[SExpr] = None
+
+    def _load(self, filename: str) -> _Sheet:
+        key = os.path.abspath(filename)
+        sheet = self._sheets.get(key)
+        if sheet is not None:
+            return sheet
+        with open(filename, encoding="utf-8") as f:
+            ast = parseSexprF(f)
+        if len(self._sheets) == 0:
+            self._root = ast
+        sheet = _Sheet(uuid=None, items=[], symbolInstances=[])
+        dirname = os.path.dirname(filename)
+        for item in ast.items:
+            if isUuid(item) and sheet.uuid is None:
+                sheet.uuid = item.items[1].value
+            elif isSymbol(item):
+                sheet.items.append(item)
+            elif isSheet(item):
+                f = getProperty(item, "Sheet file")
+                if f is None:
+                    # v7 format
+                    f = getProperty(item, "Sheetfile")
+                if f is None:
+                    raise SchematicError("Invalid format - no Sheet file")
+                if len(dirname) > 0:
+                    f = dirname + "/" + f
+                sheet.items.append((f, getUuid(item)))
+            elif isSymbolInstances(item):
+                sheet.symbolInstances += [p for p in item.items if isPath(p)]
+        self._sheets[key] = sheet
+        self.files.append(Path(key))
+        return sheet
+
+    def schema(self, filename: str) -> Schema:
+        """
+        Return the title block of the root sheet. It has to be called first.
+        """
+        self._load(filename)
+        assert self._root is not None
+        schema = Schema.fromAst(self._root)
+        self._root = None
+        return schema
+
+    def _collect(self, filename: str, path: Optional[str]) -> Tuple[List[Symbol], list]:
+        isRoot = path is None
+        sheet = self._load(filename)
+        if path is None:
+            path = "/" + sheet.uuid
+        symbols, instances = [], []
+        for item in sheet.items:
+            if isinstance(item, tuple):
+                f, uuid = item
+                s, i = self._collect(f, path + "/" + uuid)
+                symbols += s
+                instances += i
+                continue
+            symbols.append(extractSymbol(item, path))
+            instance = extractSymbolInstance(item, path)
+            if instance is not None:
+                instances.append(instance)
+        # v6 contains symbol instances in the top-level sheet
+        if isRoot:
+            instances += [extractSymbolInstanceV6(p, path) for p in sheet.symbolInstances]
+        return symbols, instances
+
+    def components(self, filename: str) -> List[Symbol]:
+        symbols, instances = self._collect(filename, None)
+        symbolsDict = {x.path: x for x in symbols}
+
+        assert len(symbols) == len(instances)
+
+        # Every symbol is extracted for each instance path, so we can modify
+        # it without copying
+        components = []
+        for inst in instances:
+            s = symbolsDict[inst.symbol_path]
+            if inst.reference is not None:
+                s.properties["Reference"] = inst.reference
+            if inst.value is not None:
+                s.properties["Value"] = inst.value
+            if inst.footprint is not None:
+                s.properties["Footprint"] = inst.footprint
+            if inst.unit is not None:
+                s.unit = inst.unit
+            components.append(s)
+        return components
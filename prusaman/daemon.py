@@ -0,0 +1,361 @@
+"""
+Prusaman daemon keeps a pool of worker processes with pcbnew, KiKit and
+shapely already imported, so the builds requested by the clients do not pay
+the startup cost. The daemon listens on a Unix socket and speaks a simple
+protocol of JSON objects, one per line:
+
+- the client sends a request: {"command": ..., "args": {...}},
+- the daemon streams the reporter messages: {"type": "message", "severity":
+  ..., "tag": ..., "message": ...},
+- the daemon forwards prompts: {"type": "prompt", "tag": ..., "message": ...}
+  to which the client replies {"answer": true/false},
+- the daemon finishes with {"type": "result", "status": "ok"|"failed"|"crashed",
+  "message": ..., "traceback": ...}.
+"""
+
+import json
+import multiprocessing
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import traceback
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, Optional
+
+from .util import StrPath, locatePythonInterpreter
+
+DEFAULT_SOCKET = Path.home() / ".prusaman" / "daemon.sock"
+DEFAULT_WORKERS = 2
+DEFAULT_RECYCLE = 10 # Requests served by a worker before it is restarted
+
+# How often the daemon checks that the worker serving a request is alive
+POLL_INTERVAL = 1
+
+Request = Dict[str, Any]
+Result = Dict[str, Any]
+
+def daemonSupported() -> bool:
+    return hasattr(socket, "AF_UNIX")
+
+def _send(stream: BinaryIO, message: Dict[str, Any]) -> None:
+    stream.write((json.dumps(message) + "\n").encode("utf-8"))
+    stream.flush()
+
+def _receive(stream: BinaryIO) -> Optional[Dict[str, Any]]:
+    line = stream.readline()
+    if len(line) == 0:
+        return None
+    return json.loads(line.decode("utf-8"))
+
+
+# The worker process part. The heavy modules are imported only here, so the
+# client can stay lightweight.
+
+# The fake KiCAD application has to outlive the requests served by the worker
+_workerApp = None
+
+def _initWorker() -> None:
+    global _workerApp
+    import pcbnew # type: ignore
+    import shapely.geometry # type: ignore
+    import kikit.panelize # type: ignore
+
+    from . import manugenerator, sync3d
+    from .pcbnew_common import fakeKiCADGui
+
+    _workerApp = fakeKiCADGui()
+
+def _makeQueueReporter(messages: Any, answers: Any, defaultAnswer: Optional[bool]):
+    from .ui import StdReporter
+
+    class QueueReporter(StdReporter):
+        """
+        Reporter forwarding everything to the client. The client takes care of
+        filtering and formatting.
+        """
+        def prompt(self, tag: str, message: str) -> bool:
+            if self._defAnswer is not None:
+                return self._defAnswer
+            messages.put(("prompt", tag, message))
+            return answers.get()
+
+        def _print(self, header: str, tag: str, message: str) -> None:
+            messages.put(("message", header.lower(), tag, message))
+
+    return QueueReporter(reportWarnings=True, reportInfo=True,
+                         defaultAnswer=defaultAnswer)
+
+def _serveRequest(command: str, args: Dict[str, Any], messages: Any,
+                  answers: Any) -> None:
+    """
+    Serve a single request in a worker process. The outcome is passed to the
+    daemon via the message queue as the last message.
+    """
+    from .manugenerator import BoardError
+    from .cache import BuildCache
+    from .sync3d import synchronizeProject3D
+    from .ui import buildProject, failedDir
+
+    messages.put(("started", os.getpid()))
+    result: Result = {"status": "ok", "message": ""}
+    try:
+        if command == "make":
+            reporter = _makeQueueReporter(messages, answers, args["defaultAnswer"])
+            try:
+                buildProject(args["source"], args["outputdir"],
+                             force=args["force"], werror=args["werror"],
+                             reporter=reporter,
+                             cache=None if args["noCache"] else BuildCache(),
+                             compressionLevel=args["compressionLevel"],
+                             offline=args["offline"],
+                             panelDrc=args["panelDrc"])
+            except Exception:
+                result["faileddir"] = str(failedDir(args["outputdir"]))
+                raise
+        elif command == "sync3d":
+            synchronizeProject3D(args["source"])
+        else:
+            raise RuntimeError(f"Unknown command '{command}'")
+    except BoardError as e:
+        result.update(status="failed", message=str(e))
+    except Exception as e:
+        result.update(status="crashed", message=str(e),
+                      traceback=traceback.format_exc())
+    messages.put(("result", result))
+
+def _isAlive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# The daemon part
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    server: "PrusamanDaemon"
+
+    def handle(self) -> None:
+        request = _receive(self.rfile)
+        if request is None:
+            return
+        command = request.get("command")
+        if command == "ping":
+            _send(self.wfile, {"type": "result", "status": "ok", "message": ""})
+            return
+        if command == "shutdown":
+            _send(self.wfile, {"type": "result", "status": "ok", "message": ""})
+            # Shutdown waits for the serving loop to finish, we cannot call it
+            # from the thread handling the request.
+            threading.Thread(target=self.server.shutdown).start()
+            return
+        _send(self.wfile, self.server.dispatch(request, self._forward))
+
+    def _forward(self, message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Send message to the client. If it is a prompt, return the reply.
+        """
+        _send(self.wfile, message)
+        if message["type"] != "prompt":
+            return None
+        return _receive(self.rfile)
+
+
+class PrusamanDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    The daemon accepting requests on a Unix socket and dispatching them to a
+    pool of warm worker processes. Workers are recycled after serving given
+    number of requests to contain the memory leaked by pcbnew. Note that the
+    workers cannot spawn processes on their own, so the stages of a build run
+    serially.
+    """
+    daemon_threads = True
+
+    def __init__(self, socketPath: StrPath, workers: int=DEFAULT_WORKERS,
+                 recycle: int=DEFAULT_RECYCLE) -> None:
+        # We use spawn as pcbnew and wx do not survive fork. We also have to
+        # point multiprocessing to the real interpreter when running inside
+        # KiCAD.
+        ctx = multiprocessing.get_context("spawn")
+        ctx.set_executable(locatePythonInterpreter())
+        self._manager = ctx.Manager()
+        self._pool = ctx.Pool(processes=workers, initializer=_initWorker,
+                              maxtasksperchild=recycle)
+        self.socketPath = Path(socketPath)
+        super().__init__(str(self.socketPath), _RequestHandler)
+
+    def dispatch(self, request: Request,
+                 forward: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]) -> Result:
+        """
+        Run the request in a worker process and forward its messages. Return
+        the result.
+        """
+        messages = self._manager.Queue()
+        answers = self._manager.Queue()
+        pending = self._pool.apply_async(_serveRequest,
+            (request.get("command"), request.get("args", {}), messages, answers))
+        workerPid = None
+        while True:
+            try:
+                kind, *payload = messages.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                # A worker that crashed (e.g., segfault in pcbnew) is silently
+                # replaced by the pool and the request would never finish
+                if workerPid is not None and not _isAlive(workerPid):
+                    return self._crashed("The worker process serving the request died")
+                if pending.ready() and messages.empty():
+                    try:
+                        pending.get()
+                    except Exception as e:
+                        return self._crashed(str(e), traceback.format_exc())
+                    return self._crashed("The worker finished without a result")
+                continue
+            if kind == "started":
+                workerPid = payload[0]
+            elif kind == "message":
+                severity, tag, message = payload
+                forward({"type": "message", "severity": severity, "tag": tag,
+                         "message": message})
+            elif kind == "prompt":
+                tag, message = payload
+                reply = forward({"type": "prompt", "tag": tag, "message": message})
+                # Disconnected client cannot confirm anything
+                answers.put(bool(reply is not None and reply.get("answer")))
+            elif kind == "result":
+                result = payload[0]
+                result["type"] = "result"
+                return result
+
+    @staticmethod
+    def _crashed(message: str, trace: str="") -> Result:
+        return {"type": "result", "status": "crashed", "message": message,
+                "traceback": trace}
+
+    def server_close(self) -> None:
+        super().server_close()
+        self._pool.terminate()
+        self._pool.join()
+        self._manager.shutdown()
+        try:
+            self.socketPath.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def serve(socketPath: Optional[StrPath]=None, workers: int=DEFAULT_WORKERS,
+          recycle: int=DEFAULT_RECYCLE) -> None:
+    """
+    Run the daemon until it is asked to shut down or interrupted.
+    """
+    if not daemonSupported():
+        raise RuntimeError("The daemon is not supported on this platform")
+    socketPath = Path(socketPath if socketPath is not None else DEFAULT_SOCKET)
+    socketPath.parent.mkdir(parents=True, exist_ok=True)
+    if socketPath.exists():
+        if DaemonClient(socketPath).available():
+            raise RuntimeError(f"Another daemon is already listening on {socketPath}")
+        # Stale socket of a daemon that did not exit cleanly
+        socketPath.unlink()
+
+    server = PrusamanDaemon(socketPath, workers, recycle)
+    try:
+        sys.stderr.write(f"Prusaman daemon listening on {socketPath}\n")
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+class DaemonClient:
+    """
+    Client forwarding requests to a running daemon.
+    """
+    def __init__(self, socketPath: Optional[StrPath]=None) -> None:
+        self.socketPath = Path(socketPath if socketPath is not None else DEFAULT_SOCKET)
+
+    def _connect(self) -> socket.socket:
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            s.connect(str(self.socketPath))
+        except Exception:
+            s.close()
+            raise
+        return s
+
+    def available(self) -> bool:
+        """
+        Check if there is a daemon listening on the socket
+        """
+        if not daemonSupported() or not self.socketPath.exists():
+            return False
+        try:
+            return self._call({"command": "ping"})["status"] == "ok"
+        except (OSError, ValueError):
+            return False
+
+    def shutdown(self) -> None:
+        self._call({"command": "shutdown"})
+
+    def make(self, source: StrPath, outputdir: StrPath, force: bool,
+             werror: bool, defaultAnswer: Optional[bool], noCache: bool,
+             compressionLevel: int, offline: bool, panelDrc: str,
+             reportInfo: Callable[[str, str], None],
+             reportWarning: Callable[[str, str], None],
+             reportError: Callable[[str, str], None],
+             askContinuation: Callable[[str, str], bool]) -> Result:
+        # The daemon has a different working directory
+        args = {
+            "source": str(Path(source).resolve()),
+            "outputdir": str(Path(outputdir).resolve()),
+            "force": force,
+            "werror": werror,
+            "defaultAnswer": defaultAnswer,
+            "noCache": noCache,
+            "compressionLevel": compressionLevel,
+            "offline": offline,
+            "panelDrc": panelDrc
+        }
+        return self._call({"command": "make", "args": args},
+                          reportInfo, reportWarning, reportError, askContinuation)
+
+    def sync3d(self, source: StrPath,
+               reportInfo: Callable[[str, str], None],
+               reportWarning: Callable[[str, str], None],
+               reportError: Callable[[str, str], None]) -> Result:
+        return self._call({"command": "sync3d",
+                           "args": {"source": str(Path(source).resolve())}},
+                          reportInfo, reportWarning, reportError)
+
+    def _call(self, request: Request,
+              reportInfo: Optional[Callable[[str, str], None]]=None,
+              reportWarning: Optional[Callable[[str, str], None]]=None,
+              reportError: Optional[Callable[[str, str], None]]=None,
+              askContinuation: Optional[Callable[[str, str], bool]]=None) -> Result:
+        with self._connect() as s, s.makefile("rb") as rfile, s.makefile("wb") as wfile:
+            _send(wfile, request)
+            while True:
+                message = _receive(rfile)
+                if message is None:
+                    raise ConnectionError("The daemon closed the connection unexpectedly")
+                if message["type"] == "result":
+                    return message
+                if message["type"] == "prompt":
+                    answer = False
+                    if askContinuation is not None:
+                        answer = askContinuation(message["tag"], message["message"])
+                    _send(wfile, {"answer": answer})
+                    continue
+                report = {
+                    "info": reportInfo,
+                    "warning": reportWarning,
+                    "error": reportError
+                }.get(message["severity"])
+                if report is not None:
+                    report(message["tag"], message["message"])
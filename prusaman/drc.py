@@ -2,13 +2,66 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 import json
+import re
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from kikit.drc import DrcReport, readReport # type: ignore
 from kikit.units import readLength
 import pcbnew
 
 from typing import Callable, Dict, Any, Tuple
 
+from prusaman.cache import Fingerprint
 from prusaman.params import RESOURCES
 
+DRC_REPORT_NAME = "drc-report.txt"
+
+# Timestamps and UUIDs change on every save (e.g., of a panel), but they do
+# not affect DRC
+_VOLATILE_BOARD_DATA = re.compile(r"\((tstamp|uuid|tedit)\s+[^()]*\)")
+
+def drcFingerprint(board: pcbnew.BOARD, strict: bool) -> Fingerprint:
+    """
+    Fingerprint of the inputs of the DRC of a board: the normalized board
+    file, the project with the design settings, custom rules and the KiCAD
+    version. The board has to be unmodified since it was loaded.
+    """
+    boardPath = Path(board.GetFileName())
+    with open(boardPath, encoding="utf-8") as f:
+        content = _VOLATILE_BOARD_DATA.sub("", f.read())
+    return Fingerprint(boardPath.parent) \
+        .addText("stage", "DRC") \
+        .addText("kicad", pcbnew.GetBuildVersion()) \
+        .addText("strict", str(strict)) \
+        .addText("board", content) \
+        .addFile(boardPath.with_suffix(".kicad_pro")) \
+        .addFile(boardPath.with_suffix(".kicad_dru"))
+
+def writeDrcReport(board: pcbnew.BOARD, reportPath: Path, strict: bool) -> None:
+    """
+    Run DRC and write the KiCAD report, it can be read by
+    kikit.drc.readReport. The project of the board is loaded first, so DRC
+    uses its design settings and custom rules.
+    """
+    projectPath = Path(board.GetFileName()).resolve().with_suffix(".kicad_pro")
+    pcbnew.GetSettingsManager().LoadProject(str(projectPath))
+    result = pcbnew.WriteDRCReport(board, str(reportPath),
+                                   pcbnew.EDA_UNITS_MILLIMETRES, strict)
+    if not result:
+        raise RuntimeError("Cannot run DRC: Unspecified KiCAD error")
+
+def runDrc(board: pcbnew.BOARD, strict: bool) -> DrcReport:
+    """
+    Run DRC of the board and return the parsed report. Use this (or
+    writeDrcReport) instead of kikit.drc.runBoardDrc, so all DRC runs share
+    the same setup.
+    """
+    with TemporaryDirectory() as tmpdir:
+        reportPath = Path(tmpdir) / DRC_REPORT_NAME
+        writeDrcReport(board, reportPath, strict)
+        with open(reportPath, encoding="utf-8") as f:
+            return readReport(f, board)
+
 @dataclass
 class DesignRules:
     allowBlindVias: bool
@@ -0,0 +1,156 @@
+"""
+Baseline of known DRC violations of a project. Legacy boards often carry
+violations that were accepted, but they are not excluded in KiCAD. The
+baseline records them in the project directory and the builds report only the
+violations that are not in the baseline.
+
+A violation matches a baseline entry when it has the same type and severity
+and the involved objects are at the same positions up to a tolerance, so
+small shifts caused by, e.g., panelization or rounding do not break the
+match. Positions in panels are taken relative to the board instance, so the
+baseline of the source board covers all its instances.
+"""
+
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pcbnew # type: ignore
+from kikit.drc import (DrcReport, Violation, # type: ignore
+                       readBoardDrcExclusions)
+
+from .drc import runDrc
+from .paneldrc import InstanceLocator, violationPositions
+from .project import PrusamanProject
+from .util import StrPath
+
+BASELINE_VERSION = 1
+BASELINE_TOLERANCE = pcbnew.FromMM(0.1)
+
+Position = Tuple[float, float]
+
+@dataclass(frozen=True)
+class BaselineEntry:
+    type: str
+    severity: str
+    description: str
+    positions: Tuple[Position, ...]
+
+    @staticmethod
+    def fromViolation(v: Violation,
+                      locator: Optional[InstanceLocator]=None) -> BaselineEntry:
+        return BaselineEntry(v.type, v.severity, v.description,
+                             violationPositions(v, locator))
+
+    def toDict(self) -> dict:
+        return {
+            "type": self.type,
+            "severity": self.severity,
+            "description": self.description,
+            "positions": [[pcbnew.ToMM(x), pcbnew.ToMM(y)] for x, y in self.positions]
+        }
+
+    @staticmethod
+    def fromDict(d: dict) -> BaselineEntry:
+        return BaselineEntry(d["type"], d["severity"], d["description"],
+            tuple((pcbnew.FromMM(x), pcbnew.FromMM(y)) for x, y in d["positions"]))
+
+
+class DrcBaseline:
+    """
+    Set of known violations indexed by type and a grid over the position of
+    the first involved object. A lookup therefore inspects only the entries
+    in the neighbouring cells of the grid.
+    """
+    def __init__(self, entries: Iterable[BaselineEntry],
+                 tolerance: int=BASELINE_TOLERANCE) -> None:
+        self.entries = list(entries)
+        self._tolerance = tolerance
+        self._located: Dict[Tuple[str, str, int, int], List[BaselineEntry]] = {}
+        self._unlocated: Dict[Tuple[str, str, str], BaselineEntry] = {}
+        for e in self.entries:
+            if len(e.positions) == 0:
+                self._unlocated[(e.type, e.severity, e.description)] = e
+            else:
+                cx, cy = self._cell(e.positions[0])
+                self._located.setdefault((e.type, e.severity, cx, cy), []).append(e)
+
+    def _cell(self, p: Position) -> Tuple[int, int]:
+        return int(p[0] // self._tolerance), int(p[1] // self._tolerance)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @staticmethod
+    def fromViolations(violations: Iterable[Violation],
+                       locator: Optional[InstanceLocator]=None) -> DrcBaseline:
+        return DrcBaseline(BaselineEntry.fromViolation(v, locator) for v in violations)
+
+    @staticmethod
+    def load(path: StrPath) -> DrcBaseline:
+        try:
+            with open(path, encoding="utf-8") as f:
+                content = json.load(f)
+            if content.get("version") != BASELINE_VERSION:
+                raise RuntimeError(f"unsupported version {content.get('version')}")
+            return DrcBaseline(BaselineEntry.fromDict(x) for x in content["violations"])
+        except (ValueError, KeyError, TypeError, RuntimeError) as e:
+            raise RuntimeError(f"Invalid DRC baseline {path}: {e}") from None
+
+    def save(self, path: StrPath) -> None:
+        content = {
+            "version": BASELINE_VERSION,
+            "violations": [e.toDict() for e in self.entries]
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(content, f, indent=4)
+            f.write("\n")
+
+    def matches(self, v: Violation, locator: Optional[InstanceLocator]=None) -> bool:
+        if len(v.objects) == 0:
+            return (v.type, v.severity, v.description) in self._unlocated
+        positions = violationPositions(v, locator)
+        cx, cy = self._cell(positions[0])
+        for x in range(cx - 1, cx + 2):
+            for y in range(cy - 1, cy + 2):
+                for e in self._located.get((v.type, v.severity, x, y), []):
+                    if self._samePositions(e.positions, positions):
+                        return True
+        return False
+
+    def _samePositions(self, a: Tuple[Position, ...], b: Tuple[Position, ...]) -> bool:
+        return len(a) == len(b) and \
+            all(abs(p[0] - q[0]) <= self._tolerance and abs(p[1] - q[1]) <= self._tolerance
+                for p, q in zip(a, b))
+
+    def prune(self, report: DrcReport, locator: Optional[InstanceLocator]=None) -> int:
+        """
+        Remove the known violations from the report. Return the number of the
+        removed violations.
+        """
+        def unknown(violations: List[Violation]) -> List[Violation]:
+            return [v for v in violations if not self.matches(v, locator)]
+        before = len(report.drc) + len(report.unconnected) + len(report.footprint)
+        report.drc = unknown(report.drc)
+        report.unconnected = unknown(report.unconnected)
+        report.footprint = unknown(report.footprint)
+        return before - len(report.drc) - len(report.unconnected) - len(report.footprint)
+
+
+def recordDrcBaseline(source: StrPath) -> Tuple[Path, int]:
+    """
+    Run DRC of the project board and record all the violations that are not
+    excluded in KiCAD as the baseline of the project. Return the path of the
+    baseline and the number of the recorded violations.
+    """
+    project = PrusamanProject(source)
+    board = project.board
+    report = runDrc(board, True)
+    report.pruneExclusions(readBoardDrcExclusions(board))
+    baseline = DrcBaseline.fromViolations(report.drc + report.unconnected + report.footprint)
+    path = project.getDrcBaseline()
+    baseline.save(path)
+    return path, len(baseline)
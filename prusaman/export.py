@@ -1,20 +1,52 @@
+import multiprocessing
+import os
 import shutil
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Callable, Set, Union
+from tempfile import TemporaryDirectory
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
 
 from pcbnew import (BOARD, DXF_UNITS_MILLIMETERS,  # type: ignore
                     EXCELLON_WRITER, GENDRILL_WRITER_BASE, PLOT_CONTROLLER,
                     PLOT_FORMAT_DXF, PLOT_FORMAT_GERBER, FromMM, LayerName,
                     LoadBoard, wxPoint)
 
+from .util import locatePythonInterpreter
+
 
 def makeGerbers(source: Union[Path, BOARD], outdir: Path,
-                layers: Callable[[BOARD], Set[int]]) -> None:
+                layers: Callable[[BOARD], Set[int]], jobs: int=1) -> None:
+    """
+    Plot gerbers and drill files of the board. With more jobs, the layers are
+    plotted by worker processes. The workers load the board from its file, so
+    a board given as an object must not have unsaved changes.
+    """
     if isinstance(source, BOARD):
         board = source
     else:
         board = LoadBoard(str(source))
 
+    layerList = list(layers(board))
+    if jobs > 1 and len(layerList) > 1 and not multiprocessing.current_process().daemon:
+        _plotGerbersParallel(board.GetFileName(), outdir, layerList, jobs)
+    else:
+        _plotGerbers(board, outdir, layerList)
+
+    drlwriter = EXCELLON_WRITER(board)
+    drlwriter.SetOptions(
+        aMirror=False,
+        aMinimalHeader=True,
+        aOffset=wxPoint(0, 0),
+        aMerge_PTH_NPTH=True)
+    drlwriter.SetRouteModeForOvalHoles(False)
+
+    # Set metric format
+    drlwriter.SetFormat(True, GENDRILL_WRITER_BASE.DECIMAL_FORMAT)
+    drlwriter.CreateDrillandMapFilesSet(str(outdir), aGenDrill=True, aGenMap=False)
+
+    # shutil.make_archive(str(outdir / "gerber"), "zip", str(gerberSubdir))
+
+def _plotGerbers(board: BOARD, outdir: Path, layers: List[int]) -> None:
     pctl = PLOT_CONTROLLER(board)
     popt = pctl.GetPlotOptions()
     popt.SetOutputDirectory(str(outdir))
@@ -35,7 +67,7 @@ def makeGerbers(source: Union[Path, BOARD], outdir: Path,
     popt.SetDrillMarksType(0) # NO_DRILL_SHAPE
 
     try:
-        for layer in layers(board):
+        for layer in layers:
             pctl.SetLayer(layer)
             pctl.OpenPlotfile(LayerName(layer), PLOT_FORMAT_GERBER, "")
             if not pctl.PlotLayer():
@@ -43,19 +75,133 @@ def makeGerbers(source: Union[Path, BOARD], outdir: Path,
     finally:
         pctl.ClosePlot()
 
-    drlwriter = EXCELLON_WRITER(board)
-    drlwriter.SetOptions(
-        aMirror=False,
-        aMinimalHeader=True,
-        aOffset=wxPoint(0, 0),
-        aMerge_PTH_NPTH=True)
-    drlwriter.SetRouteModeForOvalHoles(False)
+# The fake KiCAD application of a plotting worker process. It has to outlive
+# the shards plotted by the worker.
+_plotApp: Optional[Any] = None
 
-    # Set metric format
-    drlwriter.SetFormat(True, GENDRILL_WRITER_BASE.DECIMAL_FORMAT)
-    drlwriter.CreateDrillandMapFilesSet(str(outdir), aGenDrill=True, aGenMap=False)
+def _initPlotWorker() -> None:
+    from .pcbnew_common import fakeKiCADGui
 
-    # shutil.make_archive(str(outdir / "gerber"), "zip", str(gerberSubdir))
+    global _plotApp
+    # Without the application and its locale, KiCAD may format the numbers
+    # in the plots differently than in the coordinating process
+    _plotApp = fakeKiCADGui()
+
+def _plotGerberShard(boardPath: str, shardDir: str, layers: List[int]) -> None:
+    _plotGerbers(LoadBoard(boardPath), Path(shardDir), layers)
+
+def _plotGerbersParallel(boardPath: str, outdir: Path, layers: List[int],
+                         jobs: int) -> None:
+    """
+    Plot the layers in worker processes. Each worker loads its own instance of
+    the board and plots a shard of layers into a private directory. The
+    directories are merged into outdir once all the shards succeed.
+    """
+    # We use spawn as pcbnew and wx do not survive fork. We also have to
+    # point multiprocessing to the real interpreter when running inside KiCAD.
+    ctx = multiprocessing.get_context("spawn")
+    ctx.set_executable(locatePythonInterpreter())
+    jobs = min(jobs, len(layers))
+    shards = [layers[i::jobs] for i in range(jobs)]
+
+    outdir.mkdir(parents=True, exist_ok=True)
+    with TemporaryDirectory(prefix="gerbers_", dir=outdir.parent) as tmp:
+        shardDirs = [Path(tmp) / str(i) for i in range(jobs)]
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=ctx,
+                                 initializer=_initPlotWorker) as executor:
+            futures = [executor.submit(_plotGerberShard, boardPath, str(d), s)
+                       for d, s in zip(shardDirs, shards)]
+            for f in futures:
+                f.result()
+        jobFiles: Dict[str, List[Path]] = {}
+        for d in shardDirs:
+            for f in d.iterdir():
+                if f.suffix == ".gbrjob":
+                    jobFiles.setdefault(f.name, []).append(f)
+                else:
+                    os.replace(f, outdir / f.name)
+        for name, parts in jobFiles.items():
+            _mergeJobFiles(parts, outdir / name, len(layers))
+
+def _mergeJobFiles(parts: List[Path], target: Path, layerCount: int) -> None:
+    """
+    Merge gerber job files of round-robin shards so the files are listed in
+    the plotting order - as if the job file was produced by a serial plot.
+
+    The shards differ only in the list of files. We therefore take the text of
+    the first shard and replace the list with the entries copied verbatim from
+    the shards, so the formatting is exactly the one KiCAD writes and the
+    result is identical to a serial plot (except for the creation date).
+    """
+    texts = []
+    for p in parts:
+        with open(p, encoding="utf-8", newline="") as f:
+            texts.append(f.read())
+    arrays = [_jsonArray(t, "FilesAttributes") for t in texts]
+    shardFiles = [[text[a:b] for a, b in array[2]] for text, array in zip(texts, arrays)]
+    if sum(len(x) for x in shardFiles) == layerCount:
+        files = [shardFiles[i % len(parts)][i // len(parts)] for i in range(layerCount)]
+    else:
+        files = [x for shard in shardFiles for x in shard]
+
+    text = texts[0]
+    start, end, items = arrays[0]
+    if len(items) == 0:
+        raise RuntimeError(f"Gerber job file {parts[0]} lists no files")
+    # KiCAD indents every entry the same way, the entries are separated by a
+    # comma and the indentation
+    leading = text[start + 1:items[0][0]]
+    trailing = text[items[-1][1]:end - 1]
+    merged = text[:start] + "[" + leading + ("," + leading).join(files) + \
+             trailing + "]" + text[end:]
+    with open(target, "w", encoding="utf-8", newline="") as f:
+        f.write(merged)
+
+def _jsonArray(text: str, key: str) -> Tuple[int, int, List[Tuple[int, int]]]:
+    """
+    Locate the array value of the key in JSON text. Return the span of the
+    array (including the brackets) and the spans of its items.
+    """
+    keyPos = text.find(f'"{key}"')
+    if keyPos == -1:
+        raise RuntimeError(f"No {key} in gerber job file")
+    start = text.index("[", keyPos)
+    items: List[Tuple[int, int]] = []
+    depth = 0
+    itemStart: Optional[int] = None
+    inString = False
+    i = start + 1
+    while True:
+        c = text[i]
+        if inString:
+            if c == "\\":
+                i += 1
+            elif c == '"':
+                inString = False
+        elif c == '"':
+            inString = True
+        elif c in "[{":
+            depth += 1
+        elif c in "]}":
+            if depth == 0:
+                if itemStart is not None:
+                    items.append((itemStart, _rstripPos(text, i)))
+                return start, i + 1, items
+            depth -= 1
+        elif c == "," and depth == 0:
+            if itemStart is not None:
+                items.append((itemStart, _rstripPos(text, i)))
+            itemStart = None
+            i += 1
+            continue
+        if itemStart is None and not c.isspace():
+            itemStart = i
+        i += 1
+
+def _rstripPos(text: str, end: int) -> int:
+    while text[end - 1].isspace():
+        end -= 1
+    return end
 
 def makeDxf(source: Union[Path, BOARD], outdir: Path,
             layers: Callable[[BOARD], Set[int]]) -> None:
@@ -1,27 +1,136 @@
+import hashlib
+import io
+import json
+import os
 import re
+import threading
 import shutil
-from typing import Dict, List, Union, Optional
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Union, Optional
 from pathlib import Path
+from urllib.error import HTTPError
 from urllib.request import urlopen, Request
-from zipfile import ZipFile
+from zipfile import ZipFile, ZipInfo
 import pcbnew
-from itertools import zip_longest
-from kikit.sexpr import isElement, parseSexprS, SExpr, Atom
+from kikit.sexpr import parseSexprS, SExpr, Atom
 
-from .params import FOOTPRINT_REPO
-from .util import replaceDirectory
+from .archive import bytesMember, copiedMember, writeMembers
+from .params import FOOTPRINT_REPO, FOOTPRINT_REVISION_TTL, GITHUB_API
+from .util import fileLock, writeFileAtomically
+
+# Number of concurrent downloads during an incremental update
+DOWNLOAD_WORKERS = 8
+
+Manifest = Dict[str, str] # Path relative to the library -> git blob hash
+RevisionIndex = Dict[str, Optional[str]] # "lib:footprint" -> revision
+
+_FOOTPRINT_PATH = re.compile(r"^prusa-footprints/([^/]+)\.pretty/([^/]+)\.kicad_mod$")
+# KiCAD writes the text as a quoted string or, when it needs no quoting, as a
+# bare atom
+_REVISION_TEXT = re.compile(
+    r'\(fp_text\s+user\s+(?:"(PRUSA_REVISION:[^"]*)"|(PRUSA_REVISION:[^\s()"]*))')
+
+def gitBlobHash(content: bytes) -> str:
+    """
+    Compute the hash git assigns to the file content
+    """
+    h = hashlib.sha1(f"blob {len(content)}\0".encode("utf-8"))
+    h.update(content)
+    return h.hexdigest()
+
+class _Pack:
+    """
+    The library stored as a ZIP archive in the GitHub zipball layout, i.e.,
+    all files are in a single top-level directory. The central directory of
+    the archive serves as an index, so individual files can be read without
+    extracting the archive.
+    """
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        # Identifies the file, so we can tell the pack was replaced
+        stat = os.stat(path)
+        self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        self._zip = ZipFile(path, mode="r")
+        self.root = ""
+        self.index: Dict[str, ZipInfo] = {}
+        for info in self._zip.infolist():
+            if info.is_dir():
+                continue
+            root, _, name = info.filename.partition("/")
+            self.root = root
+            self.index[name] = info
+
+    def read(self, name: str) -> bytes:
+        return self._zip.read(self.index[name])
+
+    def manifest(self) -> Manifest:
+        return {name: gitBlobHash(self.read(name)) for name in self.index.keys()}
+
+    def scanRevision(self, name: str) -> Optional[str]:
+        """
+        Find the revision text of a footprint without loading it. The text
+        usually comes early in the file, so we stop at the first match.
+        """
+        with self._zip.open(self.index[name]) as f:
+            for line in io.TextIOWrapper(f, encoding="utf-8", errors="replace"):
+                match = _REVISION_TEXT.search(line)
+                if match is not None:
+                    return _revisionFromText(match.group(1) or match.group(2))
+        return None
+
+    def revisionIndex(self, names: Optional[List[str]]=None) -> RevisionIndex:
+        """
+        Build revision index of given files (all by default). Files that are
+        not footprints are ignored.
+        """
+        footprints = []
+        for name in sorted(names if names is not None else self.index.keys()):
+            match = _FOOTPRINT_PATH.match(name)
+            if match is not None:
+                footprints.append((f"{match.group(1)}:{match.group(2)}", name))
+        # The scan is dominated by the regular expression, which holds the
+        # GIL, so threads do not speed it up
+        return {key: self.scanRevision(name) for key, name in footprints}
+
+    def close(self) -> None:
+        self._zip.close()
 
 class PrusaFootprints:
     """
     This class represents a footprint library fetched from Github. The library
     is stored on disk and you can retrieve footprints from it and you can update
     it.
+
+    The library is kept as the downloaded ZIP archive (a pack) and it is never
+    extracted; footprints are materialized on disk only when requested, as
+    pcbnew can load them only from a directory.
+
+    The library is updated incrementally: the manifest of the remote tree is
+    compared with the manifest of the local library and only the changed files
+    are downloaded. The whole repository is downloaded only when there is no
+    usable local library.
+
+    The remote revision is cached for revisionTtl seconds and then revalidated
+    by a conditional request, so frequent builds do not hit the GitHub rate
+    limits. The API URL can be changed, e.g., to a local server mimicking the
+    GitHub API.
+
+    The library can be shared by multiple processes (e.g., make-batch or
+    daemon workers). The synchronization and materialization of footprints
+    are serialized by a lock file and all files are replaced atomically.
     """
-    def __init__(self, accessToken: str, repo: Optional[str]=None,
-                 path: Union[None, Path, str]=None) -> None:
+    def __init__(self, accessToken: Optional[str], repo: Optional[str]=None,
+                 path: Union[None, Path, str]=None, apiUrl: Optional[str]=None,
+                 revisionTtl: float=FOOTPRINT_REVISION_TTL) -> None:
         self._accessToken = accessToken
         self._repo = repo if repo is not None else FOOTPRINT_REPO
         self._path = self._defaultPath() if path is None else Path(path)
+        self._apiUrl = (apiUrl if apiUrl is not None else GITHUB_API).rstrip("/")
+        self._revisionTtl = revisionTtl
+        self._pack: Optional[_Pack] = None
+        self._packLock = threading.Lock()
 
         self._path.mkdir(parents=True, exist_ok=True)
 
@@ -34,17 +143,47 @@ class PrusaFootprints:
 
     @property
     def _libLoc(self) -> Path:
+        # Extracted library of older versions
         return self._path / "lib"
 
+    @property
+    def _packLoc(self) -> Path:
+        return self._path / "lib.zip"
+
+    @property
+    def _materializedLoc(self) -> Path:
+        return self._path / "materialized"
+
     @property
     def _revisionLoc(self) -> Path:
         return self._path / "revision.txt"
 
+    @property
+    def _manifestLoc(self) -> Path:
+        return self._path / "manifest.json"
+
+    @property
+    def _revisionIndexLoc(self) -> Path:
+        return self._path / "revisions.json"
+
+    @property
+    def _hashCacheLoc(self) -> Path:
+        return self._path / "hashes.json"
+
+    @property
+    def _remoteRevisionLoc(self) -> Path:
+        return self._path / "remote-revision.json"
+
+    @property
+    def _lockLoc(self) -> Path:
+        return self._path / "lock"
+
     def _makeGhRequest(self, url, data=None, headers=None, origin_req_host=None,
                        unverifiable=False, method=None):
         if headers is None:
             headers = {}
-        headers["Authorization"] = f"token {self._accessToken}"
+        if self._accessToken is not None:
+            headers["Authorization"] = f"token {self._accessToken}"
         if "Accept" not in headers:
             headers["Accept"] = "application/vnd.github.v3+json"
         return urlopen(Request(url, data, headers, origin_req_host, unverifiable, method))
@@ -56,112 +195,370 @@ class PrusaFootprints:
         except Exception:
             return None
 
+    def _readRemoteRevisionCache(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._remoteRevisionLoc) as f:
+                cache = json.load(f)
+        except Exception:
+            return None
+        # The cache of a different repository or server is useless
+        if cache.get("repo") != self._repo or cache.get("api") != self._apiUrl:
+            return None
+        return cache
+
+    def _writeRemoteRevisionCache(self, revision: str, etag: Optional[str]) -> None:
+        cache = {
+            "repo": self._repo,
+            "api": self._apiUrl,
+            "revision": revision,
+            "etag": etag,
+            "checked": time.time()
+        }
+        writeFileAtomically(self._remoteRevisionLoc, json.dumps(cache))
+
     def getRemoteRevision(self) -> str:
+        """
+        Return the revision of the remote library. A revision checked less than
+        revisionTtl seconds ago is returned without contacting the server.
+        """
+        cache = self._readRemoteRevisionCache()
+        if cache is not None and time.time() - cache["checked"] < self._revisionTtl:
+            return cache["revision"]
+
         headers = {
             "Accept": "application/vnd.github.VERSION.sha"
         }
+        if cache is not None and cache.get("etag") is not None:
+            headers["If-None-Match"] = cache["etag"]
+        try:
+            with self._makeGhRequest(
+                    f"{self._apiUrl}/repos/{self._repo}/commits/master",
+                    headers=headers) as f:
+                revision = f.read().decode("utf-8").strip()
+                etag = f.headers.get("ETag")
+        except HTTPError as e:
+            if e.code != 304 or cache is None:
+                raise
+            # Not modified; conditional requests do not count against the
+            # rate limit
+            revision, etag = cache["revision"], cache["etag"]
+        self._writeRemoteRevisionCache(revision, etag)
+        return revision
+
+    def _openPack(self) -> Optional[_Pack]:
+        """
+        Return the pack, reopen it if it was replaced by another process.
+        """
+        with self._packLock:
+            try:
+                stat = os.stat(self._packLoc)
+            except FileNotFoundError:
+                return self._pack
+            identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if self._pack is not None and self._pack.identity != identity:
+                self._pack.close()
+                self._pack = None
+            if self._pack is None:
+                self._pack = _Pack(self._packLoc)
+            return self._pack
+
+    def _closePack(self) -> None:
+        with self._packLock:
+            if self._pack is not None:
+                self._pack.close()
+                self._pack = None
+
+    def getLocalManifest(self) -> Optional[Manifest]:
+        if not self._packLoc.exists():
+            return None
+        try:
+            with open(self._manifestLoc) as f:
+                return json.load(f)
+        except Exception:
+            return None
+
+    def _installPack(self, packPath: Path, revision: str, manifest: Manifest,
+                     revisions: RevisionIndex) -> None:
+        """
+        Install a new pack; the caller holds the library lock. The files
+        describing the pack are removed first and the revision is written
+        last, so an interrupted installation is detected as an outdated
+        library without a manifest and it is redone by a full update.
+        """
+        self._closePack()
+        for p in [self._revisionLoc, self._manifestLoc, self._revisionIndexLoc]:
+            if p.exists():
+                p.unlink()
+        # The pack is a single file, so unlike the extracted library of older
+        # versions it does not need replaceDirectory and its non-atomic
+        # fallback. os.replace renames it over the old pack in one step
+        # (rename(2) on POSIX, MoveFileEx on Windows); readers see either the
+        # old or the new pack. If the rename fails, the old pack stays.
+        os.replace(packPath, self._packLoc)
+        self._writeRevisionIndex(revisions)
+        writeFileAtomically(self._manifestLoc, json.dumps(manifest))
+        # The materialized footprints belong to the previous revision
+        shutil.rmtree(self._materializedLoc, ignore_errors=True)
+        shutil.rmtree(self._libLoc, ignore_errors=True)
+        writeFileAtomically(self._revisionLoc, revision.strip())
+
+    def _tempPackPath(self) -> Path:
+        fd, name = tempfile.mkstemp(prefix="lib.", suffix=".zip.tmp", dir=self._path)
+        os.close(fd)
+        return Path(name)
+
+    def getRemoteManifest(self, revision: str) -> Optional[Manifest]:
+        """
+        Return the manifest of the remote library at given revision. If the
+        server cannot provide the full tree, return None.
+        """
         with self._makeGhRequest(
-                f"https://api.github.com/repos/{self._repo}/commits/master",
-                headers=headers) as f:
-            return f.read().decode("utf-8").strip()
+                f"{self._apiUrl}/repos/{self._repo}/git/trees/{revision}?recursive=1") as f:
+            tree = json.load(f)
+        if tree.get("truncated", False):
+            return None
+        return {x["path"]: x["sha"] for x in tree["tree"] if x["type"] == "blob"}
 
     def updateFromRemote(self) -> None:
-        tempLoc = self._path / "lib-tmp"
-        tempZip = self._path / "lib.zip"
-        shutil.rmtree(tempLoc, ignore_errors=True)
-        tempZip.unlink(missing_ok=True)
+        """
+        Update the local library to the latest remote revision. If there is a
+        local library with a manifest, only the changes are downloaded.
+        """
+        revision = self.getRemoteRevision()
+        with fileLock(self._lockLoc):
+            # Another process might have updated the library meanwhile
+            if self.getLocalRevision() == revision and self._packLoc.exists():
+                return
+            localManifest = self.getLocalManifest()
+            remoteManifest = self.getRemoteManifest(revision)
+            tempPack = self._tempPackPath()
+            try:
+                if localManifest is None or remoteManifest is None:
+                    self._fullUpdate(tempPack, revision, remoteManifest)
+                else:
+                    self._incrementalUpdate(tempPack, revision, localManifest,
+                                            remoteManifest)
+            finally:
+                if tempPack.exists():
+                    tempPack.unlink()
 
-        with self._makeGhRequest(f"https://api.github.com/repos/{self._repo}/zipball/master") as resp:
-            with open(tempZip, "wb") as f:
+    def _incrementalUpdate(self, tempPack: Path, revision: str,
+                           localManifest: Manifest, remoteManifest: Manifest) -> None:
+        pack = self._openPack()
+        assert pack is not None
+        changed = [path for path, sha in remoteManifest.items()
+                   if localManifest.get(path) != sha or path not in pack.index]
+
+        def download(path: str) -> bytes:
+            with self._makeGhRequest(
+                    f"{self._apiUrl}/repos/{self._repo}/git/blobs/{remoteManifest[path]}",
+                    headers={"Accept": "application/vnd.github.v3.raw"}) as resp:
+                return resp.read()
+
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            downloaded = dict(zip(changed, executor.map(download, changed)))
+
+        # Deleted files are simply not carried over to the new pack and the
+        # unchanged ones are copied without recompression
+        writeMembers(tempPack, (
+            bytesMember(f"{pack.root}/{path}", downloaded[path]) if path in downloaded
+            else copiedMember(pack.path, pack.index[path])
+            for path in sorted(remoteManifest.keys())))
+
+        # Only the downloaded footprints have to be scanned for revisions
+        revisions = {k: v for k, v in self.getRevisionIndex().items()
+                     if self._footprintPath(k) in remoteManifest}
+        newPack = _Pack(tempPack)
+        revisions.update(newPack.revisionIndex(changed))
+        newPack.close()
+        self._installPack(tempPack, revision, remoteManifest, revisions)
+
+    def _fullUpdate(self, tempPack: Path, revision: str,
+                    manifest: Optional[Manifest]) -> None:
+        with self._makeGhRequest(f"{self._apiUrl}/repos/{self._repo}/zipball/{revision}") as resp:
+            with open(tempPack, "wb") as f:
                 shutil.copyfileobj(resp, f)
-        with ZipFile(tempZip, mode="r") as archive:
-            archive.extractall(tempLoc)
-        revisionDir = next(tempLoc.iterdir())
-        for x in revisionDir.iterdir():
-            shutil.move(str(x), str(tempLoc))
-        revisionDir.rmdir()
+        pack = _Pack(tempPack)
+        if manifest is None:
+            manifest = pack.manifest()
+        revisions = pack.revisionIndex()
+        pack.close()
+        self._installPack(tempPack, revision, manifest, revisions)
+
+    @staticmethod
+    def _footprintPath(key: str) -> str:
+        libname, fname = key.split(":", 1)
+        return f"prusa-footprints/{libname}.pretty/{fname}.kicad_mod"
 
-        replaceDirectory(self._libLoc, tempLoc)
+    def _writeRevisionIndex(self, revisions: RevisionIndex) -> None:
+        writeFileAtomically(self._revisionIndexLoc, json.dumps(revisions))
 
-        revision = revisionDir.name.split("-")[-1]
-        with open(self._revisionLoc, "w") as f:
-            f.write(revision.strip())
+    def getRevisionIndex(self) -> RevisionIndex:
+        """
+        Return the index of footprint revisions ("lib:footprint" -> revision
+        or None if the footprint has no revision). The index is built when the
+        library is synchronized; libraries synchronized by older versions are
+        indexed on first use.
+        """
+        try:
+            with open(self._revisionIndexLoc) as f:
+                return json.load(f)
+        except Exception:
+            pass
+        pack = self._openPack()
+        if pack is None:
+            return {}
+        revisions = pack.revisionIndex()
+        self._writeRevisionIndex(revisions)
+        return revisions
 
     def getFootprint(self, libname: str, fname: str) -> Optional[pcbnew.FOOTPRINT]:
-        libPath = self._libLoc / "prusa-footprints" / f"{libname}.pretty"
-        if not (libPath / f"{fname}.kicad_mod").exists():
+        pack = self._openPack()
+        if pack is None:
+            return None
+        name = self._footprintPath(f"{libname}:{fname}")
+        if name not in pack.index:
             return None
+        libPath = self._materializedLoc / f"{libname}.pretty"
+        footprintPath = libPath / f"{fname}.kicad_mod"
+        if not footprintPath.exists():
+            with fileLock(self._lockLoc):
+                # The library might have been updated by another process, we
+                # must not materialize a footprint of the previous revision
+                pack = self._openPack()
+                if pack is None or name not in pack.index:
+                    return None
+                libPath.mkdir(parents=True, exist_ok=True)
+                writeFileAtomically(footprintPath, pack.read(name))
         return pcbnew.FootprintLoad(str(libPath), str(fname))
 
+    def getFootprintHashes(self, keys: List[str]) -> Dict[str, Optional[str]]:
+        """
+        Return structural hashes (see footprintHash) of given library
+        footprints ("lib:footprint"); None for footprints not in the library.
+        The hashes are cached by the content of the footprint and the KiCAD
+        version, so only footprints changed by an update are loaded.
+        """
+        manifest = self.getLocalManifest() or {}
+        kicad = pcbnew.GetBuildVersion()
+        try:
+            with open(self._hashCacheLoc) as f:
+                cache = json.load(f)
+        except Exception:
+            cache = {}
+
+        hashes: Dict[str, Optional[str]] = {}
+        dirty = False
+        for key in keys:
+            blob = manifest.get(self._footprintPath(key))
+            cached = cache.get(key)
+            if cached is not None and cached["blob"] == blob and cached["kicad"] == kicad:
+                hashes[key] = cached["hash"]
+                continue
+            libname, fname = key.split(":", 1)
+            footprint = self.getFootprint(libname, fname)
+            hashes[key] = None if footprint is None else footprintHash(footprint)
+            if footprint is not None and blob is not None:
+                cache[key] = {"blob": blob, "kicad": kicad, "hash": hashes[key]}
+                dirty = True
+        if dirty:
+            writeFileAtomically(self._hashCacheLoc, json.dumps(cache))
+        return hashes
+
 def extractRevision(footprint: pcbnew.FOOTPRINT) -> Optional[str]:
     for x in footprint.GraphicalItems():
         if not isinstance(x, pcbnew.FP_TEXT):
             continue
         text = x.GetText()
         if text.startswith("PRUSA_REVISION:"):
-            return text.replace("PRUSA_REVISION: ", "")
+            return _revisionFromText(text)
     return None
 
-def matchesFootprintPattern(footprint: pcbnew.FOOTPRINT,
-                            pattern: pcbnew.FOOTPRINT,
-                            workingDir: Path) -> bool:
+def _revisionFromText(text: str) -> str:
     """
-    There is no equality implemented in KiCAD between footprints. Let's decide
-    the equality by saving footprints, stripping timestamps and sorting it. It's
-    less laborious than manually walking the tree and probably more reliable.
+    Extract the revision from the text of the revision field. The revision
+    index uses it as well, so both yield the same revision for a footprint.
     """
-    pattern.SetPosition(footprint.GetPosition())
-    pattern.SetOrientation(footprint.GetOrientation())
+    return text.replace("PRUSA_REVISION: ", "")
 
-    fId = footprint.GetFPID()
-    fId.SetLibItemName(pcbnew.UTF8("FOOTPRINT"))
-    clone = pcbnew.Cast_to_FOOTPRINT(pcbnew.Cast_to_BOARD_ITEM(footprint.Clone()))
-    clone.SetFPID(fId)
-
-    pId = pattern.GetFPID()
-    pId.SetLibItemName(pcbnew.UTF8("PATTERN"))
-
-    pcbnew.FootprintSave(str(workingDir), clone)
-    pcbnew.FootprintSave(str(workingDir), pattern)
+# Nodes that do not describe the footprint itself; they are either volatile
+# (timestamps), come from the board (nets, pin functions from schematics) or
+# are board placement
+_IGNORED_NODES = frozenset(["tedit", "tstamp", "uuid", "path", "property",
+                            "sheetname", "sheetfile", "net", "pinfunction",
+                            "pintype"])
+# Visibility of texts and 3D models is changed by the users and sync3d; the
+# hide atom is ignored only in these nodes
+_VISIBILITY_NODES = frozenset(["fp_text", "model", "effects"])
+# Placement of the footprint on the board
+_IGNORED_ROOT_NODES = frozenset(["at", "layer"])
+_IGNORED_ROOT_ATOMS = frozenset(["locked", "placed"])
 
-    patternAst = loadAstWithoutTStamp(workingDir / "PATTERN.kicad_mod")
-    footprintAst = loadAstWithoutTStamp(workingDir / "FOOTPRINT.kicad_mod")
-    return areSameFootprints(footprintAst, patternAst)
+def _isNode(item: Union[Atom, SExpr], *names: str) -> bool:
+    return isinstance(item, SExpr) and len(item.items) > 0 and \
+           isinstance(item.items[0], Atom) and item.items[0].value in names
 
-def areSameFootprints(l: SExpr, r: SExpr) -> bool:
-    simplifyAndCanonizeFpAst(l)
-    simplifyAndCanonizeFpAst(r)
-    return l == r
+def _relevant(item: Union[Atom, SExpr], parent: SExpr, root: bool) -> bool:
+    if isinstance(item, Atom):
+        if item.value == "hide" and _isNode(parent, *_VISIBILITY_NODES):
+            return False
+        return not (root and item.value in _IGNORED_ROOT_ATOMS)
+    if _isNode(item, *_IGNORED_NODES):
+        return False
+    if root and _isNode(item, *_IGNORED_ROOT_NODES):
+        return False
+    if _isNode(item, "fp_text") and len(item.items) >= 2 and \
+       isinstance(item.items[1], Atom) and item.items[1].value in ["reference", "value"]:
+        return False
+    return True
 
-def loadAstWithoutTStamp(fname):
-    with open(fname) as f:
-        content = f.read()
-    content = re.sub(r'\(tedit\s+[a-fA-F0-9]*\)|\(tstamp\s+[a-fA-F-0-9\-]*\)|hide', "", content)
-    return parseSexprS(content)
+def astHash(node: Union[Atom, SExpr], root: bool=True) -> bytes:
+    """
+    Canonical Merkle hash of a footprint AST. The items of a node are hashed
+    in order (e.g., coordinates or vertices of a polygon) with the exception
+    of the top-level items of the footprint (e.g., the pads and graphical
+    items) that are hashed as a multiset, so the hash does not depend on the
+    order of items in the file. The footprint name, placement, timestamps,
+    reference and value texts and visibility are ignored.
+    """
+    if isinstance(node, Atom):
+        return hashlib.sha1(b"a" + node.value.encode("utf-8")).digest()
+    items = node.items
+    if root:
+        # Skip the footprint name
+        items = items[:1] + items[2:]
+    items = [x for x in items if _relevant(x, node, root)]
+    h = hashlib.sha1(b"n")
+    if not root:
+        for x in items:
+            h.update(astHash(x, False))
+        return h.digest()
+    for x in items:
+        if isinstance(x, Atom):
+            h.update(astHash(x, False))
+    h.update(b"|")
+    for childHash in sorted(astHash(x, False) for x in items if isinstance(x, SExpr)):
+        h.update(childHash)
+    return h.digest()
 
-def simplifyAndCanonizeFpAst(node: SExpr) -> SExpr:
+def serializeFootprint(footprint: pcbnew.FOOTPRINT) -> str:
+    """
+    Serialize the footprint in a canonical placement - on the top side, at the
+    origin with zero orientation - without touching the original.
     """
-    Sorts nodes in the AST to make it somewhat canonic. This breaks, however,
-    semantics of lists. Also, the complexity is quadratic.
+    clone = pcbnew.Cast_to_FOOTPRINT(pcbnew.Cast_to_BOARD_ITEM(footprint.Clone()))
+    if clone.IsFlipped():
+        clone.Flip(clone.GetPosition(), False)
+    clone.SetOrientation(0)
+    clone.SetPosition(pcbnew.wxPoint(0, 0))
+    plugin = pcbnew.PCB_PLUGIN()
+    plugin.Format(clone)
+    return plugin.GetStringOutput(True)
 
-    However, both properties are fine for footprint comparison
+def footprintHash(footprint: pcbnew.FOOTPRINT) -> str:
     """
-    if isinstance(node, Atom):
-        node.leadingWhitespace = ""
-        return node
-    node.leadingWhitespace = ""
-    node.trailingWhitespace = ""
-
-    def allowed(node):
-        if isinstance(node, Atom):
-            return node.value not in ["FOOTPRINT", "PATTERN"]
-        if node.items[0].value == "property":
-            return False
-        if node.items[0].value == "fp_text":
-            if len(node.items) >= 2 and isinstance(node.items[1], Atom):
-                if node.items[1].value in ["value", "reference"]:
-                    return False
-        return True
-    node.items = [simplifyAndCanonizeFpAst(x) for x in node.items if allowed(x)]
-    node.items.sort(key=lambda x: str(x))
-    return
+    Structural hash of the footprint. Two footprints have the same hash if
+    they differ only in placement, timestamps, reference, value, visibility
+    and the data coming from the schematics.
+    """
+    return astHash(parseSexprS(serializeFootprint(footprint))).hex()
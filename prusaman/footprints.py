@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+from array import array
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional
+
+import pcbnew # type: ignore
+
+@dataclass(frozen=True)
+class FootprintRecord:
+    """
+    Snapshot of a single footprint. Coordinates are in board units,
+    orientation in tenths of degree as KiCAD reports it.
+    """
+    index: int
+    reference: str
+    value: str
+    fpid: str
+    x: int
+    y: int
+    orientation: float
+    layer: int
+
+
+class FootprintTable:
+    """
+    Snapshot of the footprints of a board taken in a single pass. Every access
+    to a footprint crosses the SWIG boundary and looking up a footprint by
+    reference walks all footprints, so consumers that need several
+    properties of many footprints should use the snapshot instead of the
+    board. The numeric properties are stored in compact arrays; the records
+    are materialized only on access.
+
+    The table also keeps the footprint handles in the board order, so
+    consumers modifying the footprints can avoid another lookup.
+    """
+    def __init__(self) -> None:
+        self.references: List[str] = []
+        self.values: List[str] = []
+        self.fpids: List[str] = []
+        self.xs = array("q")
+        self.ys = array("q")
+        self.orientations = array("d")
+        self.layers = array("i")
+        self.handles: List[pcbnew.FOOTPRINT] = []
+        self._index: Dict[str, int] = {}
+
+    @staticmethod
+    def fromBoard(board: pcbnew.BOARD) -> FootprintTable:
+        table = FootprintTable()
+        for f in board.Footprints():
+            pos = f.GetPosition()
+            table._append(f, f.GetReference(), f.GetValue(),
+                          f.GetFPID().GetUniStringLibItemName(), pos.x, pos.y,
+                          f.GetOrientation(), f.GetLayer())
+        return table
+
+    def _append(self, handle: pcbnew.FOOTPRINT, reference: str, value: str,
+                fpid: str, x: int, y: int, orientation: float,
+                layer: int) -> None:
+        # With duplicate references, the first footprint wins like in
+        # BOARD::FindFootprintByReference
+        self._index.setdefault(reference, len(self.references))
+        self.references.append(reference)
+        self.values.append(value)
+        self.fpids.append(fpid)
+        self.xs.append(x)
+        self.ys.append(y)
+        self.orientations.append(orientation)
+        self.layers.append(layer)
+        self.handles.append(handle)
+
+    def __len__(self) -> int:
+        return len(self.references)
+
+    def __iter__(self) -> Iterator[FootprintRecord]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, i: int) -> FootprintRecord:
+        return FootprintRecord(
+            index=i,
+            reference=self.references[i],
+            value=self.values[i],
+            fpid=self.fpids[i],
+            x=self.xs[i],
+            y=self.ys[i],
+            orientation=self.orientations[i],
+            layer=self.layers[i])
+
+    def find(self, reference: str) -> Optional[FootprintRecord]:
+        i = self._index.get(reference)
+        if i is None:
+            return None
+        return self[i]
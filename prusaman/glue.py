@@ -0,0 +1,350 @@
+"""
+Ordering of glue stamps for the dispenser. The dispenser visits the stamps in
+the order of the glue file, so we look for a short open path through them.
+Panels carry thousands of stamps, so we avoid anything quadratic: the initial
+path is built by nearest-neighbour search over a uniform grid and it is then
+improved by 2-opt and Or-opt moves limited to a window of nearby positions in
+the path. Once no move improves the path, a number of seeded perturbations
+proportional to the number of stamps follows, each one locally re-optimized
+(iterated local search).
+
+Stamps of different types (diameters) require reconfiguring the dispenser,
+which costs more time than a short travel. The dispense planner therefore
+compares a single path through all stamps with paths grouped by stamp type
+and picks the plan with the shortest expected cycle time.
+
+The search is bounded by the number of passes and perturbations, so the
+result depends only on the input and the seed, not on the machine load. The
+wall-clock time limit is only a safety cap; normal inputs finish well below
+it.
+"""
+
+import math
+import random
+import time
+from dataclasses import dataclass
+from itertools import permutations
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+Point = Tuple[int, int]
+
+DEFAULT_TIME_LIMIT = 120 # seconds
+DEFAULT_WINDOW = 24
+DEFAULT_SEED = 0
+# Limit of the improvement passes over the path (or its part)
+MAX_PASSES = 50
+# Number of the perturbation rounds and the length of the perturbed part of
+# the path
+PERTURBATIONS_PER_POINT = 1
+MAX_PERTURBATIONS = 1000
+PERTURBATION_SPAN = 8
+# Above this number of stamp types we do not try all orders of the groups
+MAX_PERMUTED_GROUPS = 6
+
+@dataclass
+class GluePath:
+    order: List[int] # Indices into the input points
+    initialLength: float # Length of the path in the input order
+    length: float # Length of the optimized path
+
+
+class _Grid:
+    """
+    Uniform grid over points supporting removal and nearest neighbour query.
+    """
+    def __init__(self, points: Sequence[Point]) -> None:
+        self._points = points
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+        self._minX, self._minY = min(xs), min(ys)
+        area = max(max(xs) - self._minX, 1) * max(max(ys) - self._minY, 1)
+        # Aim for about two points per cell
+        self._cellSize = max(math.sqrt(2 * area / len(points)), 1)
+        self._cells: Dict[Tuple[int, int], List[int]] = {}
+        for i, p in enumerate(points):
+            self._cells.setdefault(self._cell(p), []).append(i)
+        self._maxRing = max(self._cell((max(xs), max(ys))))
+        self._count = len(points)
+
+    def _cell(self, p: Point) -> Tuple[int, int]:
+        return (int((p[0] - self._minX) // self._cellSize),
+                int((p[1] - self._minY) // self._cellSize))
+
+    def remove(self, i: int) -> None:
+        self._cells[self._cell(self._points[i])].remove(i)
+        self._count -= 1
+
+    def nearest(self, p: Point) -> Optional[int]:
+        if self._count == 0:
+            return None
+        cx, cy = self._cell(p)
+        best, bestDist = None, math.inf
+        ring = 0
+        # Points in ring r + 1 are at least r cells away
+        while ring <= self._maxRing + max(abs(cx), abs(cy)) and \
+              (ring - 1) * self._cellSize <= bestDist:
+            for x in range(cx - ring, cx + ring + 1):
+                for y in range(cy - ring, cy + ring + 1):
+                    if max(abs(x - cx), abs(y - cy)) != ring:
+                        continue
+                    for i in self._cells.get((x, y), []):
+                        d = _dist(p, self._points[i])
+                        if d < bestDist:
+                            best, bestDist = i, d
+            ring += 1
+        return best
+
+
+def _dist(a: Point, b: Point) -> float:
+    return math.hypot(a[0] - b[0], a[1] - b[1])
+
+def pathLength(points: Sequence[Point], order: Sequence[int]) -> float:
+    return sum(_dist(points[a], points[b]) for a, b in zip(order, order[1:]))
+
+def _nearestNeighbourPath(points: Sequence[Point]) -> List[int]:
+    grid = _Grid(points)
+    # Start in the corner closest to the origin of the board
+    minX = min(p[0] for p in points)
+    minY = min(p[1] for p in points)
+    current = min(range(len(points)),
+                  key=lambda i: _dist(points[i], (minX, minY)))
+    grid.remove(current)
+    order = [current]
+    while True:
+        current = grid.nearest(points[current])
+        if current is None:
+            return order
+        grid.remove(current)
+        order.append(current)
+
+
+class _PathImprover:
+    """
+    Local search over an open path. Moves are limited to a window of positions
+    and to a range of the path, so they are cheap to evaluate and a
+    perturbation can be re-optimized locally.
+    """
+    def __init__(self, points: Sequence[Point], order: List[int], window: int,
+                 deadline: float) -> None:
+        self.points = points
+        self.order = order
+        self.window = window
+        self.deadline = deadline
+
+    def _d(self, i: int, j: int) -> float:
+        """
+        Distance between stamps at path positions i and j. Positions outside
+        the path represent free start and end.
+        """
+        n = len(self.order)
+        if i < 0 or j < 0 or i >= n or j >= n:
+            return 0
+        return _dist(self.points[self.order[i]], self.points[self.order[j]])
+
+    def optimize(self, lo: int, hi: int) -> None:
+        """
+        Apply improving moves within positions lo..hi until there is none or
+        the pass limit is reached.
+        """
+        improved = True
+        passes = 0
+        while improved and passes < MAX_PASSES and time.monotonic() < self.deadline:
+            improved = self._twoOpt(lo, hi)
+            improved = self._orOpt(lo, hi) or improved
+            passes += 1
+
+    def _twoOpt(self, lo: int, hi: int) -> bool:
+        # Reverse order[i..j]
+        improved = False
+        for i in range(lo, hi):
+            if time.monotonic() >= self.deadline:
+                break
+            for j in range(i + 1, min(i + self.window, hi) + 1):
+                delta = self._d(i - 1, j) + self._d(i, j + 1) \
+                      - self._d(i - 1, i) - self._d(j, j + 1)
+                if delta < -1e-9:
+                    self.order[i:j + 1] = reversed(self.order[i:j + 1])
+                    improved = True
+        return improved
+
+    def _orOpt(self, lo: int, hi: int) -> bool:
+        # Move segment order[i..i + k - 1] between positions p and p + 1
+        improved = False
+        for k in range(1, 4):
+            i = lo
+            while i + k - 1 <= hi:
+                if self._moveSegment(i, k, lo, hi):
+                    improved = True
+                i += 1
+        return improved
+
+    def _moveSegment(self, i: int, k: int, lo: int, hi: int) -> bool:
+        j = i + k - 1
+        removeGain = self._d(i - 1, i) + self._d(j, j + 1) - self._d(i - 1, j + 1)
+        if removeGain <= 1e-9:
+            return False
+        bestDelta, bestMove = -1e-9, None
+        for p in range(max(lo - 1, i - self.window), min(hi, j + self.window) + 1):
+            if i - 1 <= p <= j:
+                continue
+            edge = self._d(p, p + 1)
+            forward = self._d(p, i) + self._d(j, p + 1) - edge - removeGain
+            backward = self._d(p, j) + self._d(i, p + 1) - edge - removeGain
+            if forward < bestDelta:
+                bestDelta, bestMove = forward, (p, False)
+            if backward < bestDelta:
+                bestDelta, bestMove = backward, (p, True)
+        if bestMove is None:
+            return False
+        p, reverse = bestMove
+        segment = self.order[i:j + 1]
+        if reverse:
+            segment.reverse()
+        if p > j:
+            self.order[i:p + 1] = self.order[j + 1:p + 1] + segment
+        else:
+            self.order[p + 1:j + 1] = segment + self.order[p + 1:i]
+        return True
+
+    def perturb(self, rng: random.Random) -> None:
+        """
+        Apply a random double-bridge move in a window, re-optimize the
+        neighbourhood and keep the result only if it is shorter.
+        """
+        n = len(self.order)
+        span = min(PERTURBATION_SPAN, n - 1)
+        a = rng.randrange(0, n - span)
+        b, c = sorted(rng.sample(range(a + 1, a + span + 1), 2)) if span >= 2 else (a + 1, a + 1)
+        lo, hi = max(a - 1, 0), min(a + span + 1, n - 1)
+        before = self._rangeLength(lo, hi)
+        backup = self.order[lo:hi + 1]
+        # A B C D -> A C B D, where B = order[a + 1..b], C = order[b + 1..c]
+        self.order[a + 1:c + 1] = self.order[b + 1:c + 1] + self.order[a + 1:b + 1]
+        self.optimize(lo, hi)
+        if self._rangeLength(lo, hi) >= before - 1e-9:
+            self.order[lo:hi + 1] = backup
+
+    def _rangeLength(self, lo: int, hi: int) -> float:
+        return sum(self._d(i, i + 1) for i in range(lo - 1, hi + 1))
+
+
+def optimizeGluePath(points: Sequence[Point], timeLimit: float=DEFAULT_TIME_LIMIT,
+                     seed: int=DEFAULT_SEED, window: int=DEFAULT_WINDOW) -> GluePath:
+    """
+    Find a short open path visiting all the points. The time limit (in
+    seconds) is a safety cap, when reached, the result is no longer
+    deterministic.
+    """
+    initialLength = pathLength(points, range(len(points)))
+    if len(points) < 3:
+        return GluePath(list(range(len(points))), initialLength, initialLength)
+
+    deadline = time.monotonic() + timeLimit
+    improver = _PathImprover(points, _nearestNeighbourPath(points), window, deadline)
+    improver.optimize(0, len(points) - 1)
+    rng = random.Random(seed)
+    for _ in range(min(PERTURBATIONS_PER_POINT * len(points), MAX_PERTURBATIONS)):
+        if time.monotonic() >= deadline:
+            break
+        improver.perturb(rng)
+    return GluePath(improver.order, initialLength,
+                    pathLength(points, improver.order))
+
+
+@dataclass
+class DispensePlan:
+    order: List[int] # Indices into the input stamps
+    grouped: bool # Are the stamps dispensed grouped by their type?
+    initialTravelLength: float # Travel length in the input order
+    travelLength: float
+    travelTime: float # seconds
+    dwellTime: float # seconds
+    switches: int # Number of stamp type changes
+    switchTime: float # seconds
+
+    @property
+    def cycleTime(self) -> float:
+        return self.travelTime + self.dwellTime + self.switchTime
+
+    @property
+    def travelReduction(self) -> float:
+        """
+        Relative reduction of the travel length against the input order
+        """
+        if self.initialTravelLength == 0:
+            return 0
+        return 1 - self.travelLength / self.initialTravelLength
+
+
+def _countSwitches(kinds: Sequence[Hashable], order: Sequence[int]) -> int:
+    return sum(1 for a, b in zip(order, order[1:]) if kinds[a] != kinds[b])
+
+def _groupedOrder(points: Sequence[Point], groups: List[List[int]]) -> List[int]:
+    """
+    Given optimized paths of the individual groups, find the order and the
+    direction of the groups that minimizes the travel between them.
+    """
+    candidates = permutations(groups) if len(groups) <= MAX_PERMUTED_GROUPS \
+                 else [groups]
+    best, bestLength = None, math.inf
+    for candidate in candidates:
+        # Pick the direction of each group greedily with respect to the end
+        # of the previous group
+        order = list(candidate[0])
+        length = 0.0
+        for group in candidate[1:]:
+            end = points[order[-1]]
+            forward = _dist(end, points[group[0]])
+            backward = _dist(end, points[group[-1]])
+            if backward < forward:
+                order += reversed(group)
+                length += backward
+            else:
+                order += group
+                length += forward
+        if length < bestLength:
+            best, bestLength = order, length
+    assert best is not None
+    return best
+
+def planDispense(points: Sequence[Point], kinds: Sequence[Hashable],
+                 dwell: Dict[Hashable, float], travelSpeed: float,
+                 switchPenalty: float, timeLimit: float=DEFAULT_TIME_LIMIT,
+                 seed: int=DEFAULT_SEED) -> DispensePlan:
+    """
+    Plan the order of dispensing glue stamps to minimize the expected cycle
+    time. Each stamp has a kind; dwell gives the time spent dispensing a stamp
+    of given kind, switchPenalty is the time of changing the kind between two
+    consecutive stamps and travelSpeed is in units of points per second. The
+    time limit is a safety cap of the whole planning.
+    """
+    def makePlan(order: List[int], grouped: bool) -> DispensePlan:
+        length = pathLength(points, order)
+        switches = _countSwitches(kinds, order)
+        return DispensePlan(order=order, grouped=grouped,
+                            initialTravelLength=initialLength,
+                            travelLength=length,
+                            travelTime=length / travelSpeed,
+                            dwellTime=sum(dwell[kinds[i]] for i in order),
+                            switches=switches,
+                            switchTime=switches * switchPenalty)
+
+    initialLength = pathLength(points, range(len(points)))
+    groups: Dict[Hashable, List[int]] = {}
+    for i, kind in enumerate(kinds):
+        groups.setdefault(kind, []).append(i)
+    deadline = time.monotonic() + timeLimit
+    remaining = lambda: max(deadline - time.monotonic(), 0)
+    if len(groups) <= 1:
+        path = optimizeGluePath(points, remaining(), seed)
+        return makePlan(path.order, True)
+
+    mixed = optimizeGluePath(points, remaining(), seed)
+    groupPaths = []
+    for indices in groups.values():
+        path = optimizeGluePath([points[i] for i in indices], remaining(), seed)
+        groupPaths.append([indices[i] for i in path.order])
+
+    return min(makePlan(mixed.order, False),
+               makePlan(_groupedOrder(points, groupPaths), True),
+               key=lambda plan: plan.cycleTime)
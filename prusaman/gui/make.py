@@ -14,6 +14,8 @@ from ..params import RESOURCES
 from ..dialogs.prusamanExport import PrusamanExportBase
 from ..project import PrusamanProject
 from ..manugenerator import Manugenerator, BoardError
+from ..archive import DEFAULT_COMPRESSION_LEVEL
+from ..daemon import DaemonClient
 from ..util import locatePythonInterpreter, replaceDirectory
 from ..wxAnyThread import anythread
 
@@ -63,7 +65,69 @@ class PrusamanExport(PrusamanExportBase):
             abandon()
             reportException(e, traceback.format_exc())
 
+    def runWithProgress(self, function):
+        """
+        Run the function in a separate thread while pulsing the progress bar.
+        Propagate the exception raised by the function.
+        """
+        exception = None
+        def work():
+            nonlocal exception
+            try:
+                function()
+            except Exception as e:
+                exception = e
+        t = Thread(target=work)
+        t.start()
+        while True:
+            wx.CallAfter(lambda: self.outputProgressbar.Pulse())
+            t.join(0.1)
+            if not t.is_alive():
+                break
+        if exception is not None:
+            raise exception
+
     def doExportWork(self, outDir, project):
+        client = DaemonClient()
+        if client.available():
+            self.doDaemonExportWork(client, outDir, project)
+        else:
+            self.doLocalExportWork(outDir, project)
+
+    def doDaemonExportWork(self, client, outDir, project):
+        try:
+            result = None
+            def work():
+                nonlocal result
+                result = client.make(project.getDir(), outDir, force=True,
+                                     werror=self.werrorCheckbox.GetValue(),
+                                     defaultAnswer=None, noCache=False,
+                                     compressionLevel=DEFAULT_COMPRESSION_LEVEL,
+                                     offline=False, panelDrc="full",
+                                     reportInfo=self.onInfo,
+                                     reportWarning=self.onWarning,
+                                     reportError=self.onError,
+                                     askContinuation=self.onPrompt)
+            self.onInfo("", "Starting export in Prusaman daemon")
+            self.runWithProgress(work)
+            if result["status"] != "ok":
+                details = f"{result['message']}\n\nBuild artifacts are stored in {result.get('faileddir')}"
+                if result["status"] == "failed":
+                    raise BoardError(details)
+                raise RuntimeError(f"{details}\n\n{result.get('traceback', '')}")
+            self.onInfo("", "Finished, all files were successfully generated.")
+
+            wx.CallAfter(lambda: self.outputProgressbar.SetValue(self.outputProgressbar.GetRange()))
+            wx.CallAfter(lambda: self.onFinish(outDir))
+        except Exception as e:
+            self.onError("", f"Error occured: {e}")
+            reportException(e, traceback.format_exc())
+            wx.CallAfter(lambda: self.outputProgressbar.SetValue(0))
+        finally:
+            wx.CallAfter(lambda: self.exportButton.SetLabelText(self.oldLabel))
+            wx.CallAfter(lambda: self.exportButton.Enable())
+
+    def doLocalExportWork(self, outDir, project):
         # We use temporary directory so we do not damage any existing files in
         # process. Once we are done, we atomically swap the directories
         tmpdir = Path(outDir).resolve()
@@ -73,28 +137,15 @@ class PrusamanExport(PrusamanExportBase):
         shutil.rmtree(faileddir, ignore_errors=True)
         shutil.rmtree(tmpdir, ignore_errors=True)
         try:
-            exception = None
             def work():
-                nonlocal exception
-                try:
-                    generator = Manugenerator(project, tmpdir,
-                                    reportInfo=self.onInfo,
-                                    reportWarning=self.onWarning,
-                                    reportError=self.onError,
-                                    askContinuation=self.onPrompt)
-                    generator.make()
-                except Exception as e:
-                    exception = e
+                generator = Manugenerator(project, tmpdir,
+                                reportInfo=self.onInfo,
+                                reportWarning=self.onWarning,
+                                reportError=self.onError,
+                                askContinuation=self.onPrompt)
+                generator.make()
             self.onInfo("", "Starting export")
-            t = Thread(target=work)
-            t.start()
-            while True:
-                wx.CallAfter(lambda: self.outputProgressbar.Pulse())
-                t.join(0.1)
-                if not t.is_alive():
-                    break
-            if exception is not None:
-                raise exception
+            self.runWithProgress(work)
 
             if self.werrorCheckbox.GetValue() and self.triggered:
                 raise BoardError("Warnings were treated as errors.\nSee warnings in the output box.")
@@ -0,0 +1,146 @@
+"""
+In-process generation of the interactive HTML BOM. iBom is bundled as a
+resource, so we import it from there and drive it as a library: it receives
+an already loaded board and the fields of the components from the schematics
+instead of a netlist file.
+"""
+
+import argparse
+import io
+import os
+import sys
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List
+
+import pcbnew # type: ignore
+from kikit.eeschema_v6 import Symbol, getReference # type: ignore
+
+from .netlist import ibomFields
+from .params import RESOURCES
+
+IBOM_PATH = RESOURCES / "ibom"
+IBOM_OPTIONS = ["--no-browser", "--dark-mode",
+                "--extra-fields", "ID,Osazovat/Nakupovat",
+                "--name-format", "%f-ibom"]
+
+# Prevent iBom from registering its action plugin and from touching the
+# display
+IBOM_ENVIRONMENT = {
+    "INTERACTIVE_HTML_BOM_CLI_MODE": "1",
+    "INTERACTIVE_HTML_BOM_NO_DISPLAY": "1"
+}
+
+Reporter = Callable[[str, str], None]
+
+def _formatMessage(args: tuple) -> str:
+    # iBom logs printf-style like the logging module
+    if len(args) == 0:
+        return ""
+    if len(args) == 1:
+        return str(args[0])
+    return str(args[0]) % args[1:]
+
+class _ReporterLogger:
+    """
+    iBom logger that routes the messages to the reporters
+    """
+    def __init__(self, reportInfo: Reporter, reportWarning: Reporter,
+                 reportError: Reporter) -> None:
+        self._reportInfo = reportInfo
+        self._reportWarning = reportWarning
+        self._reportError = reportError
+
+    def info(self, *args) -> None:
+        self._reportInfo("IBOM", _formatMessage(args))
+
+    def warn(self, *args) -> None:
+        self._reportWarning("IBOM", _formatMessage(args))
+
+    def error(self, *args) -> None:
+        self._reportError("IBOM", _formatMessage(args))
+
+@contextmanager
+def _ibomEnvironment() -> Iterator[None]:
+    """
+    Set the iBom environment variables only for the duration of the block, so
+    they do not leak into the rest of the (possibly long-living) process.
+    """
+    original = {k: os.environ.get(k) for k in IBOM_ENVIRONMENT}
+    os.environ.update(IBOM_ENVIRONMENT)
+    try:
+        yield
+    finally:
+        for k, v in original.items():
+            if v is None:
+                del os.environ[k]
+            else:
+                os.environ[k] = v
+
+def _importIbom():
+    # The bundled iBom has to take precedence over any installed one as the
+    # parser below is written against it
+    if str(IBOM_PATH) not in sys.path:
+        sys.path.insert(0, str(IBOM_PATH))
+    from InteractiveHtmlBom.core import ibom # type: ignore
+    from InteractiveHtmlBom.core.config import Config # type: ignore
+    from InteractiveHtmlBom.ecad import common # type: ignore
+    from InteractiveHtmlBom.ecad.kicad import PcbnewParser # type: ignore
+    from InteractiveHtmlBom.version import version # type: ignore
+
+    class SymbolFieldsParser(PcbnewParser):
+        """
+        Pcbnew parser that takes the extra fields from the given component
+        fields instead of a netlist file.
+        """
+        def __init__(self, fileName: str, config: Config, logger: _ReporterLogger,
+                     board: pcbnew.BOARD, fields: Dict[str, Dict[str, str]]) -> None:
+            super().__init__(fileName, config, logger, board)
+            self._fields = fields
+
+        def get_extra_field_data(self, file_name):
+            names = sorted(set(n for f in self._fields.values() for n in f.keys()))
+            # Older iBom versions represent the data as a tuple
+            if not hasattr(common, "ExtraFieldData"):
+                return names, self._fields
+            return common.ExtraFieldData(names, self._fields)
+
+    return ibom, Config, SymbolFieldsParser, version
+
+def generateIbom(board: pcbnew.BOARD, boardPath: Path, symbols: List[Symbol],
+                 outdir: Path, reportInfo: Reporter, reportWarning: Reporter,
+                 reportError: Reporter) -> None:
+    """
+    Generate iBom of a loaded board into outdir. The board is not modified.
+    """
+    with _ibomEnvironment():
+        _generateIbom(board, boardPath, symbols, outdir, reportInfo,
+                      reportWarning, reportError)
+
+def _generateIbom(board: pcbnew.BOARD, boardPath: Path, symbols: List[Symbol],
+                  outdir: Path, reportInfo: Reporter, reportWarning: Reporter,
+                  reportError: Reporter) -> None:
+    ibom, Config, SymbolFieldsParser, version = _importIbom()
+
+    boardPath = Path(boardPath).resolve()
+    config = Config(version, str(boardPath.parent))
+    argParser = argparse.ArgumentParser()
+    config.add_options(argParser, version)
+    config.set_from_args(argParser.parse_args(
+        IBOM_OPTIONS + ["--dest-dir", str(Path(outdir).resolve())]))
+    # iBom asks for the extra fields only if there is a data file. We provide
+    # the fields directly, so any existing file will do.
+    config.extra_data_file = str(boardPath)
+
+    fields = {getReference(s): ibomFields(s) for s in symbols}
+    logger = _ReporterLogger(reportInfo, reportWarning, reportError)
+    parser = SymbolFieldsParser(str(boardPath), config, logger, board, fields)
+
+    output = io.StringIO()
+    try:
+        with redirect_stdout(output), redirect_stderr(output):
+            ibom.main(parser, config, logger)
+    except Exception as e:
+        raise RuntimeError(f"Ibom generation of {boardPath} failed: {e}") from e
+    finally:
+        reportInfo("IBOM", output.getvalue())
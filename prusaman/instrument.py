@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, TextIO
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None # type: ignore
+
+@dataclass
+class Measurement:
+    """
+    Accumulated cost of a named operation. Times are in seconds, peak RSS is
+    in bytes and it is the peak during the operation including the child
+    processes it started (e.g., KiKit or iBOM).
+    """
+    name: str
+    calls: int = 0
+    wallTime: float = 0
+    cpuTime: float = 0
+    peakRss: Optional[int] = None
+    boardLoads: int = 0
+
+    def add(self, other: Measurement) -> None:
+        self.calls += other.calls
+        self.wallTime += other.wallTime
+        self.cpuTime += other.cpuTime
+        self.boardLoads += other.boardLoads
+        if other.peakRss is not None:
+            self.peakRss = max(self.peakRss or 0, other.peakRss)
+
+
+def _cpuTime() -> float:
+    """
+    CPU time of the process and its finished children
+    """
+    if resource is None:
+        return time.process_time()
+    s = resource.getrusage(resource.RUSAGE_SELF)
+    c = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return s.ru_utime + s.ru_stime + c.ru_utime + c.ru_stime
+
+# Sampling period of the resident set size
+RSS_SAMPLING_INTERVAL = 0.1
+
+def _pageSize() -> int:
+    try:
+        return os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return 4096
+
+def _processRss(pid: int) -> int:
+    """
+    Current resident set size of a process in bytes, 0 if it does not exist
+    """
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * _pageSize()
+    except (OSError, ValueError, IndexError):
+        return 0
+
+def _descendants(pid: int) -> Set[int]:
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The process name is parenthesized and it can contain spaces
+        parent = int(stat[stat.rindex(")") + 2:].split()[1])
+        children.setdefault(parent, []).append(int(entry))
+    result: Set[int] = set()
+    pending = children.get(pid, [])
+    while len(pending) > 0:
+        child = pending.pop()
+        result.add(child)
+        pending.extend(children.get(child, []))
+    return result
+
+class _RssSampler:
+    """
+    Samples the resident set size of the process and of the child processes
+    started during the sampling, keeps the peak. The rusage of the process
+    holds only the lifetime peak, so we sample in a thread. The RSS is read
+    from /proc, on other platforms the peak is not available.
+    """
+    supported = os.path.exists("/proc/self/statm")
+
+    def __init__(self) -> None:
+        self.peak: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._pid = os.getpid()
+        # The children that already exist (e.g., workers of the scheduler)
+        # belong to other measurements
+        self._excluded = _descendants(self._pid) if self.supported else set()
+
+    def __enter__(self) -> _RssSampler:
+        if self.supported:
+            self._sample()
+            self._thread.start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        if self.supported:
+            self._stop.set()
+            self._thread.join()
+            self._sample()
+
+    def _run(self) -> None:
+        while not self._stop.wait(RSS_SAMPLING_INTERVAL):
+            self._sample()
+
+    def _sample(self) -> None:
+        children = _descendants(self._pid) - self._excluded
+        rss = _processRss(self._pid) + sum(_processRss(c) for c in children)
+        self.peak = max(self.peak or 0, rss)
+
+
+class Instrumentation:
+    """
+    Collects wall time, CPU time, peak RSS and the number of board loads of
+    named operations. The measurements of worker processes can be merged.
+    """
+    def __init__(self, boardLoads: Optional[Callable[[], int]]=None) -> None:
+        self._boardLoads = boardLoads if boardLoads is not None else lambda: 0
+        self._measurements: Dict[str, Measurement] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, name: str) -> Iterator[None]:
+        wallStart = time.perf_counter()
+        cpuStart = _cpuTime()
+        loadsStart = self._boardLoads()
+        sampler = _RssSampler()
+        try:
+            with sampler:
+                yield
+        finally:
+            self.record(Measurement(
+                name=name,
+                calls=1,
+                wallTime=time.perf_counter() - wallStart,
+                cpuTime=_cpuTime() - cpuStart,
+                peakRss=sampler.peak,
+                boardLoads=self._boardLoads() - loadsStart))
+
+    def record(self, measurement: Measurement) -> None:
+        with self._lock:
+            if measurement.name not in self._measurements:
+                self._measurements[measurement.name] = Measurement(measurement.name)
+            self._measurements[measurement.name].add(measurement)
+
+    def merge(self, measurements: List[Measurement]) -> None:
+        for m in measurements:
+            self.record(m)
+
+    @property
+    def measurements(self) -> List[Measurement]:
+        with self._lock:
+            return [Measurement(**asdict(m)) for m in self._measurements.values()]
+
+    def toJson(self) -> List[Dict[str, Any]]:
+        return [asdict(m) for m in self.measurements]
+
+    def writeTable(self, file: TextIO) -> None:
+        measurements = self.measurements
+        if len(measurements) == 0:
+            return
+        namePad = max([len("Operation")] + [len(m.name) for m in measurements])
+        file.write(f"{'Operation':<{namePad}} | Calls |  Wall [s] |   CPU [s] | Peak RSS [MB] | Board loads\n")
+        for m in measurements:
+            rss = "-" if m.peakRss is None else f"{m.peakRss / 1024 ** 2:.0f}"
+            file.write(f"{m.name:<{namePad}} | {m.calls:>5} | {m.wallTime:>9.2f} | " +
+                       f"{m.cpuTime:>9.2f} | {rss:>13} | {m.boardLoads:>11}\n")
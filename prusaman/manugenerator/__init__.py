@@ -2,31 +2,42 @@ from __future__ import annotations
 
 import enum
 import glob
+import json
 import os
 import shutil
-import subprocess
 import sys
 import textwrap
+import threading
 from datetime import datetime
 from pathlib import Path
-from tempfile import NamedTemporaryFile
-from typing import Callable, List, Optional, Tuple, TypeVar, Union
+from tempfile import mkdtemp
+from typing import (Any, Callable, ContextManager, Dict, List, Optional, Tuple,
+                    TypeVar, Union)
 
+import kikit
+import pcbnew # type: ignore
 from kikit.eeschema_v6 import (Symbol, extractComponents,  # type: ignore
                                getField, getReference)
 
 import prusaman
 
+from ..archive import DEFAULT_COMPRESSION_LEVEL
 from ..bom import BomFilter, PnBFilter
-from ..netlist import exportIBomNetlist
+from ..boardpool import BoardPool
+from ..cache import BuildCache, Fingerprint, LogRecord
+from ..components import ComponentModel
+from ..instrument import Instrumentation
+from ..ibom import generateIbom
 from ..params import RESOURCES
 from ..project import PrusamanProject
-from ..util import defaultTo, locatePythonInterpreter, zipFiles
+from ..util import defaultTo, zipFiles
 from .panelStage import PanelStageMixin
 from .validationStage import ValidationStageMixin
 from .millStage import MillStageMixin
 from .smtStage import SmtStageMixin
 from .sourcingStage import SourcingStageMixin
+from .scheduler import (IBOM, MILL_BOARD, PANEL_BOARD, PARSED_BOM,
+                        VALIDATED_SOURCE, Stage, StageScheduler)
 from .common import BoardError
 
 T = TypeVar("T")
@@ -60,7 +71,10 @@ class Manugenerator(ValidationStageMixin, PanelStageMixin, MillStageMixin,
                  reportInfo: Optional[OutputReporter]=None,
                  reportWarning: Optional[OutputReporter]=None,
                  reportError: Optional[OutputReporter]=None,
-                 askContinuation: Optional[ContinuationPrompt]=None) -> None:
+                 askContinuation: Optional[ContinuationPrompt]=None,
+                 jobs: int=1, cache: Optional[BuildCache]=None,
+                 compressionLevel: int=DEFAULT_COMPRESSION_LEVEL,
+                 offline: bool=False, panelDrc: str="full") -> None:
         """
         Construct the object that generates the output. This is an object
         instead of function, so we can implicitly pass reporters and other
@@ -73,27 +87,97 @@ class Manugenerator(ValidationStageMixin, PanelStageMixin, MillStageMixin,
                          deduced from the project.
         - reportInfo: A callback to report logs
         - reportWarning: A callback to report warnings
+        - jobs: number of worker processes used to run independent stages
+        - cache: build cache to reuse outputs of stages with unchanged inputs.
+                 If not specified, everything is rebuilt.
+        - compressionLevel: deflate level (0-9) of the produced archives
+        - offline: do not contact GitHub, validate footprints against the last
+                   synchronized library
+        - panelDrc: "full" checks the whole panel, "instances" checks only the
+                    panel outside the interiors of the board instances
         """
         self._project: PrusamanProject = project
         self._outputdir: Path = Path(outputdir)
+        self._jobs: int = jobs
+        # Worker processes a single stage may use (e.g., for plotting). When
+        # the stages run in parallel, the scheduler takes the whole budget.
+        self._stageJobs: int = jobs
+        self._compressionLevel: int = compressionLevel
+        self._offline: bool = offline
+        self._panelDrc: str = panelDrc
+        self._log: List[Tuple[Severity, str, str]] = []
+        self._componentModel: Optional[ComponentModel] = None
+        # Build-private directory for intermediate results shared by stages.
+        # It exists only during make.
+        self._scratchdir: Optional[Path] = None
+        self._cache: Optional[BuildCache] = cache
+        self._captured = threading.local()
+        self._boards = BoardPool()
+        self._instrumentation = Instrumentation(lambda: self._boards.loads)
+        self._attachReporters(reportInfo, reportWarning, reportError, askContinuation)
+
+    def _attachReporters(self, reportInfo: Optional[OutputReporter]=None,
+                         reportWarning: Optional[OutputReporter]=None,
+                         reportError: Optional[OutputReporter]=None,
+                         askContinuation: Optional[ContinuationPrompt]=None) -> None:
         self._infoReporter: OutputReporter = defaultTo(reportInfo, stderrReporter)
         self._warningReporter: OutputReporter = defaultTo(reportWarning, stderrReporter)
         self._errorReporter: OutputReporter = defaultTo(reportError, stderrReporter)
         self._askContinuation: ContinuationPrompt = defaultTo(askContinuation, stdioPrompt)
-        self._log: List[Tuple[Severity, str, str]] = []
+
+    # The generator is shipped to worker processes, however, the reporters are
+    # bound to the coordinating process. Workers attach their own.
+    _PROCESS_LOCAL = ["_infoReporter", "_warningReporter", "_errorReporter",
+                      "_askContinuation", "_log", "_captured", "_boards",
+                      "_instrumentation"]
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {k: v for k, v in self.__dict__.items() if k not in self._PROCESS_LOCAL}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._log = []
+        self._captured = threading.local()
+        self._boards = BoardPool()
+        self._instrumentation = Instrumentation(lambda: self._boards.loads)
+        self._attachReporters()
+
+    def _capture(self, severity: str, tag: str, message: str) -> None:
+        records = getattr(self._captured, "records", None)
+        if records is not None:
+            records.append((severity, tag, message))
 
     def _reportInfo(self, tag: str, message: str) -> None:
         self._log.append((Severity.Info, tag, message))
+        self._capture("info", tag, message)
         self._infoReporter(tag, message)
 
     def _reportWarning(self, tag: str, message: str) -> None:
         self._log.append((Severity.Warning, tag, message))
+        self._capture("warning", tag, message)
         self._warningReporter(tag, message)
 
     def _reportError(self, tag: str, message: str) -> None:
         self._log.append((Severity.Error, tag, message))
+        self._capture("error", tag, message)
         self._errorReporter(tag, message)
 
+    def _replay(self, records: List[LogRecord]) -> None:
+        for severity, tag, message in records:
+            if severity == "info":
+                self._reportInfo(tag, message)
+            elif severity == "warning":
+                self._reportWarning(tag, message)
+            else:
+                self._reportError(tag, message)
+
+    def _measure(self, name: str) -> ContextManager[None]:
+        """
+        Measure the cost of the enclosed block. The results are part of the
+        build metadata.
+        """
+        return self._instrumentation.measure(name)
+
     def _askWarning(self, tag: str, prompt: str, error: str) -> None:
         if not self._askContinuation(tag, prompt):
             raise BoardError(error)
@@ -105,21 +189,58 @@ class Manugenerator(ValidationStageMixin, PanelStageMixin, MillStageMixin,
         self._reportError(message)
         raise BoardError(message)
 
+    def _stages(self) -> List[Stage]:
+        """
+        Return the build plan. The order is the order of serial execution.
+        """
+        return [
+            Stage("VALIDATE", "_makeValidation",
+                  provides=[VALIDATED_SOURCE], inProcess=True),
+            Stage("BOM", "_makeBom", requires=[VALIDATED_SOURCE],
+                  provides=[PARSED_BOM], inProcess=True),
+            Stage("IBOM", "_makeIbomStage",
+                  requires=[VALIDATED_SOURCE, PARSED_BOM], provides=[IBOM]),
+            # The panel stage checks DRC and it might ask the user
+            Stage("PANEL", "_makePanelStage", requires=[VALIDATED_SOURCE],
+                  provides=[PANEL_BOARD], inProcess=True),
+            Stage("PANEL OUTPUTS", "_makePanelOutputs",
+                  requires=[PANEL_BOARD, IBOM]),
+            Stage("MILL", "_makeMillStage", requires=[PANEL_BOARD],
+                  provides=[MILL_BOARD]),
+            Stage("SMT", "_makeSmtStage",
+                  requires=[PANEL_BOARD, MILL_BOARD, PARSED_BOM, IBOM]),
+            Stage("SOURCING", "_makeSourcingStage", requires=[PARSED_BOM]),
+            Stage("SOURCE", "_copySrc", requires=[VALIDATED_SOURCE]),
+        ]
+
+    def _runStage(self, stage: Stage) -> None:
+        with self._measure(f"stage {stage.name}"):
+            getattr(self, stage.method)()
+
     def make(self) -> None:
+        # Keep the scratch directory on the same filesystem as the output, so
+        # the intermediate results can be hardlinked
+        self._outputdir.mkdir(parents=True, exist_ok=True)
+        self._scratchdir = Path(mkdtemp(prefix=".prusaman-scratch-",
+                                        dir=self._outputdir.parent))
         try:
-            self._makeValidation()
-            self._makePanelStage()
-            self._makeMillStage()
-            self._makeSmtStage()
-            self._makeSourcingStage()
-            self._copySrc()
+            with self._measure("build"):
+                StageScheduler(self, self._stages(), self._jobs).run()
         except Exception:
             raise
         finally:
-            self._makeMetadata()
+            shutil.rmtree(self._scratchdir, ignore_errors=True)
+            self._scratchdir = None
             finalArchive = self._outputdir / (self._project.getName() + ".zip")
-            zipFiles(finalArchive, self._outputdir, None,
-                [x for x in glob.glob(str(self._outputdir / "**" / "*")) if os.path.isfile(x)])
+            # The archive contains only the stage directories, so the metadata
+            # can be written after it and they include its timing
+            try:
+                with self._measure("archive"):
+                    zipFiles(finalArchive, self._outputdir, None,
+                        [x for x in glob.glob(str(self._outputdir / "**" / "*")) if os.path.isfile(x)],
+                        compressionLevel=self._compressionLevel)
+            finally:
+                self._makeMetadata()
 
     def _makeMetadata(self):
         self._reportInfo("LOG", "Final log start")
@@ -131,8 +252,17 @@ class Manugenerator(ValidationStageMixin, PanelStageMixin, MillStageMixin,
             now = datetime.now()
             f.write(f"Prusaman version {prusaman.__version__}\n")
             f.write(f"Generated on {now.strftime('%d. %m. %Y, %H:%M:%S')}\n")
+            f.write(f"\nBuild timings (stages include their operations):\n")
+            self._instrumentation.writeTable(f)
             f.write(f"\nThe build log follows:\n")
             self._writeLog(f)
+        with open(self._outputdir / "prusaman-timings.json", "w") as f:
+            json.dump({
+                "version": prusaman.__version__,
+                "generated": now.isoformat(),
+                "jobs": self._jobs,
+                "measurements": self._instrumentation.toJson()
+            }, f, indent=4)
         self._reportInfo("LOG", "Final log finished")
 
     def _writeLog(self, file):
@@ -171,39 +301,120 @@ class Manugenerator(ValidationStageMixin, PanelStageMixin, MillStageMixin,
             t.parent.mkdir(parents=True, exist_ok=True)
             shutil.copy2(s, t)
 
+    def _sourceBoard(self) -> pcbnew.BOARD:
+        """
+        Return the shared instance of the source board. Do not modify it.
+        """
+        return self._boards.get(self._project.getBoard())
+
+    def _stageFingerprint(self, stage: str, dated: bool=False) -> Fingerprint:
+        """
+        Start a fingerprint of stage inputs with the inputs common to all
+        stages - tool versions and the project settings. Stages that expand
+        text templates are dated as the templates can contain the current date.
+        """
+        fingerprint = Fingerprint(self._project.getDir()) \
+            .addText("stage", stage) \
+            .addText("prusaman", prusaman.__version__) \
+            .addText("kikit", kikit.__version__) \
+            .addText("kicad", pcbnew.GetBuildVersion()) \
+            .addFile(self._project.getProject()) \
+            .addText("compression level", str(self._compressionLevel))
+        if "TECHNOLOGY_PARAMS" in self._project.textVars:
+            paramsName = self._project.textVars["TECHNOLOGY_PARAMS"]
+            fingerprint.addFile(RESOURCES / "designRules" / (paramsName + ".json"))
+        if dated:
+            fingerprint.addText("date", datetime.today().strftime("%Y-%m-%d"))
+        return fingerprint
+
+    def _schemaFiles(self) -> List[Path]:
+        return self._components.sheetFiles
+
+    def _cachedStage(self, tag: str, outdir: Path, fingerprint: Optional[Fingerprint],
+                     build: Callable[[], None]) -> None:
+        """
+        Run build that produces files into outdir unless there are cached
+        outputs for the fingerprint. The messages reported by the build are
+        cached as well and they are replayed on cache hit. Without a
+        fingerprint, the stage inputs are not known and the build always runs.
+        """
+        if self._cache is None or fingerprint is None:
+            build()
+            return
+        key = fingerprint.hexdigest()
+        entry = self._cache.lookup(key)
+        if entry is not None:
+            self._reportInfo(tag, "Inputs did not change, reusing cached outputs")
+            entry.restore(outdir)
+            self._replay(entry.log)
+            return
+
+        outdir.mkdir(parents=True, exist_ok=True)
+        existing = set(p for p in outdir.glob("**/*") if p.is_file())
+        self._captured.records = []
+        try:
+            build()
+            records = self._captured.records
+        finally:
+            self._captured.records = None
+        produced = [p for p in outdir.glob("**/*") if p.is_file() and p not in existing]
+        self._cache.store(key, outdir, produced, records)
+
+    @property
+    def _components(self) -> ComponentModel:
+        """
+        The component model of the project. It is built on the first access and
+        then it is shared by all stages.
+        """
+        if self._componentModel is None:
+            self._componentModel = ComponentModel.fromFile(
+                self._project.getSchema(), self._bomFilter)
+        return self._componentModel
+
+    def _makeBom(self) -> None:
+        # Build the model in the coordinating process, so the workers get it
+        # already parsed.
+        self._components
+
     def _fileName(self, prefix: str) -> str:
         return f"{prefix}-{self._project.getName()}"
 
-    def _makeIbom(self, source: Path, outdir: Path) -> None:
-        with NamedTemporaryFile(mode="w", prefix="ibomnet_", suffix=".net",
-                                delete=False) as f:
+    def _ibomDir(self) -> Path:
+        assert self._scratchdir is not None
+        return self._scratchdir / "ibom"
+
+    def _makeIbomStage(self) -> None:
+        """
+        Generate the iBOM of the source board once per build. The stages that
+        ship it take a copy via _placeIbom.
+        """
+        outdir = self._ibomDir()
+        outdir.mkdir(parents=True, exist_ok=True)
+        fingerprint = self._stageFingerprint("IBOM") \
+            .addFile(self._project.getBoard()) \
+            .addFiles(self._schemaFiles())
+        self._cachedStage("IBOM", outdir, fingerprint,
+                          lambda: self._makeIbom(self._project.getBoard(), outdir))
+
+    def _placeIbom(self, outdir: Path) -> None:
+        """
+        Place the iBOM generated by the IBOM stage into outdir. The files are
+        never modified after generation, so we hardlink them when possible.
+        """
+        for source in self._ibomDir().iterdir():
+            destination = outdir / source.name
             try:
-                bom = extractComponents(str(self._project.getSchema()))
-                exportIBomNetlist(f, bom)
-                f.close()
-
-                env = os.environ.copy()
-                env["INTERACTIVE_HTML_BOM_NO_DISPLAY"] = "1"
-
-                ibomBinary = RESOURCES / "ibom" / "InteractiveHtmlBom" / "generate_interactive_bom.py"
-                command = [locatePythonInterpreter(), str(ibomBinary), "--no-browser",
-                        "--dark-mode", "--extra-fields", "ID,Osazovat/Nakupovat",
-                        "--name-format", "%f-ibom",
-                        "--netlist-file", f.name,
-                        "--dest-dir", str(outdir), str(source)]
-                result = subprocess.run(command, capture_output=True, env=env)
-                stdout = result.stdout.decode("utf-8")
-                stderr = result.stderr.decode("utf-8")
-                if result.returncode != 0:
-                    self._reportError("IBOM", stdout)
-                    self._reportError("IBOM", stderr)
-                    message = f"Ibom generation of {source} failed with code {result.returncode}."
-                    raise RuntimeError(message)
-                self._reportInfo("IBOM", stdout)
-                self._reportInfo("IBOM", stderr)
-            finally:
-                f.close()
-                os.unlink(f.name)
+                os.link(source, destination)
+            except OSError:
+                shutil.copyfile(source, destination)
+
+    def _makeIbom(self, source: Path, outdir: Path) -> None:
+        with self._measure("makeIbom"):
+            generateIbom(self._boards.get(source), source,
+                         self._components.symbols, outdir,
+                         reportInfo=self._reportInfo,
+                         reportWarning=self._reportWarning,
+                         reportError=self._reportError)
 
     def _commonBomFilter(self, item: Symbol) -> bool:
         ref = getReference(item)
@@ -38,20 +38,33 @@ class MillStageMixin:
         millName = self._fileName("FREZA")
         outdir = self._outputdir / millName
         outdir.mkdir(parents=True, exist_ok=True)
+
+        fingerprint = self._stageFingerprint("MILL", dated=True) \
+            .addFile(panelPath) \
+            .addFile(self._project.getMillReadmeTemplate())
+        self._cachedStage("MILL", outdir, fingerprint,
+                          lambda: self._makeMillFiles(outdir, panelPath))
+        self._reportInfo("MILL", "Mill stage finished")
+
+    def _makeMillFiles(self, outdir: Path, panelPath: Path) -> None:
+        millName = self._fileName("FREZA")
         outfile = outdir / (millName + ".kicad_pcb")
         gerberdir = outdir / (millName + "-gerber")
 
         # Make the gerbers for board that has no features other than cuts
-        panel = pcbnew.LoadBoard(str(panelPath))
+        # We strip the panel, so we need a private copy
+        panel = self._boards.checkout(panelPath)
         preserveOnlyOutline(panel, set(MILL_RELEVANT_FOOTPRINTS))
         pcbnew.SaveBoard(str(outfile), panel)
-        makeGerbers(panel, gerberdir, lambda _: set([pcbnew.Edge_Cuts]))
+        with self._measure("makeGerbers"):
+            makeGerbers(panel, gerberdir, lambda _: set([pcbnew.Edge_Cuts]))
         self._makeMillReadme(outdir, panel)
-        zipFiles(str(outdir / (millName + ".zip")), outdir, None,
-            glob.glob(str(outdir / "*.txt")) +
-            glob.glob(str(outdir / "*.html")) +
-            glob.glob(str(gerberdir / "*")))
-        self._reportInfo("MILL", "Mill stage finished")
+        with self._measure("zipFiles"):
+            zipFiles(str(outdir / (millName + ".zip")), outdir, None,
+                glob.glob(str(outdir / "*.txt")) +
+                glob.glob(str(outdir / "*.html")) +
+                glob.glob(str(gerberdir / "*")),
+                compressionLevel=self._compressionLevel)
 
     def _makeMillReadme(self, outdir: Path, panel: pcbnew.BOARD) -> None:
         try:
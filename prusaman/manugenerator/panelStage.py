@@ -1,10 +1,20 @@
+import json
 import os
 import subprocess
 import pcbnew # type: ignore
 import shutil
 import glob
 from pathlib import Path
+from typing import List, Optional
 
+import prusaman
+
+from ..cache import Fingerprint
+from ..drc import drcFingerprint
+from ..footprints import FootprintTable
+from ..paneldrc import (CLIPPING_ARTIFACTS, INSTANCE_MARGIN, InstanceLocator,
+                        clipPanel, findInstances, instanceInteriors,
+                        pruneClippingArtifacts)
 from ..text import populateText
 from ..params import RESOURCES
 from ..export import makeGerbers
@@ -18,8 +28,76 @@ class PanelStageMixin:
         outdir = self._outputdir / panelName
         outdir.mkdir(parents=True)
         outfile = outdir / (panelName + ".kicad_pcb")
-        gerberdir = outdir / (panelName + "-gerber")
 
+        self._cachedStage("PANEL", outdir, self._panelFingerprint(),
+                          lambda: self._makePanel(outfile))
+
+        if self._panelDrc == "instances":
+            self._ensurePassingInstancePanelDrc(outfile)
+        else:
+            instances = findInstances(self._boards.footprints(self._project.getBoard()),
+                                      self._boards.footprints(outfile))
+            self._ensurePassingDrc(self._boards.get(outfile), "generated panel",
+                                   locator=InstanceLocator(self._sourceBoard(), instances))
+
+    def _panelFingerprint(self) -> Optional[Fingerprint]:
+        """
+        Fingerprint of the panel recipe and of the files it references. Return
+        None when the inputs cannot be determined - the panel script can read
+        anything and so can the plugins that are not part of the project.
+        """
+        if self._cache is None:
+            return None
+        projectDir = self._project.getDir()
+        if self._project.has("kikit.json"):
+            recipeFiles = kikitRecipeFiles(projectDir / "kikit.json", projectDir)
+            if recipeFiles is None:
+                self._reportInfo("PANEL", "The panel recipe references files outside of the project, " +
+                                          "its outputs are not cached")
+                return None
+        elif self._project.has("panel.sh"):
+            self._reportInfo("PANEL", "The panel is made by a script, its outputs are not cached")
+            return None
+        else:
+            recipeFiles = []
+        return self._stageFingerprint("PANEL", dated=True) \
+            .addFile(self._project.getBoard()) \
+            .addFile(projectDir / "kikit.json") \
+            .addFiles(recipeFiles) \
+            .addFile(projectDir / "panel" / "panel.kicad_pcb")
+
+    def _ensurePassingInstancePanelDrc(self, panelPath: Path) -> None:
+        """
+        Check the panel except the interiors of the board instances that are
+        covered by the DRC of the source board. Fall back to the full DRC if
+        the instances cannot be recognized.
+        """
+        sourceBoard = self._sourceBoard()
+        # We remove items, so we need a private copy
+        panel = self._boards.checkout(panelPath)
+        instances = findInstances(self._boards.footprints(self._project.getBoard()),
+                                  FootprintTable.fromBoard(panel))
+        interiors = instanceInteriors(sourceBoard, instances) if len(instances) > 0 else None
+        if interiors is None:
+            self._reportInfo("DRC", "Cannot recognize board instances in the panel, running full DRC")
+            self._ensurePassingDrc(self._boards.get(panelPath), "generated panel")
+            return
+        locator = InstanceLocator(sourceBoard, instances)
+        # The fingerprint has to be computed from the unmodified panel
+        fingerprint = drcFingerprint(panel, True) \
+            .addText("mode", "instances") \
+            .addText("prusaman", prusaman.__version__) \
+            .addText("instance margin", str(INSTANCE_MARGIN)) \
+            .addText("clipping artifacts", ",".join(sorted(CLIPPING_ARTIFACTS))) \
+            .addFile(self._project.getBoard())
+        clipped = clipPanel(panel, interiors)
+        self._reportInfo("DRC", f"Found {len(instances)} board instances in the panel, " +
+                                f"their interiors ({clipped.count} items) are covered by the source board DRC")
+        report = self._runBoardDrc(panel, "generated panel", fingerprint)
+        pruneClippingArtifacts(report, interiors, clipped)
+        self._ensurePassingDrc(panel, "generated panel", report, locator)
+
+    def _makePanel(self, outfile: Path) -> None:
         # Make the panel based on the configuration
         if self._project.has("kikit.json"):
             self._makeKikitPanel(outfile)
@@ -31,25 +109,43 @@ class PanelStageMixin:
             raise BoardError("No recipe to make panel. " + \
                 "You miss one of kikit.json, panel.sh or panel/panel.kicad_pcb in the project.")
 
-        panel = pcbnew.LoadBoard(str(outfile))
-        self._ensurePassingDrc(panel, "generated panel")
+    def _makePanelOutputs(self) -> None:
+        panelName = self._fileName("PANEL")
+        outdir = self._outputdir / panelName
+        outfile = outdir / (panelName + ".kicad_pcb")
+
+        fingerprint = self._stageFingerprint("PANEL OUTPUTS", dated=True) \
+            .addFile(outfile) \
+            .addFile(self._project.getBoard()) \
+            .addFiles(self._schemaFiles()) \
+            .addFile(self._project.getPanelReadmeTemplate())
+        self._cachedStage("PANEL", outdir, fingerprint,
+                          lambda: self._makePanelOutputFiles(outdir, outfile))
 
-        makeGerbers(source=panel, outdir=gerberdir, layers=collectStandardLayers)
-        self._makeIbom(source=self._project.getBoard(), outdir=outdir)
+    def _makePanelOutputFiles(self, outdir: Path, outfile: Path) -> None:
+        gerberdir = outdir / (self._fileName("PANEL") + "-gerber")
+
+        panel = self._boards.get(outfile)
+        with self._measure("makeGerbers"):
+            makeGerbers(source=panel, outdir=gerberdir, layers=collectStandardLayers,
+                        jobs=self._stageJobs)
+        self._placeIbom(outdir)
         shutil.copyfile(RESOURCES / "datamatrix_znaceni_zbozi_v2.pdf",
                         outdir / "datamatrix_znaceni_zbozi_v2.pdf")
         self._makePanelReadme(outdir, boardPath=outfile)
 
-        zipFiles(str(gerberdir) + ".zip", outdir, None,
-            glob.glob(str(outdir / "*.pdf")) +
-            glob.glob(str(outdir / "*.txt")) +
-            glob.glob(str(outdir / "*.html")) +
-            glob.glob(str(gerberdir / "*")))
+        with self._measure("zipFiles"):
+            zipFiles(str(gerberdir) + ".zip", outdir, None,
+                glob.glob(str(outdir / "*.pdf")) +
+                glob.glob(str(outdir / "*.txt")) +
+                glob.glob(str(outdir / "*.html")) +
+                glob.glob(str(gerberdir / "*")),
+                compressionLevel=self._compressionLevel)
 
     def _makePanelReadme(self, outdir: Path, boardPath: Path) -> None:
         try:
             with open(self._project.getPanelReadmeTemplate(), "r") as f:
-                content = populateText(f.read(), pcbnew.LoadBoard(str(boardPath)), self._project.textVars["ID"])
+                content = populateText(f.read(), self._boards.get(boardPath), self._project.textVars["ID"])
         except FileNotFoundError as e:
             raise BoardError(f"Missing panel readme template. Please create the file {self._project.getPanelReadmeTemplate()}") from None
         with open(outdir / (self._fileName("PANEL") + "-README.txt"), "w") as f:
@@ -74,8 +170,9 @@ class PanelStageMixin:
                         "-p", str(cfgFile),
                         str(input), str(output)]
 
-        r = subprocess.run(command, encoding="utf-8",
-            capture_output=True, cwd=self._project.getDir(), env=env)
+        with self._measure("makeKikitPanel"):
+            r = subprocess.run(command, encoding="utf-8",
+                capture_output=True, cwd=self._project.getDir(), env=env)
         if len(r.stdout) != 0:
             self._reportInfo("KIKIT", r.stdout)
         if len(r.stderr) != 0:
@@ -96,3 +193,52 @@ class PanelStageMixin:
             raise BoardError(message)
         self._reportInfo("PANEL_SCRIPT", stdout)
         self._reportWarning("PANEL_SCRIPT", stderr)
+
+
+# Plugins from these packages are covered by the tool versions in the stage
+# fingerprint
+_VERSIONED_PLUGIN_PACKAGES = ["prusaman", "kikit"]
+
+def kikitRecipeFiles(configPath: Path, projectDir: Path) -> Optional[List[Path]]:
+    """
+    Return the files referenced by the KiKit panel configuration - the plugins
+    given by a file and the postprocessing script. KiKit resolves them relative
+    to the project directory. Return None when the configuration references
+    files outside of the project or plugins from unknown packages.
+    """
+    try:
+        with open(configPath, encoding="utf-8") as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return []
+    except ValueError:
+        # KiKit reports the error when building the panel
+        return None
+    if not isinstance(config, dict):
+        return None
+
+    references = []
+    for section in config.values():
+        if not isinstance(section, dict):
+            continue
+        for key in ["code", "plugin"]:
+            spec = section.get(key)
+            if not isinstance(spec, str) or spec in ["", "none"]:
+                continue
+            module = spec.rsplit(".", maxsplit=1)[0]
+            if module.endswith(".py"):
+                references.append(module)
+            elif module.split(".")[0] not in _VERSIONED_PLUGIN_PACKAGES:
+                return None
+        script = section.get("script")
+        if isinstance(script, str) and script != "":
+            references.append(script)
+
+    files = []
+    root = projectDir.resolve()
+    for reference in references:
+        path = (projectDir / reference).resolve()
+        if root not in path.parents:
+            return None
+        files.append(path)
+    return files
@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import multiprocessing
+import threading
+from concurrent.futures import (FIRST_COMPLETED, Future, ProcessPoolExecutor,
+                                wait)
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set
+
+from ..util import locatePythonInterpreter
+
+# Artifacts the stages exchange. Files artifacts live in the output directory,
+# in-memory artifacts are stored in the generator and they are shipped to the
+# worker processes together with it.
+VALIDATED_SOURCE = "validated source"
+PANEL_BOARD = "panel board"
+MILL_BOARD = "FREZA board"
+PARSED_BOM = "parsed BOM"
+IBOM = "iBOM"
+
+@dataclass
+class Stage:
+    """
+    A single step of the manufacturing data generation. The stage is realized
+    by a method of the generator and it declares which artifacts it needs and
+    which it produces. Stages that interact with the user or produce in-memory
+    artifacts have to run in the coordinating process.
+    """
+    name: str
+    method: str
+    requires: FrozenSet[str] = field(default_factory=frozenset)
+    provides: FrozenSet[str] = field(default_factory=frozenset)
+    inProcess: bool = False
+
+    def __post_init__(self) -> None:
+        self.requires = frozenset(self.requires)
+        self.provides = frozenset(self.provides)
+
+
+def validateStages(stages: Iterable[Stage]) -> None:
+    """
+    Check that the stages in given order form a valid plan - i.e., each
+    requirement is provided by some previous stage.
+    """
+    available: Set[str] = set()
+    for stage in stages:
+        missing = stage.requires - available
+        if len(missing) > 0:
+            raise RuntimeError(f"Stage {stage.name} requires {', '.join(sorted(missing))} " +
+                                "that is not provided by any preceding stage")
+        available |= stage.provides
+
+
+# The worker process state. It is initialized once per process via the pool
+# initializer as multiprocessing queues cannot be passed as task arguments.
+# The fake KiCAD application has to outlive the stages run by the worker.
+_workerQueue: Optional[Any] = None
+_workerApp: Optional[Any] = None
+
+def _initWorker(queue: Any) -> None:
+    from ..pcbnew_common import fakeKiCADGui
+
+    global _workerQueue, _workerApp
+    _workerQueue = queue
+    # The stages have to run in the same environment as in the coordinating
+    # process, otherwise, e.g., the number formatting may differ
+    _workerApp = fakeKiCADGui()
+
+def _forward(severity: str):
+    def report(tag: str, message: str) -> None:
+        _workerQueue.put((severity, tag, message))
+    return report
+
+def _refusePrompt(tag: str, message: str) -> bool:
+    raise RuntimeError(f"Stage running in a worker process asked '{tag}: {message}'. " +
+                        "This is a bug, please report it.")
+
+def _runWorkerStage(generator: Any, stage: Stage) -> List[Any]:
+    generator._attachReporters(
+        reportInfo=_forward("info"),
+        reportWarning=_forward("warning"),
+        reportError=_forward("error"),
+        askContinuation=_refusePrompt)
+    generator._runStage(stage)
+    # Ship the measurements back to the coordinating process
+    return generator._instrumentation.measurements
+
+
+class StageScheduler:
+    """
+    Runs the stages of a generator respecting their dependencies. With a single
+    job, the stages are run in the given order in the current process. With
+    more jobs, independent stages are dispatched to worker processes as soon
+    as their inputs are available; the stages then run single-job.
+    """
+    def __init__(self, generator: Any, stages: List[Stage], jobs: int=1) -> None:
+        validateStages(stages)
+        self._generator = generator
+        self._stages = stages
+        self._jobs = max(1, jobs)
+
+    def run(self) -> None:
+        if self._jobs == 1:
+            self._runSerial()
+        else:
+            self._runParallel()
+
+    def _runSerial(self) -> None:
+        for stage in self._stages:
+            self._generator._runStage(stage)
+
+    def _runParallel(self) -> None:
+        # The jobs are taken by the stages run in parallel; a stage spawning
+        # its own pool would multiply the number of pcbnew processes
+        stageJobs = self._generator._stageJobs
+        self._generator._stageJobs = 1
+        # We use spawn as pcbnew and wx do not survive fork. We also have to
+        # point multiprocessing to the real interpreter when running inside
+        # KiCAD.
+        ctx = multiprocessing.get_context("spawn")
+        ctx.set_executable(locatePythonInterpreter())
+        queue = ctx.Queue()
+        drain = threading.Thread(target=self._drainMessages, args=(queue,))
+        drain.start()
+        try:
+            with ProcessPoolExecutor(max_workers=self._jobs, mp_context=ctx,
+                                     initializer=_initWorker,
+                                     initargs=(queue,)) as executor:
+                self._dispatch(executor)
+        finally:
+            queue.put(None)
+            drain.join()
+            self._generator._stageJobs = stageJobs
+
+    def _dispatch(self, executor: ProcessPoolExecutor) -> None:
+        available: Set[str] = set()
+        pending = list(self._stages)
+        running: Dict[Future, Stage] = {}
+        try:
+            while len(pending) > 0 or len(running) > 0:
+                ready = [s for s in pending if s.requires <= available]
+                for stage in ready:
+                    if stage.inProcess:
+                        continue
+                    pending.remove(stage)
+                    running[executor.submit(_runWorkerStage, self._generator, stage)] = stage
+
+                local = next((s for s in ready if s.inProcess), None)
+                if local is not None:
+                    pending.remove(local)
+                    self._generator._runStage(local)
+                    available |= local.provides
+                    continue
+
+                if len(running) == 0:
+                    raise RuntimeError("Stages cannot be scheduled: " +
+                                       ", ".join(s.name for s in pending))
+                finished, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage = running.pop(future)
+                    self._generator._instrumentation.merge(future.result())
+                    available |= stage.provides
+        except Exception:
+            # Do not start anything new, but let the running stages finish so
+            # they do not write into the output directory once we report
+            # failure.
+            for future in running.keys():
+                future.cancel()
+            wait(running.keys())
+            raise
+
+    def _drainMessages(self, queue: Any) -> None:
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            severity, tag, message = item
+            if severity == "info":
+                self._generator._reportInfo(tag, message)
+            elif severity == "warning":
+                self._generator._reportWarning(tag, message)
+            else:
+                self._generator._reportError(tag, message)
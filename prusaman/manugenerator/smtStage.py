@@ -5,15 +5,16 @@ from itertools import chain
 from pathlib import Path
 from typing import List, TextIO, Tuple
 from kikit.eeschema_v6 import (Symbol, extractComponents,  # type: ignore
-                               getField, getReference)
+                               getReference)
 
 import pcbnew # type: ignore
 
 
 from .common import naturalComponetKey, layerToSide, BoardError
-from ..util import zipFiles, defaultTo
+from ..util import zipFiles
 from ..export import makeDxf
-from ..params import GLUE_STAMPS
+from ..glue import DispensePlan, planDispense
+from ..params import DISPENSER, GLUE_STAMPS
 
 def renderHolesToEdges(board: pcbnew.BOARD) -> None:
     """
@@ -45,19 +46,6 @@ def renderHolesToEdges(board: pcbnew.BOARD) -> None:
     for x in toDelete:
         board.Remove(x)
 
-def sortGlueStamps(stamps: List[Tuple[pcbnew.wxPoint, int]]) -> List[Tuple[pcbnew.wxPoint, int]]:
-    """
-    Given a list of stamp positions and sizes return a new list that sorts them
-    in order to minimize travel distance
-    """
-    from python_tsp.distances import euclidean_distance_matrix  # type: ignore
-    from python_tsp.heuristics import solve_tsp_local_search  # type: ignore
-
-    distMatrix = euclidean_distance_matrix([x[0] for x in stamps])
-    perm, _ = solve_tsp_local_search(distMatrix, list(range(len(stamps))))
-    return [stamps[i] for i in perm]
-
-
 class SmtStageMixin:
     def _makeSmtStage(self) -> None:
         self._reportInfo("SMT", "Starting SMT stage")
@@ -65,40 +53,51 @@ class SmtStageMixin:
         outdir = self._outputdir / smtName
         outdir.mkdir(parents=True, exist_ok=True)
 
+        millName = self._fileName("FREZA")
+        panelName = self._fileName("PANEL")
+        fingerprint = self._stageFingerprint("SMT") \
+            .addFile(self._outputdir / millName / (millName + ".kicad_pcb")) \
+            .addFile(self._outputdir / panelName / (panelName + ".kicad_pcb")) \
+            .addFile(self._project.getBoard()) \
+            .addFiles(self._schemaFiles())
+        self._cachedStage("SMT", outdir, fingerprint,
+                          lambda: self._makeSmtFiles(outdir))
+        self._reportInfo("SMT", "SMT stage finished")
+
+    def _makeSmtFiles(self, outdir: Path) -> None:
         posName = outdir / (self._project.getName() + "-all-pos.csv")
         zipName = outdir / (self._project.getName() + "-BOM-SMT.zip")
 
         self._makesmtStageDxf(outdir)
-        self._makeIbom(self._project.getBoard(), outdir)
-
-        bomFilter = self._bomFilter
+        self._placeIbom(outdir)
 
-        bom = extractComponents(str(self._project.getSchema()))
-        bom = [x for x in bom if bomFilter.assemblyFilter(x)]
-        self._checkAnnotation(bom)
-        bom.sort(key=naturalComponetKey)
+        self._checkAnnotation()
+        bom = sorted(self._components.assembly, key=naturalComponetKey)
 
         with open(posName, "w", newline="") as posFile:
             self._makeSmtPosFile(posFile, bom, self._project.getBoard())
 
-        zipFiles(zipName, outdir, None,
-            glob.glob(str(outdir / "*.txt")) +
-            glob.glob(str(outdir / "*.html")) +
-            glob.glob(str(outdir / "*.csv")) +
-            glob.glob(str(outdir / "*.dxf")))
+        with self._measure("zipFiles"):
+            zipFiles(zipName, outdir, None,
+                glob.glob(str(outdir / "*.txt")) +
+                glob.glob(str(outdir / "*.html")) +
+                glob.glob(str(outdir / "*.csv")) +
+                glob.glob(str(outdir / "*.dxf")),
+                compressionLevel=self._compressionLevel)
 
         panelName = self._fileName("PANEL")
         panelPath = self._outputdir / panelName / (panelName + ".kicad_pcb")
 
         self._makeGlueStamps(outdir, panelPath)
-        self._reportInfo("SMT", "SMT stage finished")
 
     def _makesmtStageDxf(self, outdir: Path) -> None:
         millName = self._fileName("FREZA")
         strippedPanelName = self._outputdir / millName / (millName + ".kicad_pcb")
-        strippedPanel = pcbnew.LoadBoard(str(strippedPanelName))
+        # We replace holes, so we need a private copy
+        strippedPanel = self._boards.checkout(strippedPanelName)
         renderHolesToEdges(strippedPanel)
-        makeDxf(strippedPanel, outdir, lambda _: set([pcbnew.Edge_Cuts]))
+        with self._measure("makeDxf"):
+            makeDxf(strippedPanel, outdir, lambda _: set([pcbnew.Edge_Cuts]))
         # Hacky way to replace a layer. However, for KiCAD boards with only
         # outlines it seems safe, and also, saves and external dependency in the
         # form of a DXF parsing library
@@ -120,72 +119,55 @@ class SmtStageMixin:
 
     def _makeSmtPosFile(self, posFile: TextIO, bom: List[Symbol],
                         boardPath: Path) -> None:
-        sourceBoard = pcbnew.LoadBoard(str(boardPath))
+        footprints = self._boards.footprints(boardPath)
         writer = csv.writer(posFile)
         writer.writerow(["Ref", "ID", "Val", "Package", "PosX", "PosY", "Rot", "Side"])
         for item in bom:
             ref = getReference(item)
-            id = getField(item, "ID")
+            id = self._components.field(item, "ID")
             if id is None:
                 self._userFail(f"Component {ref} has no ID but should be populated")
 
-            f = sourceBoard.FindFootprintByReference(getReference(item))
+            f = footprints.find(ref)
             if f is None:
                 self._reportWarning("SMT POS", f"Reference {ref} is present in schematics, " + \
                                     "but not in board. Ignoring.")
-            value = self._ensureNoComma(f.GetValue(),
+                continue
+            value = self._ensureNoComma(f.value,
                 f"value of component {ref}")
-            fpid = self._ensureNoComma(f.GetFPID().GetUniStringLibItemName(),
+            fpid = self._ensureNoComma(f.fpid,
                 f"footprint ID of component {ref}")
-            pos = f.GetPosition()
             writer.writerow([
-                f.GetReference(),
+                f.reference,
                 id,
                 value,
                 fpid,
-                pcbnew.ToMM(pos[0]),
-                -pcbnew.ToMM(pos[1]),
-                ((f.GetOrientation()) % 3600) / 10,
-                layerToSide(f.GetLayer())
-            ])
-
-    def _makeSmtBomFile(self, bomFile: TextIO, bom: List[Symbol]) -> None:
-        def required(symbol: Symbol, field: str) -> str:
-            v = getField(symbol, field)
-            if v is None:
-                self._userFail(f"{getReference(symbol)} is missing required field {field}")
-            assert isinstance(v, str)
-            return v
-
-        def recommended(symbol: Symbol, field: str) -> str:
-            v = getField(symbol, field)
-            if v is None:
-                self._reportWarning("BOM", f"{getReference(symbol)} is missing recommended field {field}")
-            return defaultTo(v, "")
-
-        def optional(symbol: Symbol, field: str) -> str:
-            return defaultTo(getField(symbol, field), "")
-
-        writer = csv.writer(bomFile)
-        writer.writerow(["Reference", "Value", "Footprint", "Datasheet", "ID", "part_value", "req", "alt"])
-        for symbol in bom:
-            writer.writerow([
-                getReference(symbol),
-                required(symbol, "Value"),
-                required(symbol, "Footprint"),
-                recommended(symbol, "Datasheet"),
-                recommended(symbol, "ID"),
-                recommended(symbol, "part_value"),
-                recommended(symbol, "req"),
-                optional(symbol, "alt")
+                pcbnew.ToMM(f.x),
+                -pcbnew.ToMM(f.y),
+                (f.orientation % 3600) / 10,
+                layerToSide(f.layer)
             ])
 
     def _makeGlueStamps(self, outdir: Path, panelPath: Path) -> None:
-        panel = pcbnew.LoadBoard(str(panelPath))
+        panel = self._boards.get(panelPath)
         glueStamps = self._collectGlueStamps(panel)
         if len(glueStamps) == 0:
             return
-        glueStamps = sortGlueStamps(glueStamps)
+        with self._measure("sortGlueStamps"):
+            plan = planDispense(
+                points=[(pos[0], pos[1]) for pos, _ in glueStamps],
+                kinds=[dia for _, dia in glueStamps],
+                dwell={dia: DISPENSER.dwellTime(s) for dia, s in GLUE_STAMPS.items()},
+                travelSpeed=DISPENSER.travelSpeed,
+                switchPenalty=DISPENSER.typeSwitchPenalty)
+        self._reportInfo("GLUE", f"Dispense path of {len(glueStamps)} stamps " +
+                         f"shortened from {pcbnew.ToMM(plan.initialTravelLength):.0f} mm " +
+                         f"to {pcbnew.ToMM(plan.travelLength):.0f} mm " +
+                         f"({100 * plan.travelReduction:.0f} % less), " +
+                         f"{plan.switches} stamp type changes, " +
+                         f"expected cycle time {plan.cycleTime:.0f} s")
+        glueStamps = [glueStamps[i] for i in plan.order]
+        self._makeGlueReadme(outdir, glueStamps, plan)
         glueName = outdir / (self._project.getName() + "-PANEL-glue-pos.csv")
         with open(glueName, "w", newline="") as f:
             writer = csv.writer(f)
@@ -200,6 +182,24 @@ class SmtStageMixin:
                     stamp.type,
                     pcbnew.ToMM(stamp.spacing)])
 
+    def _makeGlueReadme(self, outdir: Path,
+                        glueStamps: List[Tuple[pcbnew.wxPoint, int]],
+                        plan: DispensePlan) -> None:
+        readmeName = outdir / (self._project.getName() + "-PANEL-glue-README.txt")
+        with open(readmeName, "w") as f:
+            f.write(f"Glue stamps: {len(glueStamps)}\n")
+            for dia in sorted(set(dia for _, dia in glueStamps)):
+                count = sum(1 for _, d in glueStamps if d == dia)
+                f.write(f"  {pcbnew.ToMM(dia):.2f} mm: {count}\n")
+            f.write(f"Stamps grouped by type: {'yes' if plan.grouped else 'no'}\n")
+            f.write(f"Stamp type changes: {plan.switches}\n")
+            f.write(f"Travel: {pcbnew.ToMM(plan.travelLength):.0f} mm " +
+                    f"(unoptimized {pcbnew.ToMM(plan.initialTravelLength):.0f} mm, " +
+                    f"{100 * plan.travelReduction:.0f} % less)\n")
+            f.write(f"Expected cycle time: {plan.cycleTime:.0f} s " +
+                    f"(travel {plan.travelTime:.0f} s, dispensing {plan.dwellTime:.0f} s, " +
+                    f"type changes {plan.switchTime:.0f} s)\n")
+
     def _collectGlueStamps(self, board: pcbnew.BOARD) -> List[Tuple[pcbnew.wxPoint, int]]:
         """
         Collect glue stamps from the board. If there are unsupported stamp shapes
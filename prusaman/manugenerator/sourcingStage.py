@@ -1,6 +1,7 @@
 
 
 import csv
+from pathlib import Path
 from typing import List, TextIO
 
 from kikit.eeschema_v6 import (Symbol, extractComponents,  # type: ignore
@@ -19,19 +20,25 @@ class SourcingStageMixin:
         outdir = self._outputdir / sourcingName
         outdir.mkdir(parents=True, exist_ok=True)
 
+        fingerprint = self._stageFingerprint("SOURCING") \
+            .addFiles(self._schemaFiles())
+        self._cachedStage("SOURCING", outdir, fingerprint,
+                          lambda: self._makeSourcingFiles(outdir))
+        self._reportInfo("SOURCING", "Sourcing stage finished")
+
+    def _makeSourcingFiles(self, outdir: Path) -> None:
         sourcingListName = outdir / (self._project.getName() + "_BOM.csv")
         zipName = outdir / (self._project.getName() + "_BOM.zip")
 
         bomFilter = self._bomFilter
+        components = self._components
 
-        bom = extractComponents(str(self._project.getSchema()))
-        self._checkAnnotation(bom)
-        bom = [x for x in bom if bomFilter.sourcingFilter(x)]
+        self._checkAnnotation()
 
-        grouppedBom = groupBy(bom, key=lambda c: (
-            getField(c, "ID"),
-            getField(c, "Footprint"),
-            getField(c, "Value"),
+        grouppedBom = groupBy(components.sourcing, key=lambda c: (
+            components.field(c, "ID"),
+            components.field(c, "Footprint"),
+            components.field(c, "Value"),
         ))
         groups = list(grouppedBom.values())
         groups.sort(key=lambda g: (getReference(g[0])[:1], len(g)))
@@ -39,11 +46,13 @@ class SourcingStageMixin:
         with open(sourcingListName, "w", newline="") as f:
             self._makeSourcingBom(f, groups, bomFilter)
 
-        zipFiles(zipName, outdir, None, [sourcingListName])
-        self._reportInfo("SOURCING", "Sourcing stage finished")
+        with self._measure("zipFiles"):
+            zipFiles(zipName, outdir, None, [sourcingListName],
+                     compressionLevel=self._compressionLevel)
 
     def _makeSourcingBom(self, bomFile: TextIO, groups: List[List[Symbol]],
                             bomFilter: BomFilter) -> None:
+        components = self._components
         writer = csv.writer(bomFile)
         writer.writerow(["Id", "Component", "Quantity per PCB", "Value"])
 
@@ -51,29 +60,22 @@ class SourcingStageMixin:
             if len(group) == 0 or not bomFilter.assemblyFilter(group[0]):
                 continue
             writer.writerow([
-                getField(group[0], "ID"), i + 1, len(group),
-                getField(group[0], "Value")])
+                components.field(group[0], "ID"), i + 1, len(group),
+                components.field(group[0], "Value")])
         writer.writerow([])
         writer.writerow([])
         for i, group in enumerate(groups):
             if len(group) == 0 or bomFilter.assemblyFilter(group[0]):
                 continue
             writer.writerow([
-                getField(group[0], "ID"), i + 1, len(group),
-                getField(group[0], "Value")])
-
-    def _checkAnnotation(self, bom: List[Symbol]) -> None:
-        unann = {}
-        wrongAnn = []
-        for s in bom:
-            ref = getReference(s)
-            if "?" in ref:
-                unann[ref] = unann.get(ref, 0) + 1
-                continue
-            text, num = splitOn(ref, lambda x: not x.isdigit())
-            if not num.isdigit():
-                self._reportError("ANNOTATION", f"Component {ref} has invalid annotation.")
-        for ref, c in unann.items():
+                components.field(group[0], "ID"), i + 1, len(group),
+                components.field(group[0], "Value")])
+
+    def _checkAnnotation(self) -> None:
+        components = self._components
+        for ref in components.invalidAnnotation:
+            self._reportError("ANNOTATION", f"Component {ref} has invalid annotation.")
+        for ref, c in components.unannotated.items():
             self._reportError("ANNOTATION", f"There {c}× unanotated components with {ref}")
-        if len(unann) > 0 or len(wrongAnn):
+        if len(components.unannotated) > 0:
             raise BoardError("The schematics contains annotation error.")
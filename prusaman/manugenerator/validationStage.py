@@ -1,24 +1,39 @@
 import datetime
+import io
 import os
 from pathlib import Path
 from tempfile import TemporaryDirectory
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 import keyring
 from .common import BoardError
-from ..drc import DesignRules
+from ..cache import Fingerprint
+from ..drc import (DRC_REPORT_NAME, DesignRules, drcFingerprint, runDrc,
+                   writeDrcReport)
 from ..schema import Schema
-from ..footprintlib import PrusaFootprints, extractRevision, matchesFootprintPattern
+from ..paneldrc import InstanceLocator, groupViolations
+from ..drcbaseline import DrcBaseline
+from ..footprintlib import PrusaFootprints, extractRevision, footprintHash
+from ..params import FOOTPRINT_REVISION_TTL
 
 import pcbnew # type: ignore
 
-from kikit.drc import Violation, readBoardDrcExclusions, runBoardDrc
+from kikit.drc import (DrcReport, Violation, readBoardDrcExclusions, # type: ignore
+                       readReport)
+
+# Libraries whose footprints carry PRUSA_REVISION and are checked to be up to
+# date. Footprints of all the prusa_* libraries are checked to match the
+# library.
+REVISED_LIBRARIES = ["prusa_con", "prusa_other"]
+
+def _isCheckedLibrary(libName: str) -> bool:
+    return libName.startswith("prusa_") and libName != "prusa_waiting_for_approval"
 
 
 class ValidationStageMixin:
     def _makeValidation(self) -> None:
         self._reportInfo("VALIDATE", "Validation of the board started")
-        sch = self._project.schema
-        board = self._project.board
+        sch = self._components.schema
+        board = self._sourceBoard()
 
         self._validateProjectVars()
         self._validateTitleBlock(sch, board)
@@ -57,7 +72,7 @@ class ValidationStageMixin:
             return
         paramsName = self._project.textVars["TECHNOLOGY_PARAMS"]
         designRules = DesignRules.fromName(paramsName)
-        board = self._project.board
+        board = self._sourceBoard()
         violations = designRules.settingsViolations(board.GetDesignSettings())
         if len(violations) == 0:
             return
@@ -69,14 +84,24 @@ class ValidationStageMixin:
     def _validateFootprints(self) -> None:
         self._reportInfo("FOOTPRINTS", "Footprint validation started")
 
-        token = self._obtainGhToken()
-        if token is None:
-            return
+        if self._offline:
+            fLib = PrusaFootprints(None)
+            revision = fLib.getLocalRevision()
+            if revision is None:
+                self._askWarning("FOOTPRINTS",
+                    "There is no synchronized footprint library for offline validation. Skip footprint check and continue?",
+                    "Cannot validate footprints offline as there is no synchronized footprint library.")
+                return
+            self._reportInfo("FOOTPRINTS", f"Offline mode, validating against library revision {revision}")
+        else:
+            token = self._obtainGhToken()
+            if token is None:
+                return
 
-        fLib = PrusaFootprints(token)
-        if fLib.getLocalRevision() != fLib.getRemoteRevision():
-            self._reportInfo("FOOTPRINTS", "Pulling new library version from GitHub")
-            fLib.updateFromRemote()
+            fLib = self._remoteFootprintLibrary(token)
+            if fLib.getLocalRevision() != fLib.getRemoteRevision():
+                self._reportInfo("FOOTPRINTS", "Pulling new library version from GitHub")
+                fLib.updateFromRemote()
 
         warnings = False
         def reportWarning(*args, **kwargs):
@@ -84,49 +109,75 @@ class ValidationStageMixin:
             warnings = True
             self._reportWarning(*args, **kwargs)
 
-        revisionCache: Dict[Tuple[str, str], str] = {}
-
-        with TemporaryDirectory(suffix=".pretty") as tmpLib:
-            for footprint in self._project.board.Footprints():
-                reference = footprint.Reference().GetText()
-                id = footprint.GetFPID()
-                libName = str(id.GetLibNickname())
-                fName = str(id.GetLibItemName())
-                if libName == "prusa_waiting_for_approval":
-                    reportWarning("FOOTPRINT",
-                        f"{footprint.Reference()} comes from prusa_waiting_for_approval.")
-                if libName not in ["prusa_con", "prusa_other"]:
-                    continue
-                if (libName, fName) in revisionCache:
-                    patternRev = revisionCache[(libName, fName)]
-                else:
-                    pattern = fLib.getFootprint(libName, fName)
-                    if pattern is None:
-                        reportWarning("FOOTPRINT",
-                            f"{libName}:{fName} ({reference}) doesn't exist in Github library")
-                        continue
-                    patternRev = extractRevision(pattern)
-                    revisionCache[(libName, fName)] = patternRev
-                footprintRev = extractRevision(footprint)
-                if patternRev is None:
-                    reportWarning("FOOTPRINT", f"{libName}:{fName} is missing revision on GitHub. " +
-                        "There is something wrong in the library. Please, report it." )
-                if patternRev == footprintRev:
-                    # The revision is the most up-to-date, no more checks to perform
-                    continue
-                revsplit = patternRev.split("-", 1)
-                gitrev = revsplit[0]
-                date = datetime.datetime.fromisoformat(revsplit[1])
-                datestr = date.strftime("%d. %m. %Y, %H:%M")
-                reportWarning("FOOTPRINT", f"Footprint of {reference} is out of date, " +
-                                           f"there is a newer version of {libName}:{fName}: {gitrev} ({datestr})")
-            if warnings:
-                self._askWarning("FOOTPRINT",
-                    "There are footprint validation errors, ignore and continue?",
-                    "Footprint validation failed")
+        # Resolve each unique library footprint once; the index is built
+        # on the first use after a library update
+        footprints = [(f, str(f.GetFPID().GetLibNickname()), str(f.GetFPID().GetLibItemName()))
+                      for f in self._sourceBoard().Footprints()]
+        unique = sorted(set(f"{libName}:{fName}" for _, libName, fName in footprints
+                            if _isCheckedLibrary(libName)))
+        revisionIndex = fLib.getRevisionIndex()
+        revisions = {key: revisionIndex[key] for key in unique if key in revisionIndex}
+        with self._measure("footprintHashes"):
+            libraryHashes = fLib.getFootprintHashes(list(revisions.keys()))
+
+        def checkConformance(footprint: pcbnew.FOOTPRINT, reference: str, key: str) -> None:
+            libraryHash = libraryHashes[key]
+            if libraryHash is not None and footprintHash(footprint) != libraryHash:
+                reportWarning("FOOTPRINT", f"Footprint of {reference} differs from " +
+                                           f"{key} in the library.")
+
+        # Report in the board order
+        for footprint, libName, fName in footprints:
+            reference = footprint.Reference().GetText()
+            key = f"{libName}:{fName}"
+            if libName == "prusa_waiting_for_approval":
+                reportWarning("FOOTPRINT",
+                    f"{footprint.Reference()} comes from prusa_waiting_for_approval.")
+            if not _isCheckedLibrary(libName):
+                continue
+            if libName not in REVISED_LIBRARIES:
+                # The other libraries carry no revisions, we can only check
+                # that the footprint was not modified on the board
+                if key in revisions:
+                    checkConformance(footprint, reference, key)
+                continue
+            if key not in revisions:
+                reportWarning("FOOTPRINT",
+                    f"{key} ({reference}) doesn't exist in Github library")
+                continue
+            patternRev = revisions[key]
+            footprintRev = extractRevision(footprint)
+            if patternRev is None:
+                reportWarning("FOOTPRINT", f"{key} is missing revision on GitHub. " +
+                    "There is something wrong in the library. Please, report it." )
+            if patternRev == footprintRev:
+                # The revision is the most up-to-date, check that the footprint
+                # was not modified on the board
+                checkConformance(footprint, reference, key)
+                continue
+            revsplit = patternRev.split("-", 1)
+            gitrev = revsplit[0]
+            date = datetime.datetime.fromisoformat(revsplit[1])
+            datestr = date.strftime("%d. %m. %Y, %H:%M")
+            reportWarning("FOOTPRINT", f"Footprint of {reference} is out of date, " +
+                                       f"there is a newer version of {libName}:{fName}: {gitrev} ({datestr})")
+        if warnings:
+            self._askWarning("FOOTPRINT",
+                "There are footprint validation errors, ignore and continue?",
+                "Footprint validation failed")
 
         self._reportInfo("FOOTPRINTS", "Footprint validation finished")
 
+    def _remoteFootprintLibrary(self, token: str) -> PrusaFootprints:
+        apiUrl = os.environ.get("PRUSAMAN_GH_API", "").strip()
+        ttl = os.environ.get("PRUSAMAN_FOOTPRINT_TTL", "").strip()
+        try:
+            revisionTtl = float(ttl) if ttl != "" else FOOTPRINT_REVISION_TTL
+        except ValueError:
+            raise BoardError(f"Invalid PRUSAMAN_FOOTPRINT_TTL '{ttl}', expected number of seconds") from None
+        return PrusaFootprints(token, apiUrl=apiUrl if apiUrl != "" else None,
+                               revisionTtl=revisionTtl)
+
     def _getTokenFromKeyring(self):
         try:
             return keyring.get_password("prusaman", "github")
@@ -151,26 +202,80 @@ class ValidationStageMixin:
                 "Cannot pull footprint library from GitHub due to unconfigured access token. See installation instructions.")
         return token
 
-    def _ensurePassingDrc(self, board: pcbnew.BOARD, name) -> None:
+    def _runBoardDrc(self, board: pcbnew.BOARD, name: str,
+                     fingerprint: Optional[Fingerprint]=None) -> DrcReport:
+        """
+        Run strict DRC of the board. The KiCAD report is cached by the DRC
+        inputs (by default the board file and its settings) and on cache hit it
+        is read as if DRC just ran.
+        """
+        if self._cache is None:
+            with self._measure("runBoardDrc"):
+                return runDrc(board, True)
+        if fingerprint is None:
+            fingerprint = drcFingerprint(board, True)
+        key = fingerprint.hexdigest()
+        entry = self._cache.lookup(key)
+        if entry is not None:
+            self._reportInfo("DRC", f"The {name} did not change, reusing cached DRC report")
+            return readReport(io.StringIO(entry.readText(DRC_REPORT_NAME)), board)
+        with self._measure("runBoardDrc"), TemporaryDirectory() as tmpdir:
+            reportPath = Path(tmpdir) / DRC_REPORT_NAME
+            writeDrcReport(board, reportPath, True)
+            with open(reportPath, encoding="utf-8") as f:
+                report = readReport(f, board)
+            self._cache.store(key, tmpdir, [reportPath], [])
+        return report
+
+    def _pruneDrcBaseline(self, report: DrcReport, name: str,
+                          locator: Optional[InstanceLocator]) -> None:
+        """
+        Remove violations known from the DRC baseline of the project.
+        """
+        baselinePath = self._project.getDrcBaseline()
+        if not baselinePath.exists():
+            return
+        try:
+            baseline = DrcBaseline.load(baselinePath)
+        except RuntimeError as e:
+            raise BoardError(str(e)) from None
+        known = baseline.prune(report, locator)
+        if known > 0:
+            self._reportInfo("DRC", f"{known} known violations of {name} are suppressed by {baselinePath.name}")
+
+    def _ensurePassingDrc(self, board: pcbnew.BOARD, name,
+                          report: Optional[DrcReport]=None,
+                          locator: Optional[InstanceLocator]=None) -> None:
+        """
+        Report DRC violations of the board and ask whether to continue if there
+        are errors. Unless a report is given, DRC is run. Violations repeated
+        at the same spot of multiple board instances are reported once; the
+        locator maps the panel positions to the instances.
+        """
         self._reportInfo("DRC", f"Running DRC for {name}")
-        report = runBoardDrc(board, True)
+        if report is None:
+            report = self._runBoardDrc(board, name)
         report.pruneExclusions(readBoardDrcExclusions(board))
+        self._pruneDrcBaseline(report, name, locator)
 
         def reportResult(res: List[Violation], type: str) -> bool:
-            errorCount = 0
             ERROR_LIMIT = 50
 
             if len(res) == 0:
                 return False
             report = self._reportError if type == "error" else self._reportWarning
-            report("DRC", f"There are {len(res)} DRC {type}s:")
-            for v in res:
-                errorCount += 1
-                if errorCount > ERROR_LIMIT:
-                    continue
-                report("DRC", f"{name}: {v.format(pcbnew.EDA_UNITS_MILLIMETRES)}")
-            if errorCount > ERROR_LIMIT:
-                report("DRC", f"First {ERROR_LIMIT} errors, shown, omitting rest of the {errorCount} errors for brevity")
+            groups = groupViolations(res, locator)
+            if len(groups) == len(res):
+                report("DRC", f"There are {len(res)} DRC {type}s:")
+            else:
+                report("DRC", f"There are {len(res)} DRC {type}s, {len(groups)} distinct:")
+            for g in groups[:ERROR_LIMIT]:
+                message = f"{name}: {g.first.format(pcbnew.EDA_UNITS_MILLIMETRES)}"
+                if g.count > 1:
+                    message += f"\n    Repeated {g.count} times, the first occurrence is shown"
+                report("DRC", message)
+            if len(groups) > ERROR_LIMIT:
+                report("DRC", f"First {ERROR_LIMIT} errors, shown, omitting rest of the {len(groups)} errors for brevity")
             return True
 
         getWarnings = lambda l: [x for x in l if x.severity == "warning"]
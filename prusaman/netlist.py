@@ -1,31 +1,14 @@
-from typing import List, TextIO
+from typing import Dict
 from kikit.eeschema_v6 import Symbol
 
 
-def exportIBomNetlist(file: TextIO, symbols: List[Symbol]) -> None:
+def ibomFields(symbol: Symbol) -> Dict[str, str]:
     """
-    Given a list of symbols, generate a simplified netlist suitable for iBom.
-    Only the necessary fields are populated
+    Given a symbol, return its extra fields as iBom should present them. The
+    PnB field is translated into the human-readable "Osazovat/Nakupovat"
+    field. Reference, value and footprint are not extra fields, iBom reads
+    them from the board.
     """
-    file.write("""
-    (export (version "E")
-        (design
-            (source "")
-            (date "")
-            (tool "Prusaman")
-            (sheet)
-        )
-        (libparts)
-        (libraries)
-        (nets)
-        (components
-    """)
-    for s in symbols:
-        exportSymbol(file, s)
-
-    file.write("))")
-
-def exportSymbol(file: TextIO, symbol: Symbol) -> None:
     properties = dict(symbol.properties.items())
 
     pnbFieldVal = None
@@ -41,18 +24,5 @@ def exportSymbol(file: TextIO, symbol: Symbol) -> None:
         else:
             pnbFieldVal = "osadit"
         properties["Osazovat/Nakupovat"] = pnbFieldVal
-
-    file.write("(comp ")
-    file.write(f'(ref "{properties["Reference"]}") ')
-    file.write(f'(value "{properties["Value"]}") ')
-    file.write(f'(footprint "{properties["Footprint"]}") ')
-
-    file.write("(fields ")
-    for key, value in properties.items():
-        if key in ["Reference", "Value", "Footprint"]:
-            continue
-        file.write(f'(field (name "{key}") "{value}") ')
-    file.write(" ) ") # Fields
-
-    file.write(" )\n")
-
+    return {k: v for k, v in properties.items()
+            if k not in ["Reference", "Value", "Footprint"]}
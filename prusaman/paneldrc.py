@@ -0,0 +1,239 @@
+"""
+Panel DRC exploiting the repetition of the source board. The interior of each
+board instance in the panel is identical to the source board which has already
+passed DRC, so it is enough to check the rest of the panel: the frame, tabs,
+tooling holes and the surroundings of the instance boundaries. We remove the
+items lying deep inside the instances from a private copy of the panel and run
+DRC on the rest.
+"""
+
+import math
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+import pcbnew # type: ignore
+from kikit.common import collectEdges # type: ignore
+from kikit.defs import Layer # type: ignore
+from kikit.drc import DrcReport, Violation # type: ignore
+from kikit.substrate import Substrate # type: ignore
+from shapely.affinity import affine_transform # type: ignore
+from shapely.geometry import Polygon, box # type: ignore
+from shapely.geometry.base import BaseGeometry # type: ignore
+from shapely.ops import unary_union # type: ignore
+
+from .footprints import FootprintTable
+from .pcbnew_common import findBoardBoundingBox
+
+# Width of the band along the instance boundaries that is checked in full.
+# It has to exceed the largest clearance of the board.
+INSTANCE_MARGIN = pcbnew.FromMM(3)
+# Tolerance of footprint positions when matching the instances
+POSITION_TOLERANCE = pcbnew.FromMM(0.01)
+
+# Removing the instance interiors leaves dangling tracks, disconnected pads
+# and copper islands behind; these violations are artifacts of clipping
+CLIPPING_ARTIFACTS = frozenset(["track_dangling", "via_dangling",
+                                "isolated_copper", "unconnected_items"])
+
+@dataclass
+class BoardInstance:
+    """
+    Placement of the source board in the panel: rotation by angle (tenths of
+    degree, the KiCAD convention) around the origin followed by offset.
+    """
+    dx: float
+    dy: float
+    angle: float
+
+    def transform(self, x: float, y: float) -> Tuple[float, float]:
+        # Same as KiCAD's RotatePoint; with the y axis pointing down, positive
+        # angles rotate counterclockwise on screen
+        a = -math.radians(self.angle / 10)
+        return (x * math.cos(a) - y * math.sin(a) + self.dx,
+                x * math.sin(a) + y * math.cos(a) + self.dy)
+
+    def transformGeometry(self, geometry: BaseGeometry) -> BaseGeometry:
+        a = -math.radians(self.angle / 10)
+        return affine_transform(geometry, [math.cos(a), -math.sin(a),
+                                           math.sin(a), math.cos(a),
+                                           self.dx, self.dy])
+
+    def inverse(self, x: float, y: float) -> Tuple[float, float]:
+        a = math.radians(self.angle / 10)
+        x, y = x - self.dx, y - self.dy
+        return (x * math.cos(a) - y * math.sin(a),
+                x * math.sin(a) + y * math.cos(a))
+
+
+def findInstances(source: FootprintTable, panel: FootprintTable) -> List[BoardInstance]:
+    """
+    Find placements of the source board in the panel. We take the footprint
+    with the least common (FPID, value) on the source board as an anchor and
+    every matching footprint in the panel as an instance candidate. A
+    candidate is accepted if all the source footprints are found at their
+    expected positions.
+    """
+    if len(source) == 0:
+        return []
+    kinds = list(zip(source.fpids, source.values))
+    counts = Counter(kinds)
+    anchor = min(range(len(source)), key=lambda i: (counts[kinds[i]], i))
+
+    # The panel footprints are indexed by kind and a grid over the position,
+    # so a lookup inspects only the footprints in the neighbouring cells
+    panelByKind: Dict[Tuple[str, str], List[int]] = {}
+    panelGrid: Dict[Tuple[str, str, int, int], List[int]] = {}
+    for i, kind in enumerate(zip(panel.fpids, panel.values)):
+        panelByKind.setdefault(kind, []).append(i)
+        cx, cy = _cell(panel.xs[i], panel.ys[i])
+        panelGrid.setdefault((kind[0], kind[1], cx, cy), []).append(i)
+
+    def present(kind: Tuple[str, str], x: float, y: float) -> bool:
+        cx, cy = _cell(x, y)
+        return any(abs(panel.xs[j] - x) <= POSITION_TOLERANCE and
+                   abs(panel.ys[j] - y) <= POSITION_TOLERANCE
+                   for gx in range(cx - 1, cx + 2)
+                   for gy in range(cy - 1, cy + 2)
+                   for j in panelGrid.get((kind[0], kind[1], gx, gy), []))
+
+    instances = []
+    for candidate in panelByKind.get(kinds[anchor], []):
+        angle = (panel.orientations[candidate] - source.orientations[anchor]) % 3600
+        instance = BoardInstance(0, 0, angle)
+        ax, ay = instance.transform(source.xs[anchor], source.ys[anchor])
+        instance.dx = panel.xs[candidate] - ax
+        instance.dy = panel.ys[candidate] - ay
+        if all(present(kinds[i], *instance.transform(source.xs[i], source.ys[i]))
+               for i in range(len(source))):
+            instances.append(instance)
+    return instances
+
+def _cell(x: float, y: float) -> Tuple[int, int]:
+    return int(x // POSITION_TOLERANCE), int(y // POSITION_TOLERANCE)
+
+def instanceInteriors(sourceBoard: pcbnew.BOARD, instances: List[BoardInstance],
+                      margin: int=INSTANCE_MARGIN) -> Optional[BaseGeometry]:
+    """
+    Return the region covered by the source board DRC: the board outlines of
+    the instances shrunk by the margin. The outline is used instead of the
+    bounding box, as the panel can hold tabs or frame in the concave parts of
+    the bounding box.
+    """
+    outline = Substrate(collectEdges(sourceBoard, Layer.Edge_Cuts)).substrates
+    interior = outline.buffer(-margin)
+    if interior.is_empty:
+        return None
+    return unary_union([i.transformGeometry(interior) for i in instances])
+
+def _itemBox(item: pcbnew.BOARD_ITEM) -> Polygon:
+    b = item.GetBoundingBox()
+    return box(b.GetX(), b.GetY(), b.GetX() + b.GetWidth(), b.GetY() + b.GetHeight())
+
+@dataclass
+class ClippedItems:
+    """
+    Summary of the items removed from the panel by clipping.
+    """
+    count: int
+    nets: Set[int] # Codes of the nets the removed items were connected to
+
+def _netCode(item: pcbnew.BOARD_ITEM) -> int:
+    # Only connected items have a net; code 0 stands for no net
+    return item.GetNetCode() if isinstance(item, pcbnew.BOARD_CONNECTED_ITEM) else 0
+
+def clipPanel(panel: pcbnew.BOARD, interiors: BaseGeometry) -> ClippedItems:
+    """
+    Remove items lying completely inside the interiors from the panel.
+    """
+    candidates = list(panel.GetTracks()) + list(panel.GetFootprints()) + \
+                 list(panel.GetDrawings()) + list(panel.Zones())
+    toRemove = [x for x in candidates if interiors.contains(_itemBox(x))]
+    nets: Set[int] = set()
+    for x in toRemove:
+        if isinstance(x, pcbnew.FOOTPRINT):
+            nets.update(pad.GetNetCode() for pad in x.Pads())
+        else:
+            nets.add(_netCode(x))
+    nets.discard(0)
+    for x in toRemove:
+        panel.Remove(x)
+    return ClippedItems(len(toRemove), nets)
+
+def pruneClippingArtifacts(report: DrcReport, interiors: BaseGeometry,
+                           clipped: ClippedItems) -> None:
+    """
+    Remove the violations caused by clipping from the report: violations of
+    the artifact types involving an object that touches the interiors or is
+    connected to a removed item. Violations elsewhere in the panel are kept.
+    """
+    def isArtifact(v: Violation) -> bool:
+        if v.type not in CLIPPING_ARTIFACTS:
+            return False
+        return any(interiors.intersects(_itemBox(x)) or _netCode(x) in clipped.nets
+                   for x in v.objects)
+    def relevant(violations: List[Violation]) -> List[Violation]:
+        return [v for v in violations if not isArtifact(v)]
+    report.drc = relevant(report.drc)
+    report.unconnected = relevant(report.unconnected)
+    report.footprint = relevant(report.footprint)
+
+
+class InstanceLocator:
+    """
+    Maps panel positions to positions relative to the board instance that
+    contains them, so the same spot in different instances maps to the same
+    position. Positions outside all instances are kept as they are.
+    """
+    def __init__(self, sourceBoard: pcbnew.BOARD, instances: List[BoardInstance]) -> None:
+        bbox = findBoardBoundingBox(sourceBoard)
+        self._bounds = (bbox.GetX(), bbox.GetY(),
+                        bbox.GetX() + bbox.GetWidth(), bbox.GetY() + bbox.GetHeight())
+        self._instances = instances
+
+    def relative(self, x: float, y: float) -> Tuple[float, float]:
+        x1, y1, x2, y2 = self._bounds
+        for instance in self._instances:
+            rx, ry = instance.inverse(x, y)
+            if x1 <= rx <= x2 and y1 <= ry <= y2:
+                return rx, ry
+        return x, y
+
+
+@dataclass
+class ViolationGroup:
+    first: Violation
+    count: int = 1
+
+def violationPositions(v: Violation, locator: Optional[InstanceLocator]=None) \
+        -> Tuple[Tuple[float, float], ...]:
+    """
+    Positions of the objects involved in the violation, relative to the board
+    instance if a locator is given.
+    """
+    positions = []
+    for item in v.objects:
+        pos = item.GetPosition()
+        positions.append((pos[0], pos[1]) if locator is None
+                         else locator.relative(pos[0], pos[1]))
+    return tuple(positions)
+
+def groupViolations(violations: List[Violation],
+                    locator: Optional[InstanceLocator]=None) -> List[ViolationGroup]:
+    """
+    Group violations of the same type at the same position relative to the
+    board instance. The groups are ordered by their first occurrence.
+    """
+    groups: Dict[Hashable, ViolationGroup] = {}
+    for v in violations:
+        if len(v.objects) == 0:
+            key: Hashable = (v.type, v.description)
+        else:
+            key = (v.type, tuple((round(x / POSITION_TOLERANCE), round(y / POSITION_TOLERANCE))
+                                 for x, y in violationPositions(v, locator)))
+        group = groups.get(key)
+        if group is None:
+            groups[key] = ViolationGroup(v)
+        else:
+            group.count += 1
+    return list(groups.values())
@@ -10,6 +10,9 @@ FOOTPRINT_REPO = "prusa3d/PrusaKicadLib"
 # This is only a temporary override for initial testing
 FOOTPRINT_REPO = "yaqwsx/PrusaKicadLib"
 
+GITHUB_API = "https://api.github.com"
+FOOTPRINT_REVISION_TTL = 15 * 60 # seconds
+
 @dataclass
 class GluStampType:
     dia: int
@@ -25,6 +28,28 @@ GLUE_STAMPS = { s.dia: s for s in [
     GluStampType(FromMM(1.83), 1200, 50, 2, FromMM(0.5)),
 ]}
 
+@dataclass
+class DispenserModel:
+    """
+    Time model of the glue dispenser used to plan the order of stamps. The
+    values are estimates; they are used only to compare plans and to give the
+    operator the expected cycle time.
+    """
+    travelSpeed: int # Board units per second
+    stepRate: float # Dispenser motor steps per second
+    stampOverhead: float # Lowering and lifting the needle in seconds
+    typeSwitchPenalty: float # Reconfiguring the dispenser in seconds
+
+    def dwellTime(self, stamp: GluStampType) -> float:
+        return (stamp.stepsForward + stamp.stepsBackwards) / self.stepRate + \
+               self.stampOverhead
+
+DISPENSER = DispenserModel(
+    travelSpeed=FromMM(100),
+    stepRate=2000,
+    stampOverhead=0.3,
+    typeSwitchPenalty=30)
+
 MILL_RELEVANT_FOOTPRINTS = [
     "prusa_other:hole4cutter-1,5mm",
     "prusa_other:hole4cutter-2mm"
@@ -58,6 +58,9 @@ class PrusamanProject:
     def getMillReadmeTemplate(self) -> Path:
         return self._projectdir / "readme.freza.template.txt"
 
+    def getDrcBaseline(self) -> Path:
+        return self._projectdir / "drc-baseline.json"
+
     def getDir(self) -> Path:
         return self._projectdir
 
@@ -70,6 +73,10 @@ class PrusamanProject:
 
     @property
     def board(self) -> pcbnew.BOARD:
+        """
+        Load a fresh instance of the board on every access. When you need the
+        board repeatedly, use BoardPool instead.
+        """
         return pcbnew.LoadBoard(str(self.getBoard()))
 
     @cached_property
@@ -28,6 +28,10 @@ class Schema:
     def fromFile(path: Union[str, Path]) -> Schema:
         with open(path, "r") as f:
             ast = parseSexprF(f)
+        return Schema.fromAst(ast)
+
+    @staticmethod
+    def fromAst(ast: SExpr) -> Schema:
         paper = ""
         titleBlock = {}
         for item in ast.items:
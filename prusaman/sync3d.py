@@ -2,10 +2,13 @@ from __future__ import annotations
 import pcbnew
 from dataclasses import dataclass
 
-from kikit.eeschema_v6 import extractComponents, getReference
+from kikit.eeschema_v6 import getReference
 
 from .project import PrusamanProject
 from .bom import PnBFilter
+from .components import ComponentModel
+from .footprints import FootprintTable
+from .util import StrPath
 
 # You might be wondering why so much code for such a simple task? Well, it seems
 # that the SWIG API just ignores changes in the original model, so we have to
@@ -66,12 +69,12 @@ def synchronize3D(board: pcbnew.BOARD) -> None:
     """
     project = PrusamanProject(board.GetFileName())
 
-    bomFilter = PnBFilter()
-    bom = extractComponents(str(project.getSchema()))
-    visibleRef = set([getReference(x) for x in bom if bomFilter.assemblyFilter(x)])
+    components = ComponentModel.fromFile(project.getSchema(), PnBFilter())
+    visibleRef = set([getReference(x) for x in components.assembly])
 
-    for f in board.Footprints():
-        visible = f.GetReference() in visibleRef
+    footprints = FootprintTable.fromBoard(board)
+    for ref, f in zip(footprints.references, footprints.handles):
+        visible = ref in visibleRef
 
         # The following code is broken in KiCAD API, let's rebuild the model list
         # for model in f.Models():
@@ -86,3 +89,12 @@ def synchronize3D(board: pcbnew.BOARD) -> None:
             m.show = visible
             f.Add3DModel(m.toModel())
 
+
+def synchronizeProject3D(source: StrPath) -> None:
+    """
+    Synchronize 3D models of the board of given project and save the board.
+    """
+    project = PrusamanProject(source)
+    board = pcbnew.LoadBoard(str(project.getBoard()))
+    synchronize3D(board)
+    board.Save(project.getBoard())
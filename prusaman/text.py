@@ -1,6 +1,7 @@
 from decimal import Decimal
 from typing import Optional, Callable, Union
 import pcbnew # type: ignore
+from .footprints import FootprintTable
 from .pcbnew_common import findBoardBoundingBox
 from .params import RESOURCES
 from datetime import datetime
@@ -25,14 +26,14 @@ def formatDatamatrixInfo(board: Optional[pcbnew.BOARD], boardId: Union[str, int,
         raise RuntimeError("Cannot use DMC in template without board context")
     if boardId is None:
         raise RuntimeError("Cannot use DMC in template without project context")
-    dmcs = [f for f in board.Footprints()
-            if f.GetValue().startswith("G_DATAMATRIX")]
-    dmcs.sort(key=lambda f: (f.GetLayer(), f.GetPosition()[0], -f.GetPosition()[1]))
+    dmcs = [f for f in FootprintTable.fromBoard(board)
+            if f.value.startswith("G_DATAMATRIX")]
+    dmcs.sort(key=lambda f: (f.layer, f.x, -f.y))
     message = "- More about data format in attached PDF document\n"
     message += f"- ID {boardId}\n"
     message += f"- DMC positions:\n"
     for d in dmcs:
-        message += f"    - \"{d.GetReference()}\", {pcbnew.ToMM(d.GetPosition()[0])}, {pcbnew.ToMM(-d.GetPosition()[1])}, {d.GetOrientation() // 10}, {dmcLayername(d.GetLayer())}\n"
+        message += f"    - \"{d.reference}\", {pcbnew.ToMM(d.x)}, {pcbnew.ToMM(-d.y)}, {d.orientation // 10}, {dmcLayername(d.layer)}\n"
     return message
 
 def formatStackup(board: Optional[pcbnew.BOARD]) -> str:
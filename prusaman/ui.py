@@ -1,34 +1,51 @@
+import glob
+import multiprocessing
+import os
 import shutil
-from typing import Optional
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, TextIO, Tuple
 import click
 import sys
 import textwrap
 
-from prusaman.sync3d import synchronize3D
 from . import __version__
-from .util import replaceDirectory
-from .manugenerator import Manugenerator, PrusamanProject, stdioPrompt, BoardError
+from .util import StrPath, locatePythonInterpreter, replaceDirectory
+from .archive import DEFAULT_COMPRESSION_LEVEL
+from .cache import BuildCache
 from pathlib import Path
-import pcbnew
+
+# The CLI is often invoked only for introspection (--help, --version). Heavy
+# modules (pcbnew, KiKit and the manugenerator) are therefore imported only
+# inside the commands that need them.
 
 class StdReporter:
     def __init__(self, reportWarnings: bool, reportInfo: bool,
-                 defaultAnswer: Optional[bool]) -> None:
+                 defaultAnswer: Optional[bool],
+                 stream: Optional[TextIO]=None) -> None:
         self._repW = reportWarnings
         self._repI = reportInfo
         self._defAnswer = defaultAnswer
+        self._stream = stream
         self.triggered = False
+        self.warnings = 0
+        self.errors = 0
 
     def warning(self, tag: str, message: str) -> None:
         if not self._repW or len(message) == 0:
             return
         self.triggered = True
+        self.warnings += 1
         self._print("Warning", tag, message)
 
     def error(self, tag: str, message: str) -> None:
         if not self._repW or len(message) == 0:
             return
         self.triggered = True
+        self.errors += 1
         self._print("Error", tag, message)
 
     def info(self, tag: str, message: str) -> None:
@@ -39,15 +56,17 @@ class StdReporter:
     def prompt(self, tag: str, prompt: str) -> None:
         if self._defAnswer is not None:
             return self._defAnswer
+        from .manugenerator import stdioPrompt
         return stdioPrompt(tag, prompt)
 
     def _print(self, header: str, tag: str, message: str) -> None:
         BODY = 80
         wMessages = textwrap.wrap(message, BODY)
         head, *tail = wMessages
-        sys.stderr.write(f"{header + ' ' + tag + ': ':>20}{head}\n")
+        stream = self._stream if self._stream is not None else sys.stderr
+        stream.write(f"{header + ' ' + tag + ': ':>20}{head}\n")
         if len(tail) > 0:
-            sys.stderr.write(textwrap.indent("\n".join(tail), 20 * " ") + "\n")
+            stream.write(textwrap.indent("\n".join(tail), 20 * " ") + "\n")
 
 
 @click.command()
@@ -64,19 +83,80 @@ class StdReporter:
     help="Decide how to handle interactive prompt")
 @click.option("--debug", is_flag=True,
     help="Show stacktraces")
-def make(source, outputdir, force, werror, silent, question, debug):
+@click.option("--jobs", "-j", type=click.IntRange(min=1), default=1,
+    help="Number of worker processes used to build independent stages")
+@click.option("--no-cache", is_flag=True,
+    help="Do not reuse outputs of previous builds, rebuild everything")
+@click.option("--compression-level", "-z", type=click.IntRange(min=0, max=9),
+              default=DEFAULT_COMPRESSION_LEVEL, show_default=True,
+    help="Compression level of the produced archives (0 = no compression)")
+@click.option("--offline", is_flag=True, envvar="PRUSAMAN_OFFLINE",
+    help="Do not contact GitHub, validate footprints against the last synchronized library")
+@click.option("--panel-drc", type=click.Choice(["full", "instances"]), default="full",
+              show_default=True,
+    help="Check the whole panel or only the panel outside the board instances covered by the source board DRC")
+def make(source, outputdir, force, werror, silent, question, debug, jobs,
+         no_cache, compression_level, offline, panel_drc):
     """
     Make manufacturing files for a project (SOURCE) into OUTPUTDIR.
     """
+    from .manugenerator import BoardError
     from .pcbnew_common import fakeKiCADGui
 
     app = fakeKiCADGui()
 
+    reporter = StdReporter(
+        reportWarnings=(werror or not silent),
+        reportInfo=(not silent),
+        defaultAnswer=_defaultAnswer(question))
+    try:
+        buildProject(source, outputdir, force=force, werror=werror,
+                     reporter=reporter, jobs=jobs,
+                     cache=None if no_cache else BuildCache(),
+                     compressionLevel=compression_level, offline=offline,
+                     panelDrc=panel_drc)
+    except BoardError as e:
+        sys.stderr.write(f"Error occurred: \n{textwrap.indent(str(e), '   ')}\n")
+        sys.stderr.write(f"\nNo output files produced. Build artifacts are stored in {failedDir(outputdir)}\n")
+        if debug:
+            raise e
+    except Exception as e:
+        sys.stderr.write(f"Unexpected error occurred: \n{textwrap.indent(str(e), '   ')}\n")
+        sys.stderr.write(f"Build artifacts are stored in {failedDir(outputdir)}\n")
+        sys.stderr.write(f"This is probably a bug, please open issue and attach the stacktrace below:")
+        raise e
+
+
+def _defaultAnswer(question: str) -> Optional[bool]:
+    if question == "yes":
+        return True
+    if question == "no":
+        return False
+    return None
+
+def failedDir(outputdir: StrPath) -> Path:
+    """
+    Directory with the build artifacts of a failed build into outputdir
+    """
+    outputdir = Path(outputdir).resolve()
+    return outputdir.parent / (outputdir.name + "-failed")
+
+def buildProject(source: StrPath, outputdir: StrPath, force: bool, werror: bool,
+                 reporter: StdReporter, jobs: int=1,
+                 cache: Optional[BuildCache]=None,
+                 compressionLevel: int=DEFAULT_COMPRESSION_LEVEL,
+                 offline: bool=False, panelDrc: str="full") -> None:
+    """
+    Make manufacturing files for a project into outputdir. On failure, the
+    exception is propagated and the build artifacts are moved into
+    failedDir(outputdir).
+    """
+    from .manugenerator import BoardError, Manugenerator, PrusamanProject
+
     # We use temporary directory so we do not damage any existing files in
     # process. Once we are done, we atomically swap the directories
-    tmpdir = Path(outputdir).resolve()
-    faileddir = tmpdir.parent / (tmpdir.name + "-failed")
-    tmpdir = tmpdir.parent / (tmpdir.name + "-temp")
+    faileddir = failedDir(outputdir)
+    tmpdir = faileddir.parent / (Path(outputdir).resolve().name + "-temp")
 
     shutil.rmtree(faileddir, ignore_errors=True)
     shutil.rmtree(tmpdir, ignore_errors=True)
@@ -88,22 +168,16 @@ def make(source, outputdir, force, werror, silent, question, debug):
             raise BoardError(f"Cannot produce output: {outputdir} already exists.\n" +
                                 "If you wish to rewrite the files, rerun the command with --force")
 
-        defaultAnswer = None
-        if question == "yes":
-            defaultAnswer = True
-        if question == "no":
-            defaultAnswer = False
-
-        reporter = StdReporter(
-            reportWarnings=(werror or not silent),
-            reportInfo=(not silent),
-            defaultAnswer=defaultAnswer)
-
         generator = Manugenerator(project, tmpdir,
                         reportInfo=reporter.info,
                         reportWarning=reporter.warning,
                         reportError=reporter.error,
-                        askContinuation=reporter.prompt)
+                        askContinuation=reporter.prompt,
+                        jobs=jobs,
+                        cache=cache,
+                        compressionLevel=compressionLevel,
+                        offline=offline,
+                        panelDrc=panelDrc)
         generator.make()
 
         if werror and reporter.triggered:
@@ -111,31 +185,362 @@ def make(source, outputdir, force, werror, silent, question, debug):
 
         Path(outputdir).mkdir(parents=True, exist_ok=True)
         replaceDirectory(outputdir, tmpdir)
-    except BoardError as e:
-        sys.stderr.write(f"Error occurred: \n{textwrap.indent(str(e), '   ')}\n")
-        sys.stderr.write(f"\nNo output files produced. Build artifacts are stored in {faileddir}\n")
-        replaceDirectory(faileddir, tmpdir)
-        if debug:
-            raise e
-    except Exception as e:
-        sys.stderr.write(f"Unexpected error occurred: \n{textwrap.indent(str(e), '   ')}\n")
-        sys.stderr.write(f"Build artifacts are stored in {faileddir}\n")
-        sys.stderr.write(f"This is probably a bug, please open issue and attach the stacktrace below:")
-        raise e
+    except Exception:
+        if tmpdir.exists():
+            replaceDirectory(faileddir, tmpdir)
+        raise
     finally:
         shutil.rmtree(tmpdir, ignore_errors=True)
 
 
+@dataclass
+class BatchResult:
+    """
+    Outcome of building a single project of a batch
+    """
+    source: str
+    outputdir: str
+    status: str # "OK", "FAILED" or "CRASHED"
+    message: str = ""
+    warnings: int = 0
+    errors: int = 0
+    duration: float = 0
+
+# The fake KiCAD application of a batch worker process. It has to outlive the
+# builds done by the worker.
+_batchApp = None
+
+def _initBatchWorker() -> None:
+    from .pcbnew_common import fakeKiCADGui
+
+    global _batchApp
+    _batchApp = fakeKiCADGui()
+
+def _buildBatchProject(source: str, outputdir: str, force: bool, werror: bool,
+                       defaultAnswer: bool, jobs: int, useCache: bool,
+                       compressionLevel: int, offline: bool,
+                       panelDrc: str) -> BatchResult:
+    """
+    Build a single project of a batch. Unlike make, it never raises; the
+    outcome is captured in the result. The console output of the build is
+    written into a log file next to the output directory.
+    """
+    from .manugenerator import BoardError
+
+    start = time.perf_counter()
+    result = BatchResult(source=source, outputdir=outputdir, status="OK")
+    logPath = Path(outputdir).resolve().parent / (Path(outputdir).name + ".log")
+    with open(logPath, "w", encoding="utf-8") as log:
+        reporter = StdReporter(reportWarnings=True, reportInfo=True,
+                               defaultAnswer=defaultAnswer, stream=log)
+        try:
+            buildProject(source, outputdir, force=force, werror=werror,
+                         reporter=reporter, jobs=jobs,
+                         cache=BuildCache() if useCache else None,
+                         compressionLevel=compressionLevel, offline=offline,
+                         panelDrc=panelDrc)
+        except BoardError as e:
+            result.status = "FAILED"
+            result.message = str(e)
+        except Exception as e:
+            result.status = "CRASHED"
+            result.message = f"{type(e).__name__}: {e}"
+            log.write(traceback.format_exc())
+        result.warnings = reporter.warnings
+        result.errors = reporter.errors
+    result.duration = time.perf_counter() - start
+    return result
+
+def _crashedBatchResult(task: Tuple[Any, ...], e: BaseException,
+                        duration: float=0) -> BatchResult:
+    return BatchResult(source=task[0], outputdir=task[1], status="CRASHED",
+                       message=f"{type(e).__name__}: {e}", duration=duration)
+
+def _buildIsolatedBatchProject(ctx: Any, task: Tuple[Any, ...]) -> BatchResult:
+    """
+    Build a single project of a batch in a dedicated worker process, so its
+    crash affects no other project.
+    """
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=1, mp_context=ctx,
+                             initializer=_initBatchWorker) as executor:
+        try:
+            return executor.submit(_buildBatchProject, *task).result()
+        except BrokenProcessPool:
+            return BatchResult(source=task[0], outputdir=task[1], status="CRASHED",
+                               message="The worker process died unexpectedly",
+                               duration=time.perf_counter() - start)
+        except Exception as e:
+            return _crashedBatchResult(task, e, time.perf_counter() - start)
+
+def _expandBatchSources(sources: Iterable[str]) -> List[Path]:
+    """
+    Expand the glob patterns (on Windows the shell doesn't do it for us) and
+    remove duplicates while preserving order.
+    """
+    projects: List[Path] = []
+    for source in sources:
+        isPattern = any(c in source for c in "*?[")
+        matches = sorted(glob.glob(source)) if isPattern else [source]
+        if len(matches) == 0:
+            raise click.BadParameter(f"Pattern '{source}' matches no project", param_hint="SOURCES")
+        for m in matches:
+            path = Path(m).resolve()
+            if not path.exists():
+                raise click.BadParameter(f"Project '{m}' does not exist", param_hint="SOURCES")
+            if path not in projects:
+                projects.append(path)
+    return projects
+
+def _batchOutputName(source: Path) -> str:
+    if source.is_dir():
+        return source.name
+    return source.stem
+
+def writeBatchSummary(file: TextIO, results: List[BatchResult]) -> None:
+    namePad = max([len("Project")] + [len(Path(r.outputdir).name) for r in results])
+    file.write(f"{'Project':<{namePad}} | Status  |  Time [s] | Warnings | Errors | Message\n")
+    for r in results:
+        message = r.message.splitlines()[0] if len(r.message) > 0 else ""
+        file.write(f"{Path(r.outputdir).name:<{namePad}} | {r.status:<7} | " +
+                   f"{r.duration:>9.1f} | {r.warnings:>8} | {r.errors:>6} | {message}\n")
+    failed = len([r for r in results if r.status != "OK"])
+    file.write(f"\n{len(results) - failed} succeeded, {failed} failed\n")
+
+@click.command("make-batch")
+@click.argument("sources", nargs=-1, required=True)
+@click.argument("outputroot", type=click.Path(file_okay=False, dir_okay=True))
+@click.option("--force", "-f", is_flag=True,
+    help="If existing path already contains files, overwrite them.")
+@click.option("--werror", "-w", is_flag=True,
+    help="Treat warnings as errors")
+@click.option("--question", default="no",
+              type=click.Choice(["yes", "no"], case_sensitive=False),
+    help="Answer to all interactive prompts")
+@click.option("--processes", "-p", type=click.IntRange(min=1),
+              default=os.cpu_count() or 1, show_default="number of CPUs",
+    help="Number of projects built at once")
+@click.option("--jobs", "-j", type=click.IntRange(min=1), default=1,
+    help="Number of worker processes used to build stages of a single project")
+@click.option("--no-cache", is_flag=True,
+    help="Do not reuse outputs of previous builds, rebuild everything")
+@click.option("--compression-level", "-z", type=click.IntRange(min=0, max=9),
+              default=DEFAULT_COMPRESSION_LEVEL, show_default=True,
+    help="Compression level of the produced archives (0 = no compression)")
+@click.option("--offline", is_flag=True, envvar="PRUSAMAN_OFFLINE",
+    help="Do not contact GitHub, validate footprints against the last synchronized library")
+@click.option("--panel-drc", type=click.Choice(["full", "instances"]), default="full",
+              show_default=True,
+    help="Check the whole panel or only the panel outside the board instances covered by the source board DRC")
+def makeBatch(sources, outputroot, force, werror, question, processes, jobs,
+              no_cache, compression_level, offline, panel_drc):
+    """
+    Make manufacturing files for multiple projects (SOURCES, directories or
+    glob patterns) into OUTPUTROOT. Each project is built into its own
+    subdirectory; its console output is stored in a log file next to it.
+    """
+    projects = _expandBatchSources(sources)
+    outputroot = Path(outputroot).resolve()
+    outputs: Dict[str, Path] = {}
+    for project in projects:
+        name = _batchOutputName(project)
+        if name in outputs:
+            raise click.BadParameter(f"Projects {outputs[name]} and {project} " +
+                                      f"would both be built into {outputroot / name}",
+                                      param_hint="SOURCES")
+        outputs[name] = project
+    outputroot.mkdir(parents=True, exist_ok=True)
+
+    # We use spawn as pcbnew and wx do not survive fork. We also have to
+    # point multiprocessing to the real interpreter when running inside KiCAD.
+    ctx = multiprocessing.get_context("spawn")
+    ctx.set_executable(locatePythonInterpreter())
+    tasks = [(str(project), str(outputroot / name), force, werror,
+              _defaultAnswer(question), jobs, not no_cache, compression_level,
+              offline, panel_drc)
+             for name, project in outputs.items()]
+    results: List[BatchResult] = []
+    def collect(r: BatchResult) -> None:
+        results.append(r)
+        sys.stderr.write(f"[{len(results)}/{len(tasks)}] {r.status:<7} {Path(r.outputdir).name} " +
+                         f"({r.duration:.1f} s, {r.warnings} warnings, {r.errors} errors)\n")
+
+    # A worker dying (e.g., pcbnew crashing) breaks the whole pool and we
+    # cannot tell which of the running projects caused it. The unfinished
+    # projects are therefore built again, each in its own process.
+    unfinished = []
+    with ProcessPoolExecutor(max_workers=min(processes, len(tasks)),
+                             mp_context=ctx,
+                             initializer=_initBatchWorker) as executor:
+        futures = {executor.submit(_buildBatchProject, *task): task for task in tasks}
+        for future in as_completed(futures):
+            try:
+                collect(future.result())
+            except BrokenProcessPool:
+                unfinished.append(futures[future])
+            except Exception as e:
+                collect(_crashedBatchResult(futures[future], e))
+    if len(unfinished) > 0:
+        sys.stderr.write("A worker process died, building the remaining " +
+                         f"{len(unfinished)} projects in separate processes\n")
+        with ThreadPoolExecutor(max_workers=min(processes, len(unfinished))) as executor:
+            isolated = [executor.submit(_buildIsolatedBatchProject, ctx, task)
+                        for task in unfinished]
+            for future in as_completed(isolated):
+                collect(future.result())
+    results.sort(key=lambda r: Path(r.outputdir).name)
+
+    with open(outputroot / "prusaman-batch-summary.txt", "w", encoding="utf-8") as f:
+        writeBatchSummary(f, results)
+    sys.stderr.write("\n")
+    writeBatchSummary(sys.stderr, results)
+    if any(r.status != "OK" for r in results):
+        sys.exit(1)
+
+
 @click.command()
 @click.argument("source", type=click.Path(file_okay=True, dir_okay=True, exists=True))
 def sync3d(source):
     """
     Synchronize the visibility of 3D models in given project.
     """
-    project = PrusamanProject(source)
-    board = pcbnew.LoadBoard(str(project.getBoard()))
-    synchronize3D(board)
-    board.Save(project.getBoard())
+    from .sync3d import synchronizeProject3D
+
+    synchronizeProject3D(source)
+
+
+@click.command("drc-baseline")
+@click.argument("source", type=click.Path(file_okay=True, dir_okay=True, exists=True))
+def drcBaseline(source):
+    """
+    Record the current DRC violations of a project (SOURCE) as known. The
+    baseline is stored in drc-baseline.json in the project directory and the
+    builds then report only violations that are not in it.
+    """
+    from .drcbaseline import recordDrcBaseline
+    from .pcbnew_common import fakeKiCADGui
+
+    app = fakeKiCADGui()
+    try:
+        path, count = recordDrcBaseline(source)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    sys.stderr.write(f"Recorded {count} DRC violations into {path}\n")
+
+
+@click.command()
+@click.option("--socket", "socketPath", type=click.Path(dir_okay=False), default=None,
+    help="Unix socket to listen on (default ~/.prusaman/daemon.sock)")
+@click.option("--workers", type=click.IntRange(min=1), default=2, show_default=True,
+    help="Number of warm worker processes")
+@click.option("--recycle", type=click.IntRange(min=1), default=10, show_default=True,
+    help="Restart a worker after it served given number of requests")
+def daemon(socketPath, workers, recycle):
+    """
+    Run a daemon that keeps worker processes with pcbnew and KiKit loaded, so
+    the requests sent via 'prusaman client' start immediately.
+    """
+    from .daemon import serve
+
+    try:
+        serve(socketPath, workers, recycle)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+
+@click.group()
+@click.option("--socket", "socketPath", type=click.Path(dir_okay=False), default=None,
+    help="Unix socket of the daemon (default ~/.prusaman/daemon.sock)")
+@click.pass_context
+def client(ctx, socketPath):
+    """
+    Forward requests to a running Prusaman daemon.
+    """
+    from .daemon import DaemonClient
+
+    ctx.obj = DaemonClient(socketPath)
+    if not ctx.obj.available():
+        raise click.ClickException(f"No Prusaman daemon is listening on {ctx.obj.socketPath}")
+
+def _reportDaemonResult(result: Dict[str, Any]) -> None:
+    if result["status"] == "failed":
+        sys.stderr.write(f"Error occurred: \n{textwrap.indent(result['message'], '   ')}\n")
+        if "faileddir" in result:
+            sys.stderr.write(f"\nNo output files produced. Build artifacts are stored in {result['faileddir']}\n")
+    if result["status"] == "crashed":
+        sys.stderr.write(f"Unexpected error occurred: \n{textwrap.indent(result['message'], '   ')}\n")
+        if "faileddir" in result:
+            sys.stderr.write(f"Build artifacts are stored in {result['faileddir']}\n")
+        sys.stderr.write(f"This is probably a bug, please open issue and attach the stacktrace below:\n")
+        sys.stderr.write(result.get("traceback", ""))
+        sys.exit(1)
+
+@client.command("make")
+@click.argument("source", type=click.Path(file_okay=True, dir_okay=True, exists=True))
+@click.argument("outputdir", type=click.Path(file_okay=False, dir_okay=True))
+@click.option("--force", "-f", is_flag=True,
+    help="If existing path already contains files, overwrite them.")
+@click.option("--silent", "-s", is_flag=True,
+    help="Report only errors")
+@click.option("--werror", "-w", is_flag=True,
+    help="Treat warnings as errors")
+@click.option("--question", default="ask",
+              type=click.Choice(["yes", "no", "ask"], case_sensitive=False),
+    help="Decide how to handle interactive prompt")
+@click.option("--no-cache", is_flag=True,
+    help="Do not reuse outputs of previous builds, rebuild everything")
+@click.option("--compression-level", "-z", type=click.IntRange(min=0, max=9),
+              default=DEFAULT_COMPRESSION_LEVEL, show_default=True,
+    help="Compression level of the produced archives (0 = no compression)")
+@click.option("--offline", is_flag=True, envvar="PRUSAMAN_OFFLINE",
+    help="Do not contact GitHub, validate footprints against the last synchronized library")
+@click.option("--panel-drc", type=click.Choice(["full", "instances"]), default="full",
+              show_default=True,
+    help="Check the whole panel or only the panel outside the board instances covered by the source board DRC")
+@click.pass_obj
+def clientMake(daemonClient, source, outputdir, force, werror, silent,
+               question, no_cache, compression_level, offline, panel_drc):
+    """
+    Make manufacturing files for a project (SOURCE) into OUTPUTDIR using the
+    daemon.
+    """
+    reporter = StdReporter(
+        reportWarnings=(werror or not silent),
+        reportInfo=(not silent),
+        defaultAnswer=_defaultAnswer(question))
+    result = daemonClient.make(source, outputdir, force=force, werror=werror,
+                               defaultAnswer=_defaultAnswer(question),
+                               noCache=no_cache,
+                               compressionLevel=compression_level,
+                               offline=offline,
+                               panelDrc=panel_drc,
+                               reportInfo=reporter.info,
+                               reportWarning=reporter.warning,
+                               reportError=reporter.error,
+                               askContinuation=reporter.prompt)
+    _reportDaemonResult(result)
+
+@client.command("sync3d")
+@click.argument("source", type=click.Path(file_okay=True, dir_okay=True, exists=True))
+@click.pass_obj
+def clientSync3d(daemonClient, source):
+    """
+    Synchronize the visibility of 3D models in given project using the daemon.
+    """
+    reporter = StdReporter(reportWarnings=True, reportInfo=True, defaultAnswer=None)
+    result = daemonClient.sync3d(source,
+                                 reportInfo=reporter.info,
+                                 reportWarning=reporter.warning,
+                                 reportError=reporter.error)
+    _reportDaemonResult(result)
+
+@client.command("stop")
+@click.pass_obj
+def clientStop(daemonClient):
+    """
+    Shut the daemon down.
+    """
+    daemonClient.shutdown()
 
 
 @click.group()
@@ -147,7 +552,11 @@ def cli():
     pass
 
 cli.add_command(make)
+cli.add_command(makeBatch)
 cli.add_command(sync3d)
+cli.add_command(drcBaseline)
+cli.add_command(daemon)
+cli.add_command(client)
 
 if __name__ == "__main__":
     cli()
@@ -1,10 +1,13 @@
-from zipfile import ZipFile, ZIP_DEFLATED
+from contextlib import contextmanager
 from pathlib import Path
 import shutil
 import os
 import sys
+import tempfile
 
-from typing import Union, List, Optional, TypeVar, Callable, Tuple, Iterable, Dict
+from typing import Union, List, Optional, TypeVar, Callable, Tuple, Iterable, Dict, Iterator
+
+from .archive import DEFAULT_COMPRESSION_LEVEL, writeArchive
 
 T = TypeVar("T")
 K = TypeVar("K")
@@ -22,20 +25,68 @@ def replaceDirectory(target: Union[Path, str], source: Union[Path, str]) -> None
     shutil.rmtree(target, ignore_errors=True)
     shutil.move(source, target)
 
+def writeFileAtomically(path: StrPath, content: Union[str, bytes]) -> None:
+    """
+    Write the file under a unique temporary name first and then replace the
+    target, so concurrent readers and writers never see a partial file.
+    """
+    path = Path(path)
+    fd, tmpName = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content.encode("utf-8") if isinstance(content, str) else content)
+        os.replace(tmpName, path)
+    except BaseException:
+        os.unlink(tmpName)
+        raise
+
+@contextmanager
+def fileLock(path: StrPath) -> Iterator[None]:
+    """
+    Hold an exclusive lock of the file (created if needed) for the duration of
+    the block. Every holder opens the file on its own, so the lock excludes
+    both other processes and other threads.
+    """
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            # LK_LOCK gives up after 10 seconds, so we keep retrying
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
 def zipFiles(archivePath: StrPath, basePath: StrPath, archiveSubdir: Optional[StrPath],
-             files: List[StrPath]) -> None:
+             files: List[StrPath],
+             compressionLevel: int=DEFAULT_COMPRESSION_LEVEL) -> None:
     """
     Take archive output name, base path and list of files to put inside a ZIP
-    archive. If the archive exists, the files are added to the existing archive.
+    archive. If the archive exists, it is replaced. Already compressed files
+    (e.g., nested archives) are stored without compression.
     """
     assert os.path.realpath(archivePath) not in [os.path.realpath(f) for f in files]
-    with ZipFile(archivePath, "a", compression=ZIP_DEFLATED, compresslevel=9) as zipF:
-        for fileName in files:
-            relativeName = os.path.relpath(str(fileName), str(basePath))
-            if archiveSubdir is not None:
-                relativeName = os.path.join(archiveSubdir, relativeName)
-            with open(fileName, "rb") as src, zipF.open(str(relativeName), "w") as dst:
-                shutil.copyfileobj(src, dst)
+    members = []
+    for fileName in files:
+        relativeName = os.path.relpath(str(fileName), str(basePath))
+        if archiveSubdir is not None:
+            relativeName = os.path.join(archiveSubdir, relativeName)
+        members.append((fileName, str(relativeName)))
+    writeArchive(archivePath, members, compressionLevel)
 
 def defaultTo(val: Optional[T], default: T) -> T:
     """
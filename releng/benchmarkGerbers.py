@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+import click
+import filecmp
+import os
+import re
+import tempfile
+import time
+from pathlib import Path
+
+# Lines that carry the time of plotting
+DATE_LINE = re.compile(rb"^(G04 Created by KiCad.*|%TF\.CreationDate.*|;.*date.*|.*\"CreationDate\".*)$",
+                       re.MULTILINE)
+
+def normalizedContent(path):
+    with open(path, "rb") as f:
+        return DATE_LINE.sub(b"", f.read())
+
+def compareOutputs(serialDir, parallelDir):
+    """
+    Return list of differences between the two gerber directories ignoring
+    the plot dates.
+    """
+    comparison = filecmp.dircmp(serialDir, parallelDir)
+    differences = [f"only in serial: {x}" for x in comparison.left_only] + \
+                  [f"only in parallel: {x}" for x in comparison.right_only]
+    for name in comparison.common_files:
+        if normalizedContent(serialDir / name) != normalizedContent(parallelDir / name):
+            differences.append(f"content differs: {name}")
+    return differences
+
+@click.command()
+@click.argument("board", type=click.Path(dir_okay=False, exists=True))
+@click.option("--jobs", "-j", type=int, default=4, help="Number of parallel jobs")
+@click.option("--repeat", "-r", type=int, default=3, help="Number of measurements")
+@click.option("--locale", "locale", type=str, default=None,
+    help="Run under given locale, e.g., cs_CZ.UTF-8 to check decimal comma")
+def run(board, jobs, repeat, locale):
+    """
+    Compare serial and parallel gerber plotting of BOARD. Report the timings
+    and check that both produce the same files (except for dates).
+    """
+    if locale is not None:
+        # Set before importing pcbnew; the worker processes inherit it
+        os.environ["LC_ALL"] = locale
+        os.environ["LANG"] = locale
+    from pcbnew import LoadBoard
+    from prusaman.export import makeGerbers
+    from prusaman.manugenerator.common import collectStandardLayers
+    from prusaman.pcbnew_common import fakeKiCADGui
+
+    # Plot in the same environment as prusaman make does
+    app = fakeKiCADGui()
+    board = LoadBoard(str(Path(board).resolve()))
+    with tempfile.TemporaryDirectory() as tmp:
+        timings = {}
+        for name, j in [("serial", 1), ("parallel", jobs)]:
+            timings[name] = []
+            for i in range(repeat):
+                outdir = Path(tmp) / f"{name}-{i}"
+                start = time.perf_counter()
+                makeGerbers(board, outdir, collectStandardLayers, jobs=j)
+                timings[name].append(time.perf_counter() - start)
+            click.echo(f"{name:>8}: best {min(timings[name]):.2f} s, " +
+                       f"mean {sum(timings[name]) / repeat:.2f} s")
+        click.echo(f" speedup: {min(timings['serial']) / min(timings['parallel']):.2f}x")
+
+        differences = compareOutputs(Path(tmp) / "serial-0", Path(tmp) / "parallel-0")
+        for d in differences:
+            click.echo(f"Difference - {d}", err=True)
+        if len(differences) > 0:
+            raise click.ClickException("Serial and parallel outputs differ")
+        click.echo("Outputs are identical")
+
+if __name__ == "__main__":
+    run()
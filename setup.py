@@ -41,7 +41,6 @@ setuptools.setup(
         "kikit",
         "click>=7.1",
         "ruamel.yaml==0.17.*",
-        "python-tsp==0.2.*",
         "keyring==23.6.0"
     ],
     setup_requires=[
@@ -0,0 +1,33 @@
+#!/usr/bin/env bats
+
+load common
+
+# Prusaman is invoked repeatedly by CI wrapper scripts for introspection, so
+# the CLI must not import pcbnew, KiKit and the like unless a command needs
+# them. The budget (in seconds) can be overridden for slow machines.
+STARTUP_BUDGET=${STARTUP_BUDGET:-1.0}
+
+@test "Help fits into the startup budget" {
+    start=$(date +%s.%N)
+    prusaman --help
+    end=$(date +%s.%N)
+    python3 -c "import sys; sys.exit(0 if $end - $start < $STARTUP_BUDGET else 1)"
+}
+
+@test "Version fits into the startup budget" {
+    start=$(date +%s.%N)
+    prusaman --version
+    end=$(date +%s.%N)
+    python3 -c "import sys; sys.exit(0 if $end - $start < $STARTUP_BUDGET else 1)"
+}
+
+@test "CLI does not import heavy modules" {
+    python3 -c "
+import sys
+from prusaman.ui import cli
+heavy = [m for m in ['pcbnew', 'wx', 'kikit', 'shapely', 'keyring']
+         if m in sys.modules]
+print(heavy)
+sys.exit(len(heavy))
+"
+}
@@ -0,0 +1,66 @@
+import zipfile
+
+import pytest
+
+from prusaman import archive
+from prusaman.archive import ArchiveError, writeArchive
+
+
+def makeFiles(tmp_path, count=5):
+    files = []
+    for i in range(count):
+        path = tmp_path / f"file{i}.txt"
+        path.write_bytes((f"line {i}\n" * (1000 * i + 1)).encode("utf-8"))
+        files.append((path, f"dir/file{i}.txt"))
+    nested = tmp_path / "nested.zip"
+    nested.write_bytes(b"PK fake nested archive")
+    files.append((nested, "nested.zip"))
+    return files
+
+def checkRoundTrip(archivePath, files):
+    with zipfile.ZipFile(archivePath) as z:
+        assert z.testzip() is None
+        assert z.namelist() == [name for _, name in files]
+        for path, name in files:
+            assert z.read(name) == path.read_bytes()
+
+@pytest.mark.parametrize("level", [0, 1, 6, 9])
+def test_roundTrip(tmp_path, level):
+    files = makeFiles(tmp_path)
+    writeArchive(tmp_path / "out.zip", files, level, workers=3)
+    checkRoundTrip(tmp_path / "out.zip", files)
+
+def test_compressedMembersAreStored(tmp_path):
+    files = makeFiles(tmp_path)
+    writeArchive(tmp_path / "out.zip", files, 6)
+    with zipfile.ZipFile(tmp_path / "out.zip") as z:
+        assert z.getinfo("nested.zip").compress_type == zipfile.ZIP_STORED
+        assert z.getinfo("dir/file3.txt").compress_type == zipfile.ZIP_DEFLATED
+
+def test_unicodeNames(tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_text("příliš žluťoučký kůň", encoding="utf-8")
+    files = [(path, "výstup/a.txt")]
+    writeArchive(tmp_path / "out.zip", files)
+    checkRoundTrip(tmp_path / "out.zip", files)
+
+def test_zip64(tmp_path, monkeypatch):
+    # Force the ZIP64 records without writing gigabytes of data
+    monkeypatch.setattr(archive, "_ZIP64_LIMIT", 100)
+    monkeypatch.setattr(archive, "_ZIP64_ENTRIES_LIMIT", 3)
+    files = makeFiles(tmp_path)
+    writeArchive(tmp_path / "out.zip", files, 6)
+    checkRoundTrip(tmp_path / "out.zip", files)
+    with open(tmp_path / "out.zip", "rb") as f:
+        assert b"PK\006\006" in f.read()
+
+def test_replacesExisting(tmp_path):
+    files = makeFiles(tmp_path, 2)
+    (tmp_path / "out.zip").write_bytes(b"garbage")
+    writeArchive(tmp_path / "out.zip", files)
+    checkRoundTrip(tmp_path / "out.zip", files)
+    assert not (tmp_path / "out.zip.tmp").exists()
+
+def test_invalidLevel(tmp_path):
+    with pytest.raises(ArchiveError):
+        writeArchive(tmp_path / "out.zip", [], 10)
@@ -0,0 +1,85 @@
+import os
+
+from prusaman.cache import BuildCache, Fingerprint
+
+
+def makeFiles(path, sizes):
+    path.mkdir(parents=True, exist_ok=True)
+    files = []
+    for i, size in enumerate(sizes):
+        f = path / f"file{i}.bin"
+        f.write_bytes(b"x" * size)
+        files.append(f)
+    return files
+
+def key(name):
+    return Fingerprint().addText("name", name).hexdigest()
+
+def storeAt(cache, tmp_path, name, size, mtime):
+    source = tmp_path / "source" / name
+    cache.store(key(name), source, makeFiles(source, [size]), [])
+    # The modification time of the metadata tracks the last use
+    meta = tmp_path / "cache" / key(name)[:2] / key(name) / "meta.json"
+    os.utime(meta, (mtime, mtime))
+
+def stored(cache):
+    return {name for name in ["a", "b", "c", "d"] if cache.lookup(key(name)) is not None}
+
+
+def test_storeAndRestore(tmp_path):
+    cache = BuildCache(tmp_path / "cache")
+    source = tmp_path / "source"
+    files = makeFiles(source / "sub", [10, 20])
+    cache.store(key("a"), source, files, [("info", "TAG", "message")])
+    entry = cache.lookup(key("a"))
+    assert entry is not None
+    assert entry.log == [("info", "TAG", "message")]
+    entry.restore(tmp_path / "target")
+    assert (tmp_path / "target" / "sub" / "file1.bin").read_bytes() == b"x" * 20
+    assert cache.lookup(key("b")) is None
+    assert not any((tmp_path / "cache" / "tmp").iterdir())
+
+def test_evictLeastRecentlyUsed(tmp_path):
+    cache = BuildCache(tmp_path / "cache", sizeLimit=250)
+    storeAt(cache, tmp_path, "a", 100, 1000)
+    storeAt(cache, tmp_path, "b", 100, 2000)
+    assert stored(cache) == {"a", "b"}
+    # The lookup above made both entries recent, make "b" the oldest one
+    os.utime(tmp_path / "cache" / key("b")[:2] / key("b") / "meta.json", (500, 500))
+    storeAt(cache, tmp_path, "c", 100, 3000)
+    assert stored(cache) == {"a", "c"}
+
+def test_evictUntilFits(tmp_path):
+    cache = BuildCache(tmp_path / "cache", sizeLimit=1000)
+    for i, name in enumerate(["a", "b", "c"]):
+        storeAt(cache, tmp_path, name, 300, 1000 * (i + 1))
+    storeAt(cache, tmp_path, "d", 700, 4000)
+    # The new entry is stored with the current time, so it is the most recent
+    assert stored(cache) == {"c", "d"}
+
+def test_entryOverLimitIsEvicted(tmp_path):
+    cache = BuildCache(tmp_path / "cache", sizeLimit=50)
+    source = tmp_path / "source"
+    cache.store(key("a"), source, makeFiles(source, [100]), [])
+    assert cache.lookup(key("a")) is None
+
+def test_fingerprintNamesInputs():
+    assert Fingerprint().addText("a", "x").addText("b", "y").hexdigest() != \
+           Fingerprint().addText("a", "y").addText("b", "x").hexdigest()
+    assert Fingerprint().addText("a", "xy").hexdigest() != \
+           Fingerprint().addText("a", "x").addText("", "y").hexdigest()
+
+def test_fingerprintNamesFilesByProjectPath(tmp_path):
+    def project(name):
+        root = tmp_path / name
+        for f in ["a/panel.py", "b/panel.py"]:
+            (root / f).parent.mkdir(parents=True, exist_ok=True)
+            (root / f).write_text("content")
+        return root
+    first, second = project("first"), project("second")
+    # The same files with the same name in different directories differ
+    assert Fingerprint(first).addFile(first / "a" / "panel.py").hexdigest() != \
+           Fingerprint(first).addFile(first / "b" / "panel.py").hexdigest()
+    # A moved project keeps its fingerprint
+    assert Fingerprint(first).addFile(first / "a" / "panel.py").hexdigest() == \
+           Fingerprint(second).addFile(second / "a" / "panel.py").hexdigest()
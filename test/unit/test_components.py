@@ -0,0 +1,114 @@
+import pickle
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("kikit.eeschema_v6")
+
+from kikit.eeschema_v6 import Symbol, extractComponents, getReference
+
+from prusaman.bom import PnBFilter
+import prusaman.components
+from prusaman.components import ComponentModel
+from prusaman.schema import Schema
+
+EXAMPLE = Path(__file__).parents[2] / "doc" / "examples" / "simple_pnb" / "simple_pnb.kicad_sch"
+
+
+def symbol(path, **properties):
+    return Symbol(path=path, unit=1, properties=properties)
+
+def model(*symbols):
+    m = ComponentModel(schema=Schema("A4", {}), symbols=list(symbols), sheetFiles=[])
+    m._index(PnBFilter())
+    return m
+
+def test_fieldLookupIsCaseInsensitive():
+    r1 = symbol("/1", Reference="R1", Value="330R", PnB="#")
+    m = model(r1)
+    for name in ["PnB", "PNB", "pnb"]:
+        assert m.field(r1, name) == "#"
+    assert m.field(r1, "value") == "330R"
+    assert m.field(r1, "missing") is None
+
+def test_fieldLookupBySymbol():
+    # Symbols with equal properties are told apart by their path
+    a = symbol("/1", Reference="R1", Value="1k")
+    b = symbol("/2", Reference="R2", Value="2k")
+    m = model(a, b)
+    assert m.field(a, "Value") == "1k"
+    assert m.field(b, "Value") == "2k"
+
+def test_annotation():
+    m = model(symbol("/1", Reference="R?"), symbol("/2", Reference="R?"),
+              symbol("/3", Reference="RX"), symbol("/4", Reference="R1"))
+    assert m.unannotated == {"R?": 2}
+    assert m.invalidAnnotation == ["RX"]
+    assert not m.isAnnotated
+
+def test_fromFile():
+    m = ComponentModel.fromFile(EXAMPLE, PnBFilter())
+    assert m.sheetFiles == [EXAMPLE]
+    assert m.schema.titleBlock["rev"] == "10"
+    assert m.isAnnotated
+    assert sorted(getReference(s) for s in m.assembly) == ["D1", "R1"]
+    assert sorted(getReference(s) for s in m.sourcing) == ["D1", "F1", "R1"]
+    j1 = next(s for s in m.symbols if getReference(s) == "J1")
+    assert m.field(j1, "PnB") == "DNF"
+
+def test_picklable():
+    m = pickle.loads(pickle.dumps(ComponentModel.fromFile(EXAMPLE, PnBFilter())))
+    f1 = next(s for s in m.symbols if getReference(s) == "F1")
+    assert m.field(f1, "pnb") == "#"
+
+ROOT_SHEET = """(kicad_sch (version 20230121) (generator eeschema)
+  (uuid "root")
+  (paper "A4")
+  (title_block (rev "3"))
+  (symbol (lib_id "Device:R") (at 0 0 0) (unit 1) (in_bom yes) (on_board yes)
+    (uuid "r")
+    (property "Reference" "R?" (at 0 0 0))
+    (property "Value" "1k" (at 0 0 0))
+    (instances (project "p" (path "/root" (reference "R1") (unit 1)))))
+  (sheet (at 0 0) (size 10 10) (uuid "s1")
+    (property "Sheetname" "A" (at 0 0 0))
+    (property "Sheetfile" "sub.kicad_sch" (at 0 0 0)))
+  (sheet (at 20 0) (size 10 10) (uuid "s2")
+    (property "Sheetname" "B" (at 0 0 0))
+    (property "Sheetfile" "sub.kicad_sch" (at 0 0 0)))
+)
+"""
+
+SUB_SHEET = """(kicad_sch (version 20230121) (generator eeschema)
+  (uuid "sub")
+  (symbol (lib_id "Device:C") (at 0 0 0) (unit 1) (in_bom yes) (on_board yes)
+    (uuid "c")
+    (property "Reference" "C?" (at 0 0 0))
+    (property "Value" "100n" (at 0 0 0))
+    (property "PnB" "dnf" (at 0 0 0))
+    (instances (project "p"
+      (path "/root/s1" (reference "C1") (unit 1))
+      (path "/root/s2" (reference "C2") (unit 1)))))
+)
+"""
+
+def test_hierarchyParsedOnce(tmp_path, monkeypatch):
+    (tmp_path / "root.kicad_sch").write_text(ROOT_SHEET)
+    (tmp_path / "sub.kicad_sch").write_text(SUB_SHEET)
+    parsed = []
+    parse = prusaman.components.parseSexprF
+    def countingParse(f):
+        parsed.append(f.name)
+        return parse(f)
+    monkeypatch.setattr(prusaman.components, "parseSexprF", countingParse)
+
+    m = ComponentModel.fromFile(tmp_path / "root.kicad_sch", PnBFilter())
+    assert len(parsed) == 2
+    assert m.sheetFiles == [tmp_path / "root.kicad_sch", tmp_path / "sub.kicad_sch"]
+    assert m.schema.titleBlock["rev"] == "3"
+    # The same components as KiKit extracts
+    expected = extractComponents(str(tmp_path / "root.kicad_sch"))
+    assert [(s.path, s.unit, s.properties) for s in m.symbols] == \
+           [(s.path, s.unit, s.properties) for s in expected]
+    assert [getReference(s) for s in m.symbols] == ["R1", "C1", "C2"]
+    assert [getReference(s) for s in m.assembly] == ["R1"]
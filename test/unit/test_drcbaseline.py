@@ -0,0 +1,76 @@
+import pytest
+
+pcbnew = pytest.importorskip("pcbnew")
+pytest.importorskip("kikit")
+
+from kikit.drc import DrcReport, Violation
+
+from prusaman.drcbaseline import BASELINE_TOLERANCE, DrcBaseline
+
+
+class FakeItem:
+    def __init__(self, x, y):
+        self.x, self.y = x, y
+
+    def GetPosition(self):
+        return (self.x, self.y)
+
+def violation(type, *positions, severity="error", description=""):
+    return Violation(type, description, "rule", severity,
+                     [FakeItem(x, y) for x, y in positions])
+
+T = BASELINE_TOLERANCE
+# A position just below a grid cell boundary
+EDGE = 10 * T - 1
+
+@pytest.fixture
+def baseline():
+    return DrcBaseline.fromViolations([
+        violation("clearance", (EDGE, EDGE), (EDGE + 5 * T, EDGE)),
+        violation("copper_sliver", description="Copper sliver")
+    ])
+
+@pytest.mark.parametrize("dx, dy", [(0, 0), (2, 2), (T, 0), (0, T), (T, T),
+                                    (-T, -T), (T, -T)])
+def test_matchWithinTolerance(baseline, dx, dy):
+    # The shifted positions lie in the neighbouring grid cells
+    v = violation("clearance", (EDGE + dx, EDGE + dy), (EDGE + 5 * T + dx, EDGE + dy))
+    assert baseline.matches(v)
+
+@pytest.mark.parametrize("dx, dy", [(T + 1, 0), (0, -T - 1), (2 * T, 2 * T)])
+def test_noMatchBeyondTolerance(baseline, dx, dy):
+    v = violation("clearance", (EDGE + dx, EDGE + dy), (EDGE + 5 * T + dx, EDGE + dy))
+    assert not baseline.matches(v)
+
+def test_allPositionsHaveToMatch(baseline):
+    assert not baseline.matches(violation("clearance", (EDGE, EDGE), (EDGE + 7 * T, EDGE)))
+    assert not baseline.matches(violation("clearance", (EDGE, EDGE)))
+
+def test_typeAndSeverityHaveToMatch(baseline):
+    positions = [(EDGE, EDGE), (EDGE + 5 * T, EDGE)]
+    assert not baseline.matches(violation("track_width", *positions))
+    assert not baseline.matches(violation("clearance", *positions, severity="warning"))
+
+def test_matchWithoutObjects(baseline):
+    assert baseline.matches(violation("copper_sliver", description="Copper sliver"))
+    assert not baseline.matches(violation("copper_sliver", description="Other sliver"))
+
+def test_prune(baseline):
+    known = violation("clearance", (EDGE + T, EDGE), (EDGE + 6 * T, EDGE))
+    unknown = violation("clearance", (0, 0), (5 * T, 0))
+    report = DrcReport(drc=[known, unknown], unconnected=[], footprint=[])
+    assert baseline.prune(report) == 1
+    assert report.drc == [unknown]
+
+def test_saveAndLoad(baseline, tmp_path):
+    path = tmp_path / "drc-baseline.json"
+    baseline.save(path)
+    loaded = DrcBaseline.load(path)
+    assert len(loaded) == len(baseline)
+    assert loaded.matches(violation("clearance", (EDGE + T, EDGE), (EDGE + 6 * T, EDGE)))
+
+def test_loadInvalid(tmp_path):
+    path = tmp_path / "drc-baseline.json"
+    path.write_text('{"version": 0, "violations": []}')
+    with pytest.raises(RuntimeError):
+        DrcBaseline.load(path)
@@ -0,0 +1,72 @@
+import pytest
+
+pytest.importorskip("pcbnew")
+
+from prusaman.export import _mergeJobFiles
+
+# Formatted the way KiCAD writes it; in particular, not the way json.dump does
+JOB_FILE = """{
+  "Header": {
+    "GenerationSoftware": {
+      "Vendor": "KiCad",
+      "Application": "Pcbnew",
+      "Version": "6.0.11"
+    },
+    "CreationDate": "2023-01-01T00:00:00+01:00"
+  },
+  "GeneralSpecs": {
+    "ProjectId": {
+      "Name": "board \\u00e9",
+      "GUID": "626f6172-642e-46b6-9963-61645f706362",
+      "Revision": "rev ±"
+    },
+    "Size": {
+      "X": 100.0,
+      "Y": 80.0
+    },
+    "LayerNumber": 2,
+    "BoardThickness": 1.6000
+  },
+  "FilesAttributes": [%s
+  ],
+  "MaterialStackup": [
+    {
+      "Type": "Copper",
+      "Name": "F.Cu"
+    }
+  ]
+}
+"""
+
+def jobFile(names):
+    entries = [f"""
+    {{
+      "Path": "{n}",
+      "FileFunction": "Copper,L1,Top",
+      "FilePolarity": "Positive"
+    }}""" for n in names]
+    return JOB_FILE % ",".join(entries)
+
+LAYERS = [f"board-{i}.gbr" for i in range(5)]
+
+@pytest.mark.parametrize("jobs", [1, 2, 3, 5])
+def test_mergeIsIdenticalToSerial(tmp_path, jobs):
+    parts = []
+    for i in range(jobs):
+        part = tmp_path / f"shard{i}.gbrjob"
+        part.write_bytes(jobFile(LAYERS[i::jobs]).encode("utf-8"))
+        parts.append(part)
+    target = tmp_path / "board-job.gbrjob"
+    _mergeJobFiles(parts, target, len(LAYERS))
+    assert target.read_bytes() == jobFile(LAYERS).encode("utf-8")
+
+def test_mergeUnknownLayout(tmp_path):
+    parts = []
+    for i, names in enumerate([["a", "b"], ["c"]]):
+        part = tmp_path / f"shard{i}.gbrjob"
+        part.write_text(jobFile(names), encoding="utf-8")
+        parts.append(part)
+    target = tmp_path / "board-job.gbrjob"
+    # The count does not match, the shards are concatenated
+    _mergeJobFiles(parts, target, 4)
+    assert target.read_text(encoding="utf-8") == jobFile(["a", "b", "c"])
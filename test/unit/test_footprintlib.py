@@ -0,0 +1,296 @@
+import http.server
+import io
+import json
+import os
+import threading
+import zipfile
+
+import pytest
+
+pytest.importorskip("pcbnew")
+
+from kikit.sexpr import parseSexprS
+
+from prusaman.footprintlib import PrusaFootprints, astHash, gitBlobHash
+
+
+def footprint(revision):
+    return f'(footprint "x"\n  (fp_text user "PRUSA_REVISION: {revision}" (at 0 0))\n)'.encode("utf-8")
+
+class FakeGitHub(http.server.ThreadingHTTPServer):
+    """
+    A local stand-in for the parts of the GitHub API used by the library
+    """
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeGitHubHandler)
+        self.revision = "r1"
+        self.truncated = False
+        self.files = {
+            "prusa-footprints/a.pretty/x.kicad_mod": footprint("a-2022-01-01"),
+            "prusa-footprints/a.pretty/y.kicad_mod": b'(footprint "y")',
+            "README.md": b"readme"
+        }
+        self.requests = []
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def requestKinds(self):
+        return [r.split("/")[4] for r in self.requests]
+
+class FakeGitHubHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.path)
+        parts = self.path.split("?")[0].split("/")
+        kind = parts[4]
+        headers = {}
+        if kind == "commits":
+            etag = f'"{server.revision}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = server.revision.encode("utf-8")
+            headers["ETag"] = etag
+        elif kind == "zipball":
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as z:
+                for path, content in server.files.items():
+                    z.writestr(f"prusa3d-lib-{server.revision}/{path}", content)
+            body = buffer.getvalue()
+        elif kind == "git" and parts[5] == "trees":
+            body = json.dumps({
+                "truncated": server.truncated,
+                "tree": [{"path": p, "type": "blob", "sha": gitBlobHash(c)}
+                         for p, c in server.files.items()]
+            }).encode("utf-8")
+        elif kind == "git" and parts[5] == "blobs":
+            body = next(c for c in server.files.values() if gitBlobHash(c) == parts[6])
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+@pytest.fixture
+def github():
+    server = FakeGitHub()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def library(github, path, ttl=0):
+    return PrusaFootprints("token", repo="prusa3d/lib", path=path,
+                           apiUrl=github.url, revisionTtl=ttl)
+
+def packContent(path):
+    with zipfile.ZipFile(path / "lib.zip") as z:
+        return {name.split("/", 1)[1]: z.read(name) for name in z.namelist()}
+
+
+def test_revisionTtlHit(github, tmp_path):
+    lib = library(github, tmp_path, ttl=3600)
+    assert lib.getRemoteRevision() == "r1"
+    github.revision = "r2"
+    # Within the TTL the server is not contacted, not even by a new instance
+    assert library(github, tmp_path, ttl=3600).getRemoteRevision() == "r1"
+    assert github.requestKinds() == ["commits"]
+
+def test_revisionRevalidation(github, tmp_path):
+    lib = library(github, tmp_path)
+    assert lib.getRemoteRevision() == "r1"
+    assert lib.getRemoteRevision() == "r1"
+    github.revision = "r2"
+    assert lib.getRemoteRevision() == "r2"
+    assert len(github.requests) == 3
+    cache = json.loads((tmp_path / "remote-revision.json").read_text())
+    assert cache["revision"] == "r2" and cache["etag"] == '"r2"'
+
+def test_revisionNotModified(github, tmp_path, monkeypatch):
+    lib = library(github, tmp_path)
+    lib.getRemoteRevision()
+    seen = []
+    handle = FakeGitHubHandler.do_GET
+    def recordingHandle(self):
+        seen.append(self.headers.get("If-None-Match"))
+        handle(self)
+    monkeypatch.setattr(FakeGitHubHandler, "do_GET", recordingHandle)
+    assert lib.getRemoteRevision() == "r1"
+    assert seen == ['"r1"']
+
+def test_fullUpdate(github, tmp_path):
+    lib = library(github, tmp_path)
+    lib.updateFromRemote()
+    assert lib.getLocalRevision() == "r1"
+    assert "zipball" in github.requestKinds()
+    assert packContent(tmp_path) == github.files
+    assert lib.getLocalManifest() == {p: gitBlobHash(c) for p, c in github.files.items()}
+    assert lib.getRevisionIndex() == {"a:x": "a-2022-01-01", "a:y": None}
+    assert not any(p.name.endswith(".tmp") for p in tmp_path.iterdir())
+
+def test_incrementalUpdate(github, tmp_path):
+    lib = library(github, tmp_path)
+    lib.updateFromRemote()
+    with zipfile.ZipFile(tmp_path / "lib.zip") as z:
+        unchangedBefore = z.getinfo("prusa3d-lib-r1/prusa-footprints/a.pretty/y.kicad_mod")
+
+    github.revision = "r2"
+    github.files["prusa-footprints/a.pretty/x.kicad_mod"] = footprint("a-2023-01-01")
+    github.files["prusa-footprints/b.pretty/z.kicad_mod"] = footprint("b-2023-01-01")
+    del github.files["README.md"]
+    github.requests.clear()
+    lib.updateFromRemote()
+
+    assert lib.getLocalRevision() == "r2"
+    kinds = github.requestKinds()
+    assert "zipball" not in kinds
+    # Only the changed files are downloaded
+    assert kinds.count("git") == 3
+    assert packContent(tmp_path) == github.files
+    assert lib.getRevisionIndex() == {"a:x": "a-2023-01-01", "a:y": None,
+                                      "b:z": "b-2023-01-01"}
+    with zipfile.ZipFile(tmp_path / "lib.zip") as z:
+        assert z.testzip() is None
+        # The unchanged member is copied as it is
+        unchanged = z.getinfo("prusa3d-lib-r1/prusa-footprints/a.pretty/y.kicad_mod")
+        assert unchanged.CRC == unchangedBefore.CRC
+        assert unchanged.compress_size == unchangedBefore.compress_size
+    assert not any(p.name.endswith(".tmp") for p in tmp_path.iterdir())
+
+def test_truncatedTreeFallsBackToZipball(github, tmp_path):
+    lib = library(github, tmp_path)
+    lib.updateFromRemote()
+    github.revision = "r2"
+    github.truncated = True
+    github.files["prusa-footprints/a.pretty/y.kicad_mod"] = b'(footprint "y2")'
+    github.requests.clear()
+    lib.updateFromRemote()
+    assert lib.getLocalRevision() == "r2"
+    assert "zipball" in github.requestKinds()
+    assert packContent(tmp_path) == github.files
+    assert lib.getLocalManifest() == {p: gitBlobHash(c) for p, c in github.files.items()}
+
+def test_upToDateLibraryIsNotDownloaded(github, tmp_path):
+    library(github, tmp_path).updateFromRemote()
+    github.requests.clear()
+    # Another instance (e.g., in a different process) finds it up to date
+    library(github, tmp_path).updateFromRemote()
+    assert github.requestKinds() == ["commits"]
+
+def test_concurrentUpdates(github, tmp_path):
+    libs = [library(github, tmp_path) for _ in range(4)]
+    threads = [threading.Thread(target=lib.updateFromRemote) for lib in libs]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert github.requestKinds().count("zipball") == 1
+    assert packContent(tmp_path) == github.files
+    assert all(lib.getLocalRevision() == "r1" for lib in libs)
+
+def test_revisionIndexForms(github, tmp_path):
+    github.files = {
+        "prusa-footprints/a.pretty/quoted.kicad_mod": footprint("a-2022-01-01"),
+        "prusa-footprints/a.pretty/bare.kicad_mod":
+            b'(footprint "bare"\n  (fp_text user PRUSA_REVISION:b-2022-01-01 (at 0 0))\n)',
+        "prusa-footprints/a.pretty/none.kicad_mod":
+            b'(footprint "none"\n  (fp_text user "other" (at 0 0))\n)'
+    }
+    lib = library(github, tmp_path)
+    lib.updateFromRemote()
+    # The same revisions as extractRevision gives for loaded footprints
+    assert lib.getRevisionIndex() == {
+        "a:bare": "PRUSA_REVISION:b-2022-01-01",
+        "a:none": None,
+        "a:quoted": "a-2022-01-01"
+    }
+
+
+FOOTPRINT = """(footprint "name" (layer "F.Cu") (tedit 5F0C7B4B)
+  (at 10 20)
+  (fp_text reference "R1" (at 0 0) (layer "F.SilkS"))
+  (fp_text user "PRUSA_REVISION: a" (at 0 1) (layer "F.Fab"){hide}
+    (effects (font (size 1 1))))
+  (fp_poly (pts {pts}) (layer "F.SilkS") (width 0.1) (tstamp {tstamp}))
+  (pad "1" smd rect (at -1 0) (size 1 1) (layers "F.Cu" "F.Paste"))
+  (pad "2" smd rect (at 1 0) (size 1 1) (layers "F.Cu" "F.Paste"))
+  (model "a.wrl"{hide} (offset (xyz 0 0 0)))
+)"""
+
+SQUARE = "(xy 0 0) (xy 1 0) (xy 1 1) (xy 0 1)"
+
+def footprintAst(pts=SQUARE, hide="", tstamp="1", swapPads=False):
+    text = FOOTPRINT.format(pts=pts, hide=hide, tstamp=tstamp)
+    if swapPads:
+        lines = text.split("\n")
+        lines[6], lines[7] = lines[7], lines[6]
+        text = "\n".join(lines)
+    return parseSexprS(text)
+
+def test_astHashIgnoresIrrelevantData():
+    h = astHash(footprintAst())
+    assert astHash(footprintAst(tstamp="2")) == h
+    assert astHash(footprintAst(hide=" hide")) == h
+    # The order of the top-level items does not matter
+    assert astHash(footprintAst(swapPads=True)) == h
+
+def test_astHashKeepsVertexOrder():
+    # The same vertices in a different order form a different polygon
+    crossed = "(xy 0 0) (xy 1 1) (xy 1 0) (xy 0 1)"
+    assert astHash(footprintAst(pts=crossed)) != astHash(footprintAst())
+
+def test_readersSeeCompletePacks(github, tmp_path):
+    lib = library(github, tmp_path)
+    lib.updateFromRemote()
+    contents = [dict(github.files)]
+    stop = threading.Event()
+    seen = []
+    def read():
+        while not stop.is_set():
+            seen.append(packContent(tmp_path))
+    reader = threading.Thread(target=read)
+    reader.start()
+    try:
+        for i in range(2, 12):
+            github.revision = f"r{i}"
+            github.files["prusa-footprints/a.pretty/x.kicad_mod"] = footprint(f"a-{i}")
+            contents.append(dict(github.files))
+            lib.updateFromRemote()
+    finally:
+        stop.set()
+        reader.join()
+    assert len(seen) > 0
+    assert all(s in contents for s in seen)
+
+def test_interruptedInstallIsRedone(github, tmp_path, monkeypatch):
+    lib = library(github, tmp_path)
+    lib.updateFromRemote()
+    github.revision = "r2"
+    github.files["prusa-footprints/a.pretty/x.kicad_mod"] = footprint("a-2023-01-01")
+    replace = os.replace
+    def failingReplace(source, target):
+        if str(target).endswith("lib.zip"):
+            raise PermissionError("The pack is in use")
+        replace(source, target)
+    monkeypatch.setattr(os, "replace", failingReplace)
+    with pytest.raises(PermissionError):
+        lib.updateFromRemote()
+    monkeypatch.setattr(os, "replace", replace)
+    github.requests.clear()
+    # Without the manifest, the old pack cannot be trusted to be the base of an
+    # incremental update
+    lib.updateFromRemote()
+    assert "zipball" in github.requestKinds()
+    assert packContent(tmp_path) == github.files
+    assert lib.getRevisionIndex()["a:x"] == "a-2023-01-01"
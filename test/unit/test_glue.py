@@ -0,0 +1,84 @@
+import random
+
+from prusaman.glue import (_nearestNeighbourPath, optimizeGluePath, pathLength,
+                          planDispense)
+
+
+def randomPoints(count, seed=1):
+    rng = random.Random(seed)
+    return [(rng.randrange(0, 300_000_000), rng.randrange(0, 200_000_000))
+            for _ in range(count)]
+
+def test_trivialInputs():
+    assert optimizeGluePath([]).order == []
+    assert optimizeGluePath([(0, 0)]).order == [0]
+    assert sorted(optimizeGluePath([(0, 0), (5, 5)]).order) == [0, 1]
+
+def test_visitsAllPoints():
+    points = randomPoints(300)
+    path = optimizeGluePath(points)
+    assert sorted(path.order) == list(range(len(points)))
+    assert path.length == pathLength(points, path.order)
+    assert path.initialLength == pathLength(points, range(len(points)))
+
+def test_improvesNearestNeighbour():
+    points = randomPoints(300)
+    path = optimizeGluePath(points)
+    assert path.length <= pathLength(points, _nearestNeighbourPath(points))
+    assert path.length < path.initialLength
+
+def test_deterministic():
+    points = randomPoints(500)
+    assert optimizeGluePath(points, seed=3).order == optimizeGluePath(points, seed=3).order
+
+def test_line():
+    # Points on a line in a shuffled order; the optimal path is sorted
+    order = list(range(100))
+    random.Random(2).shuffle(order)
+    points = [(1000 * i, 0) for i in order]
+    path = optimizeGluePath(points)
+    assert path.length == 99 * 1000
+
+def test_duplicatePoints():
+    points = [(0, 0)] * 10 + [(100, 100)] * 10
+    path = optimizeGluePath(points)
+    assert sorted(path.order) == list(range(20))
+    assert path.length == pathLength(points, [0, 10])
+
+
+def planFor(points, kinds, switchPenalty):
+    return planDispense(points, kinds, dwell={"a": 0.5, "b": 1.0},
+                        travelSpeed=100_000_000, switchPenalty=switchPenalty)
+
+def interleaved(count=200):
+    points = randomPoints(count)
+    kinds = ["a" if i % 2 == 0 else "b" for i in range(count)]
+    return points, kinds
+
+def test_planVisitsAllStamps():
+    points, kinds = interleaved()
+    plan = planFor(points, kinds, 30)
+    assert sorted(plan.order) == list(range(len(points)))
+    assert plan.dwellTime == 100 * 0.5 + 100 * 1.0
+    assert plan.initialTravelLength == pathLength(points, range(len(points)))
+    assert plan.travelLength == pathLength(points, plan.order)
+    assert 0 < plan.travelReduction < 1
+
+def test_planGroupsWithExpensiveSwitch():
+    points, kinds = interleaved()
+    plan = planFor(points, kinds, 30)
+    assert plan.grouped
+    assert plan.switches == 1
+    assert plan.switchTime == 30
+
+def test_planMixesWithFreeSwitch():
+    points, kinds = interleaved()
+    plan = planFor(points, kinds, 0)
+    assert not plan.grouped
+    assert plan.cycleTime == plan.travelTime + plan.dwellTime
+
+def test_planSingleKind():
+    points = randomPoints(50)
+    plan = planFor(points, ["a"] * 50, 30)
+    assert plan.grouped
+    assert plan.switches == 0
@@ -0,0 +1,38 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+from prusaman.instrument import Instrumentation, _RssSampler
+
+pytestmark = pytest.mark.skipif(not _RssSampler.supported,
+                                reason="RSS sampling needs /proc")
+
+MB = 1024 ** 2
+
+def peaks(instrumentation):
+    return {m.name: m.peakRss for m in instrumentation.measurements}
+
+def test_peakRssIsPerOperation():
+    instrumentation = Instrumentation()
+    with instrumentation.measure("large"):
+        data = bytearray(300 * MB)
+        time.sleep(0.3)
+        del data
+    with instrumentation.measure("small"):
+        time.sleep(0.3)
+    result = peaks(instrumentation)
+    # The peak of the earlier operation does not leak into the later one
+    assert result["large"] - result["small"] > 200 * MB
+
+def test_peakRssIncludesChildren():
+    instrumentation = Instrumentation()
+    with instrumentation.measure("child"):
+        subprocess.run([sys.executable, "-c",
+            "import time; data = bytearray(300 * 1024 ** 2); time.sleep(0.5)"],
+            check=True)
+    with instrumentation.measure("self"):
+        time.sleep(0.3)
+    result = peaks(instrumentation)
+    assert result["child"] - result["self"] > 200 * MB
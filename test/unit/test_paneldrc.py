@@ -0,0 +1,187 @@
+import pytest
+
+pcbnew = pytest.importorskip("pcbnew")
+pytest.importorskip("kikit")
+
+from kikit.drc import DrcReport, Violation
+from shapely.geometry import Point, box
+
+from prusaman.footprints import FootprintTable
+from prusaman.paneldrc import (POSITION_TOLERANCE, BoardInstance, ClippedItems,
+                               findInstances, groupViolations,
+                               pruneClippingArtifacts)
+
+
+class FakeBox:
+    def __init__(self, x, y, w, h):
+        self.x, self.y, self.w, self.h = x, y, w, h
+
+    def GetX(self):
+        return self.x
+
+    def GetY(self):
+        return self.y
+
+    def GetWidth(self):
+        return self.w
+
+    def GetHeight(self):
+        return self.h
+
+# Coordinates in the tests are in tenths of millimeter
+UNIT = pcbnew.FromMM(0.1)
+
+class FakeItem:
+    """
+    A board item occupying a small square around its position
+    """
+    def __init__(self, x, y, size=10):
+        self.x, self.y, self.size = x * UNIT, y * UNIT, size * UNIT
+
+    def GetPosition(self):
+        return (self.x, self.y)
+
+    def GetBoundingBox(self):
+        return FakeBox(self.x - self.size, self.y - self.size, 2 * self.size, 2 * self.size)
+
+class FakeTrack(FakeItem, pcbnew.BOARD_CONNECTED_ITEM):
+    def __init__(self, x, y, net):
+        FakeItem.__init__(self, x, y)
+        self.net = net
+
+    def GetNetCode(self):
+        return self.net
+
+class FakeLocator:
+    """
+    Instances are 1000 units apart along the x axis
+    """
+    def relative(self, x, y):
+        return (x % (1000 * UNIT), y)
+
+def violation(type, *objects, description="", severity="error"):
+    return Violation(type, description, "rule", severity, list(objects))
+
+
+INTERIORS = box(100 * UNIT, 100 * UNIT, 900 * UNIT, 900 * UNIT)
+
+def prune(report, nets=()):
+    pruneClippingArtifacts(report, INTERIORS, ClippedItems(0, set(nets)))
+    return report
+
+def test_pruneArtifactsTouchingInteriors():
+    report = prune(DrcReport(
+        drc=[violation("track_dangling", FakeItem(95, 500)),
+             violation("track_dangling", FakeItem(50, 500))],
+        unconnected=[violation("unconnected_items", FakeItem(500, 500), FakeItem(950, 500))],
+        footprint=[]))
+    assert [v.objects[0].x for v in report.drc] == [50 * UNIT]
+    assert report.unconnected == []
+
+def test_pruneArtifactsOnRemovedNets():
+    # Pads in the band connected through a removed track
+    report = prune(DrcReport(
+        drc=[],
+        unconnected=[violation("unconnected_items", FakeTrack(50, 500, 3), FakeTrack(950, 500, 3)),
+                     violation("unconnected_items", FakeTrack(50, 50, 4), FakeTrack(950, 50, 4))],
+        footprint=[]), nets=[3])
+    assert [v.objects[0].net for v in report.unconnected] == [4]
+
+def test_pruneKeepsOtherViolations():
+    report = prune(DrcReport(
+        drc=[violation("clearance", FakeItem(500, 500), FakeItem(510, 500)),
+             violation("isolated_copper", FakeItem(2000, 2000))],
+        unconnected=[violation("unconnected_items", FakeItem(2000, 2000), FakeItem(2100, 2000))],
+        footprint=[violation("lib_footprint_mismatch", FakeItem(500, 500))]))
+    assert [v.type for v in report.drc] == ["clearance", "isolated_copper"]
+    assert len(report.unconnected) == 1
+    assert len(report.footprint) == 1
+
+
+def test_groupSameViolationInInstances():
+    violations = [violation("clearance", FakeItem(i * 1000 + 10, 20), FakeItem(i * 1000 + 30, 20))
+                  for i in range(4)]
+    groups = groupViolations(violations, FakeLocator())
+    assert len(groups) == 1
+    assert groups[0].count == 4
+    assert groups[0].first is violations[0]
+
+def test_groupWithoutLocator():
+    violations = [violation("clearance", FakeItem(i * 1000 + 10, 20)) for i in range(4)]
+    assert len(groupViolations(violations)) == 4
+
+def test_groupDistinguishesTypeAndPosition():
+    violations = [
+        violation("clearance", FakeItem(10, 20)),
+        violation("track_width", FakeItem(10, 20)),
+        violation("clearance", FakeItem(10, 21)),
+        violation("clearance", FakeItem(1010, 20))
+    ]
+    groups = groupViolations(violations, FakeLocator())
+    assert [g.count for g in groups] == [2, 1, 1]
+    assert [g.first for g in groups] == violations[:3]
+
+def test_groupViolationsWithoutObjects():
+    violations = [
+        violation("copper_sliver", description="Copper sliver"),
+        violation("copper_sliver", description="Copper sliver"),
+        violation("copper_sliver", description="Other sliver")
+    ]
+    assert [g.count for g in groupViolations(violations, FakeLocator())] == [2, 1]
+
+
+
+def table(footprints):
+    t = FootprintTable()
+    for ref, fpid, value, x, y, orientation in footprints:
+        t._append(None, ref, value, fpid, round(x), round(y), orientation, 0)
+    return t
+
+def sourceFootprints():
+    mm = pcbnew.FromMM(1)
+    fps = [(f"R{i}", "R_0603", "10k", (i % 20) * 2 * mm, (i // 20) * 2 * mm, 0)
+           for i in range(400)]
+    fps.append(("U1", "SOIC-8", "MCU", 5 * mm, 45 * mm, 900))
+    return fps
+
+def placed(fps, instance, suffix):
+    result = []
+    for ref, fpid, value, x, y, orientation in fps:
+        px, py = instance.transform(x, y)
+        result.append((ref + suffix, fpid, value, px, py,
+                       (orientation + instance.angle) % 3600))
+    return result
+
+def test_findInstances():
+    mm = pcbnew.FromMM(1)
+    fps = sourceFootprints()
+    placements = [BoardInstance(100 * mm, 0, 0), BoardInstance(200 * mm, 0, 0),
+                  BoardInstance(100 * mm, 200 * mm, 900)]
+    panelFps = [("FID1", "Fiducial", "F", 0, 0, 0)]
+    for i, p in enumerate(placements):
+        panelFps += placed(fps, p, f"-{i}")
+    # A partial copy of the board is not an instance
+    panelFps += placed(fps[300:], BoardInstance(300 * mm, 0, 0), "-x")
+
+    instances = findInstances(table(fps), table(panelFps))
+    assert [(round(i.dx), round(i.dy), i.angle) for i in instances] == \
+           [(round(p.dx), round(p.dy), p.angle) for p in placements]
+
+def test_findInstancesTolerance():
+    fps = sourceFootprints()
+    instance = BoardInstance(pcbnew.FromMM(100), 0, 0)
+    panelFps = placed(fps, instance, "")
+    # Shifted within the tolerance, possibly across a grid cell boundary
+    shift = POSITION_TOLERANCE // 2
+    panelFps = [(r, f, v, x + shift, y - shift, o) for r, f, v, x, y, o in panelFps]
+    assert len(findInstances(table(fps), table(panelFps))) == 1
+    panelFps[0] = (panelFps[0][0], *panelFps[0][1:3],
+                   panelFps[0][3] + 3 * POSITION_TOLERANCE, *panelFps[0][4:])
+    assert findInstances(table(fps), table(panelFps)) == []
+
+def test_transformGeometry():
+    instance = BoardInstance(1000, 2000, 450)
+    for x, y in [(0, 0), (10, 20), (-30, 5)]:
+        px, py = instance.transform(x, y)
+        q = instance.transformGeometry(Point(x, y))
+        assert abs(q.x - px) < 1e-6 and abs(q.y - py) < 1e-6